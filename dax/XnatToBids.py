@@ -13,6 +13,8 @@ import nibabel as nib
 from distutils.dir_util import copy_tree
 from xml.etree import cElementTree as ET
 
+from .XnatUtils import ProjectSnapshot
+
 
 def transform_to_bids(XNAT, DIRECTORY, project, BIDS_DIR, LOGGER):
     """
@@ -28,6 +30,8 @@ def transform_to_bids(XNAT, DIRECTORY, project, BIDS_DIR, LOGGER):
     LOGGER.info("INFO: Moving files to the BIDS folder...")
     # All the BIDS datattype
     data_type_l = ["anat", "func", "fmap", "dwi", "unknown_bids"]
+    # Scans of the project queried once for all the scan files
+    snapshot = ProjectSnapshot(XNAT, project)
     # Loop throught the XNAT folders
     for proj in os.listdir(DIRECTORY):
         if proj == project and os.path.isdir(os.path.join(DIRECTORY, proj)):
@@ -56,7 +60,7 @@ def transform_to_bids(XNAT, DIRECTORY, project, BIDS_DIR, LOGGER):
                                         nii_file = scan_file
                                         # Call the main BIDS function that is compatible with yaml
                                         bids_yaml(XNAT, project, scan_id, subj, res_dir, scan_file, uri, sess, nii_file,
-                                                  sess_idx, subj_idx)
+                                                  sess_idx, subj_idx, snapshot=snapshot)
                                         # Create the BIDS directory
                                         if not os.path.exists(os.path.join(BIDS_DIR, project)):
                                             os.makedirs(os.path.join(BIDS_DIR, project))
@@ -84,7 +88,8 @@ def transform_to_bids(XNAT, DIRECTORY, project, BIDS_DIR, LOGGER):
     dataset_description_file(BIDS_DIR, XNAT, project)
 
 
-def bids_yaml(XNAT, project, scan_id, subj, res_dir, scan_file, uri, sess, nii_file, sess_idx, subj_idx):
+def bids_yaml(XNAT, project, scan_id, subj, res_dir, scan_file, uri, sess, nii_file, sess_idx, subj_idx,
+              snapshot=None):
     """
     Main method to put the scans in the BIDS datatype folder, create json
     sidecar and remane filenames based on the BIDS format.
@@ -99,6 +104,7 @@ def bids_yaml(XNAT, project, scan_id, subj, res_dir, scan_file, uri, sess, nii_f
     :param nii_file: Scan file (for yaml it is $col1 in the INLIST )
     :param sess_idx: Session count number
     :param subj_idx: Subject count number
+    :param snapshot: ProjectSnapshot of the project to share the scans query
     """
     # Check if the json sidecar is present or not
     if scan_file.endswith('.nii.gz'):
@@ -110,8 +116,9 @@ def bids_yaml(XNAT, project, scan_id, subj, res_dir, scan_file, uri, sess, nii_f
             json_file = "empty.json"
 
     # Get the series_description and scan_type of the scan in XNAT
-    project_scans = XNAT.get_project_scans(project)
-    for x in project_scans:
+    if snapshot is None:
+        snapshot = ProjectSnapshot(XNAT, project)
+    for x in snapshot.get_session_scans(sess):
         if x['ID'] == scan_id and x['subject_label'] == subj:
             scan_type = x['type']
             series_description = x['series_description']
@@ -38,7 +38,9 @@ import fnmatch
 import getpass
 import glob
 import gzip
+import hashlib
 from lxml import etree
+from multiprocessing.pool import ThreadPool
 import nibabel as nib
 import numpy as np
 from pyxnat import Interface
@@ -47,15 +49,28 @@ import os
 import random
 import re
 import shutil
+import struct
 import subprocess
 import tempfile
+import threading
 import time
 import xlrd
 import xml.etree.cElementTree as ET
 import yaml
 import zipfile
+import zlib
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # backport of os.scandir for python 2
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 from . import utilities
+from .session_cache import get_session_cache, invalidate_session
+from .xnat_session_pool import get_session_pool
 from .task import (JOB_FAILED, JOB_RUNNING, JOB_PENDING, READY_TO_UPLOAD,
                    NEEDS_QA, RERUN, REPROC, FAILED_NEEDS_REPROC, BAD_QA_STATUS)
 from .errors import (XnatUtilsError, XnatAccessError,
@@ -72,8 +87,16 @@ except NameError:
 __copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
 __all__ = ["InterfaceTemp", "AssessorHandler", "SpiderProcessHandler",
            "CachedImageSession", "CachedImageScan", "CachedImageAssessor",
-           "CachedResource"]
+           "CachedResource", "ProjectSnapshot"]
 DAX_SETTINGS = DAX_Settings()
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+GZIP_CHUNK_SIZE = 1024 * 1024
+# Blocks of a file compressed at the same time by the threads of gzip_file
+GZIP_BLOCK_SIZE = 4 * 1024 * 1024
+# Compiled expressions kept by extract_exp, least recently used dropped first
+PATTERN_CACHE_SIZE = 512
+_PATTERN_CACHE = collections.OrderedDict()
+_PATTERN_CACHE_LOCK = threading.Lock()
 NS = {'xnat': 'http://nrg.wustl.edu/xnat',
       'proc': 'http://nrg.wustl.edu/proc',
       'fs': 'http://nrg.wustl.edu/fs',
@@ -110,10 +133,10 @@ SUBJECT_POST_URI = '''?columns=ID,project,label,URI,last_modified,src,\
 handedness,gender,yob,dob'''
 SESSION_POST_URI = '''?xsiType={stype}&columns=ID,URI,subject_label,subject_ID\
 ,modality,project,date,xsiType,{stype}/age,label,{stype}/meta/last_modified\
-,{stype}/original'''
+,{stype}/meta/insert_date,{stype}/original'''
 NO_MOD_SESSION_POST_URI = '''?xsiType={stype}&columns=ID,URI,subject_label,\
 subject_ID,project,date,xsiType,{stype}/age,label,{stype}/meta/last_modified,\
-{stype}/original'''
+{stype}/meta/insert_date,{stype}/original'''
 SCAN_POST_URI = '''?columns=ID,URI,label,subject_label,project,\
 xnat:imagesessiondata/scans/scan/id,\
 xnat:imagesessiondata/scans/scan/type,\
@@ -166,6 +189,10 @@ class InterfaceTemp(Interface):
      NOTE: This is deprecated in pyxnat 1.0.0.0
 
     Using netrc to get username password if not given.
+
+    The HTTP session and JSESSION are shared with the other InterfaceTemp
+    objects of the process for the same host and user (see
+    xnat_session_pool) when xnat_max_connections is set in the settings.
     """
 
 
@@ -210,6 +237,8 @@ class InterfaceTemp(Interface):
         if not os.path.exists(temp_dir):
             os.mkdir(temp_dir)
         self.temp_dir = temp_dir
+        self.session_pool = get_session_pool()
+        self.session_reused = False
         self.authenticate()
 
     def __enter__(self, xnat_host=None, xnat_user=None, xnat_pass=None,
@@ -228,12 +257,25 @@ class InterfaceTemp(Interface):
                                             password=self.pwd,
                                             cachedir=self.temp_dir)
 
+    def _connect(self, **kwargs):
+        """Set up the HTTP session, shared one if the pool is enabled."""
+        if self.session_pool is None:
+            return super(InterfaceTemp, self)._connect(**kwargs)
+
+        self._http, self.session_reused = self.session_pool.get_session(
+            self._server, self._user, self._pwd, verify=self._verify,
+            proxy_url=self._proxy_url)
+
     def disconnect(self):
         """Disconnect the JSESSION and blow away the cache.
 
+        A shared JSESSION stays open for the next interfaces, it is
+        disconnected when the process exits.
+
         :return: None
         """
-        self._exec('/data/JSESSION', method='DELETE')
+        if self.session_pool is None:
+            self._exec('/data/JSESSION', method='DELETE')
         if os.path.exists(self.temp_dir):
             shutil.rmtree(self.temp_dir)
 
@@ -241,11 +283,15 @@ class InterfaceTemp(Interface):
         """Authenticate to XNAT.
 
         Connect to XNAT and try to Disconnect the JSESSION before reconnecting.
+        With a shared session, reuse its JSESSION or log in once.
         Raise XnatAuthentificationError if it failes.
 
         :return: True or False
         """
         self.connect()
+        if self.session_pool is not None:
+            return self.login_shared_session()
+
         try:
             self._exec('/data/JSESSION', method='DELETE')
             # Reconnect the JSession for XNAT
@@ -255,6 +301,22 @@ class InterfaceTemp(Interface):
             print(e)
             raise XnatAuthentificationError(self.host, self.user)
 
+    def login_shared_session(self):
+        """Log in the shared session if it has no JSESSION yet.
+
+        :return: True
+        """
+        # /data entry point (XNAT >= 1.5), skip the pyxnat probing request
+        self._entry = '/data'
+        if not self._http.dax_jsession:
+            try:
+                self._http.dax_jsession = self._exec('/data/JSESSION')
+            except DatabaseError as e:
+                print(e)
+                raise XnatAuthentificationError(self.host, self.user)
+        self._jsession = 'JSESSIONID=' + self._http.dax_jsession
+        return True
+
     # TODO: string.format wants well-formed strings and will, for example, throw
     #a KeyError if any named variables in the format string are missing. Put
     #proper validation in place for these methods
@@ -340,19 +402,23 @@ class InterfaceTemp(Interface):
     def get_projects(self):
         return self._getjson(PROJECTS_URI)
 
-    def get_project_scans(self, project_id, include_shared=True):
+    def get_project_scans(self, project_id, include_shared=True,
+                          session_list=None):
         """
         List all the scans that you have access to based on passed project.
 
         :param intf: pyxnat.Interface object
         :param projectid: ID of a project on XNAT
         :param include_shared: include the shared data in this project
+        :param session_list: list of the project sessions from get_sessions.
+         Queried from XNAT if not given.
         :return: List of all the scans for the project
         """
         scans_dict = dict()
 
         # Get the sessions list to get the modality:
-        session_list = self.get_sessions(project_id)
+        if session_list is None:
+            session_list = self.get_sessions(project_id)
         sess_id2mod = dict((sess['session_id'], [sess['handedness'],
                                                  sess['gender'], sess['yob'], sess['age'],
                                                  sess['last_modified'], sess['last_updated']])
@@ -453,17 +519,20 @@ class InterfaceTemp(Interface):
 
         return sorted(list(scans_dict.values()), key=lambda k: k['session_label'])
 
-    def get_project_assessors(self, projectid):
+    def get_project_assessors(self, projectid, session_list=None):
         """
         List all the assessors that you have access to based on passed project.
 
         :param projectid: ID of a project on XNAT
+        :param session_list: list of the project sessions from get_sessions.
+         Queried from XNAT if not given.
         :return: List of all the assessors for the project
         """
         assessors_dict = dict()
 
         # Get the sessions list to get the different variables needed:
-        session_list = self.get_sessions(projectid)
+        if session_list is None:
+            session_list = self.get_sessions(projectid)
         sess_id2mod = dict((sess['session_id'], [sess['subject_label'],
                             sess['type'], sess['handedness'], sess['gender'],
                             sess['yob'], sess['age'], sess['last_modified'],
@@ -606,7 +675,7 @@ class InterfaceTemp(Interface):
     def get_resources(self, project_id):
         return self._getjson(P_RESOURCES_URI.format(project=project_id))
 
-    def get_sessions(self, projectid=None, subjectid=None):
+    def get_sessions(self, projectid=None, subjectid=None, subject_list=None):
         """
         List all the sessions either:
             1) that you have access to
@@ -616,6 +685,8 @@ class InterfaceTemp(Interface):
         :param intf: pyxnat.Interface object
         :param projectid: ID of a project on XNAT
         :param subjectid: ID/label of a subject
+        :param subject_list: list of the subjects from get_subjects.
+         Queried from XNAT if not given.
         :return: List of sessions
         """
         type_list = []
@@ -639,7 +710,9 @@ class InterfaceTemp(Interface):
                 type_list.append(sess_type)
 
         # Get the subjects list to get the subject ID:
-        subj_list = self.get_subjects(projectid)
+        if subject_list is None:
+            subject_list = self.get_subjects(projectid)
+        subj_list = subject_list
         subj_id2lab = dict((subj['ID'], [subj['handedness'], subj['gender'],
                                          subj['yob'], subj['dob']]) for subj in subj_list)
 
@@ -675,6 +748,8 @@ class InterfaceTemp(Interface):
                     sess['type'] = sess_type
                 last_modified_str = '%s/meta/last_modified' % sess_type
                 sess['last_modified'] = sess.get(last_modified_str, None)
+                sess['creation_timestamp'] = sess.get(
+                    '%s/meta/insert_date' % sess_type, None)
                 sess['last_updated'] = sess.get('%s/original' % sess_type, None)
                 sess['age'] = sess.get('%s/age' % sess_type, None)
                 try:
@@ -694,6 +769,73 @@ class InterfaceTemp(Interface):
         # Return list sorted by label
         return sorted(full_sess_list, key=lambda k: k['session_label'])
 
+    def get_modified_sessions(self, projectid, modified_since,
+                              is_modified=None, sessions_dates=None):
+        """
+        List the sessions of the subjects with a session modified since a date
+
+        Only the dates of the sessions are listed for the whole project (see
+         get_sessions_last_modified). The full sessions are then listed for
+         the subjects with a modified session.
+
+        :param projectid: ID of a project on XNAT
+        :param modified_since: last_modified string ("%Y-%m-%d %H:%M:%S"),
+         sessions modified at this date or after are selected
+        :param is_modified: function called with the dates of each session
+         modified since the date, returning False to ignore the change.
+         None to keep all.
+        :param sessions_dates: list from get_sessions_last_modified already
+         queried, None to query it
+        :return: list of the sessions of the modified subjects
+        """
+        if sessions_dates is None:
+            sessions_dates = self.get_sessions_last_modified(projectid)
+        since = modified_since[0:19]
+        subject_ids = set(
+            sess['subject_ID'] for sess in sessions_dates
+            if (sess['last_modified'] or '')[0:19] >= since and
+            (is_modified is None or is_modified(sess)))
+
+        sessions = list()
+        if subject_ids:
+            subject_list = self.get_subjects(projectid)
+            for subject_id in sorted(subject_ids):
+                sessions.extend(self.get_sessions(
+                    projectid, subject_id, subject_list=subject_list))
+        return sessions
+
+    def get_sessions_last_modified(self, projectid):
+        """
+        List the last_modified and last_updated dates of the project sessions
+
+        Only the ID, subject and dates columns are listed.
+
+        :param projectid: ID of a project on XNAT
+        :return: list of dictionaries with the keys ID, subject_ID,
+         last_modified and last_updated
+        """
+        post_uri = ALL_SESS_PROJ_URI.format(project=projectid)
+        type_list = list()
+        for sess in self._get_json('%s?columns=xsiType' % post_uri):
+            sess_type = sess['xsiType'].lower()
+            if sess_type not in type_list:
+                type_list.append(sess_type)
+
+        sessions = list()
+        for sess_type in type_list:
+            last_modified_str = '%s/meta/last_modified' % sess_type
+            last_updated_str = '%s/original' % sess_type
+            post_uri_type = '%s?xsiType=%s&columns=ID,subject_ID,%s,%s' % (
+                post_uri, sess_type, last_modified_str, last_updated_str)
+            for sess in self._get_json(post_uri_type):
+                sessions.append({
+                    'ID': sess['ID'],
+                    'subject_ID': sess['subject_ID'],
+                    'last_modified': sess.get(last_modified_str),
+                    'last_updated': sess.get(last_updated_str)})
+
+        return sessions
+
     def get_session_resources(self, projectid, subjectid, sessionid):
         """
         Gets a list of all of the resources for a session associated to a
@@ -1340,18 +1482,21 @@ def list_assessors(intf, projectid, subjectid, sessionid):
     return sorted(new_list, key=lambda k: k['label'])
 
 
-def list_project_assessors(intf, projectid):
+def list_project_assessors(intf, projectid, session_list=None):
     """
     List all the assessors that you have access to based on passed project.
 
     :param intf: pyxnat.Interface object
     :param projectid: ID of a project on XNAT
+    :param session_list: list of the project sessions from get_sessions.
+     Queried from XNAT if not given.
     :return: List of all the assessors for the project
     """
     assessors_dict = dict()
 
     # Get the sessions list to get the different variables needed:
-    session_list = intf.get_sessions(projectid)
+    if session_list is None:
+        session_list = intf.get_sessions(projectid)
     sess_id2mod = dict((sess['session_id'], [sess['subject_label'],
                         sess['type'], sess['handedness'], sess['gender'],
                         sess['yob'], sess['age'], sess['last_modified'],
@@ -1739,11 +1884,7 @@ def is_cscan_good_type(cscan, types_list, full_regex=False):
     :return: True if type is in the list, False if not.
 
     """
-    for exp in types_list:
-        regex = extract_exp(exp, full_regex)
-        if regex.match(cscan.info()['type']):
-            return True
-    return False
+    return match_many([cscan.info()['type']], types_list, full_regex)[0]
 
 
 def is_scan_unusable(scan_obj):
@@ -1767,11 +1908,8 @@ def is_scan_good_type(scan_obj, types_list, full_regex=False):
     :return: True if scan is in type list, False if not.
 
     """
-    for exp in types_list:
-        regex = extract_exp(exp, full_regex)
-        if regex.match(scan_obj.attrs.get('xnat:imageScanData/type')):
-            return True
-    return False
+    scan_type = scan_obj.attrs.get('xnat:imageScanData/type')
+    return match_many([scan_type], types_list, full_regex)[0]
 
 
 def parse_assessor_inputs(inputs):
@@ -1909,11 +2047,7 @@ def is_cassessor_good_type(cassr, types_list, full_regex=False):
 
     """
     assr_info = cassr.info()
-    for exp in types_list:
-        regex = extract_exp(exp, full_regex)
-        if regex.match(assr_info['proctype']):
-            return True
-    return False
+    return match_many([assr_info['proctype']], types_list, full_regex)[0]
 
 
 def is_cassessor_usable(cassr):
@@ -1940,11 +2074,7 @@ def is_assessor_good_type(assessor_obj, types_list, full_regex=False):
     """
     atype = assessor_obj.attrs.get('xsiType')
     proctype = assessor_obj.attrs.get('%s/proctype' % atype)
-    for exp in types_list:
-        regex = extract_exp(exp, full_regex)
-        if regex.match(proctype):
-            return True
-    return False
+    return match_many([proctype], types_list, full_regex)[0]
 
 
 def is_assessor_usable(assessor_obj):
@@ -2197,6 +2327,129 @@ def download_files(directory, resource, project_id=None, subject_id=None,
     return fpaths
 
 
+def _rest_uri(uri):
+    """REST uri of a XNAT path like /projects/... or /data/projects/..."""
+    if not uri.startswith('/data/') and not uri.startswith('/REST/'):
+        uri = '/data' + uri
+    return uri
+
+
+def download_file_resumable(intf, file_uri, fpath, size=None, digest=None,
+                            retries=3):
+    """
+    Download a file from XNAT, streamed to <fpath>.part and renamed once
+     complete. A partial file left by a failed attempt is resumed with a HTTP
+     Range request.
+
+    :param intf: pyxnat.Interface object
+    :param file_uri: path of the file on XNAT (/projects/.../files/<name>)
+    :param fpath: path of the downloaded file
+    :param size: expected size in bytes, checked if not None
+    :param digest: expected MD5 digest, checked if not None
+    :param retries: number of attempts after the first one failed
+    :return: number of bytes downloaded (0 if the file was already there)
+    """
+    if os.path.isfile(fpath) and size is not None and \
+       os.path.getsize(fpath) == int(size):
+        return 0
+
+    part_path = fpath + '.part'
+    url = intf._server.rstrip('/') + _rest_uri(file_uri)
+    downloaded = 0
+    for attempt in range(retries + 1):
+        offset = 0
+        if os.path.isfile(part_path):
+            offset = os.path.getsize(part_path)
+        headers = dict()
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+        try:
+            response = intf._http.get(url, headers=headers, stream=True)
+            if response.status_code == 416:
+                # nothing left to download or a stale partial file
+                response.close()
+                if size is None or offset != int(size):
+                    os.remove(part_path)
+                    continue
+            else:
+                response.raise_for_status()
+                mode = 'ab' if response.status_code == 206 else 'wb'
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        downloaded += len(chunk)
+        except Exception as err:
+            print('WARNING: download of %s failed (attempt %d): %s'
+                  % (file_uri, attempt + 1, err))
+            continue
+
+        error = _check_download(part_path, size, digest)
+        if error is None:
+            os.rename(part_path, fpath)
+            return downloaded
+
+        print('WARNING: download of %s is corrupted (%s), downloading again'
+              % (file_uri, error))
+        os.remove(part_path)
+
+    raise XnatAccessError('failed to download %s after %d attempts'
+                          % (file_uri, retries + 1))
+
+
+def _check_download(fpath, size, digest):
+    """Check a downloaded file, return a message if the check failed."""
+    if size is not None and os.path.getsize(fpath) != int(size):
+        return 'size %d instead of %s' % (os.path.getsize(fpath), size)
+    if digest:
+        md5 = hashlib.md5()
+        with open(fpath, 'rb') as f:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                md5.update(chunk)
+        if md5.hexdigest() != digest:
+            return 'MD5 %s instead of %s' % (md5.hexdigest(), digest)
+    return None
+
+
+def list_resource_files(intf, resource_uri):
+    """
+    List the files of a XNAT resource
+
+    :param intf: pyxnat.Interface object
+    :param resource_uri: path of the resource on XNAT
+    :return: list of dictionaries with the URI, Size, digest and relative
+     path of each file
+    """
+    return intf._get_json(_rest_uri(resource_uri.rstrip('/')) + '/files')
+
+
+def download_resource_resumable(intf, resource_uri, directory, retries=3):
+    """
+    Download all the files of a XNAT resource one by one with
+     download_file_resumable, in <directory>/<resource label>/ like
+     download_files_from_obj.
+
+    :param intf: pyxnat.Interface object
+    :param resource_uri: path of the resource on XNAT
+    :param directory: Full path to the download directory
+    :param retries: number of attempts per file after the first one failed
+    :return: tuple (list of the files downloaded, number of bytes downloaded)
+    """
+    resource_uri = resource_uri.rstrip('/')
+    resource_dir = os.path.join(directory, os.path.basename(resource_uri))
+    fpaths = list()
+    downloaded = 0
+    for fdict in list_resource_files(intf, resource_uri):
+        fpath = os.path.join(resource_dir, fdict['path'])
+        if not os.path.isdir(os.path.dirname(fpath)):
+            os.makedirs(os.path.dirname(fpath))
+        downloaded += download_file_resumable(
+            intf, fdict['URI'], fpath, size=fdict.get('Size') or None,
+            digest=fdict.get('digest') or None, retries=retries)
+        fpaths.append(fpath)
+
+    return fpaths, downloaded
+
+
 def download_biggest_file_from_obj(directory, resource_obj):
     """
     Downloads the largest file (based on file size in bytes) from a resource.
@@ -2532,10 +2785,16 @@ def upload_files(filepaths, project_id=None, subject_id=None, session_id=None,
 
 
 def upload_folder_to_obj(directory, resource_obj, resource_label, remove=False,
-                         removeall=False, extract=True):
+                         removeall=False, extract=True, mode=None):
     """
     Upload all of the files in a folder based on the pyxnat EObject passed
 
+    The folder is either sent as a zip built on the fly and extracted by XNAT,
+     or file by file with upload_put_workers concurrent PUTs. By default,
+     folders bigger than upload_zip_max_size are sent file by file. The
+     folders too big or with too many files for a zip without ZIP64 records
+     are always sent file by file, even with extract=False.
+
     :param directory: Full path of the directory to upload
     :param resource_obj: pyxnat EObject to upload the data to
     :param resource_label: label of where you want the contents of the
@@ -2544,6 +2803,7 @@ def upload_folder_to_obj(directory, resource_obj, resource_label, remove=False,
     :param remove: Remove the file if it exists if True
     :param removeall: Remove all of the files if they exist if True
     :param extract: extract the files if it's a zip
+    :param mode: 'zip' or 'files', None to choose from the folder size
     :return: True if upload was OK, False otherwise
 
     """
@@ -2562,20 +2822,130 @@ def upload_folder_to_obj(directory, resource_obj, resource_label, remove=False,
 %s already found on XNAT. No upload. Use remove/removeall." % fpath)
                     return False
 
-    fzip = '%s.zip' % resource_label
-    initdir = os.getcwd()
-    # Zip all the files in the directory
-    os.chdir(directory)
-    #os.system('zip -r %s * > /dev/null' % fzip)
-    os.system('(find . -print | zip %s -@) > /dev/null' % fzip)
-    # upload
-    resource_obj.put_zip(os.path.join(directory, fzip), overwrite=True,
-                         extract=extract)
-    # return to the initial directory:
-    os.chdir(initdir)
+    fpaths = list()
+    for root, _, filenames in os.walk(directory):
+        fpaths.extend(os.path.join(root, f) for f in sorted(filenames))
+    total_size = sum(os.path.getsize(f) for f in fpaths)
+
+    zip_allowed = total_size < zipfile.ZIP64_LIMIT and \
+        len(fpaths) < zipfile.ZIP_FILECOUNT_LIMIT
+    if mode is None:
+        max_zip_size = DAX_SETTINGS.get_upload_zip_max_size() * 1024 * 1024
+        if zip_allowed and (total_size < max_zip_size or not extract):
+            mode = 'zip'
+        else:
+            mode = 'files'
+    elif mode == 'zip' and not zip_allowed:
+        err = '%s: %d files, %d bytes: too big to upload as a zip.'
+        raise XnatUtilsError(err % ('upload_folder_to_obj', len(fpaths),
+                                    total_size))
+
+    if mode == 'zip':
+        # The zip is built while it is sent, nothing is written on disk
+        fzip = '%s.zip' % resource_label
+        if extract:
+            fzip += '?extract=true'
+        resource_obj.file(fzip).put(
+            stream_zip(directory, fpaths), overwrite=True,
+            params={"event_reason": "DAX uploading folder"})
+    elif mode == 'files':
+        if not resource_obj.exists():
+            resource_obj.create()
+        pool = ThreadPool(max(1, DAX_SETTINGS.get_upload_put_workers()))
+        try:
+            pool.map(lambda fpath: _put_file(directory, fpath, resource_obj),
+                     fpaths)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        err = "%s: mode must be 'zip' or 'files', not %s."
+        raise XnatUtilsError(err % ('upload_folder_to_obj', mode))
+
     return True
 
 
+def _put_file(directory, fpath, resource_obj):
+    """Upload a file of a folder keeping its path relative to the folder."""
+    fname = os.path.relpath(fpath, directory).replace(os.sep, '/')
+    resource_obj.file(str(fname)).put(
+        str(fpath), overwrite=True,
+        params={"event_reason": "DAX uploading file"})
+
+
+def stream_zip(directory, fpaths, chunk_size=1024 * 1024):
+    """
+    Generate a zip archive of files chunk by chunk, without writing it on disk
+
+    The entries are deflated and followed by a data descriptor since their
+     size and CRC are only known once read. No ZIP64 support: the archive
+     must stay under zipfile.ZIP64_LIMIT and zipfile.ZIP_FILECOUNT_LIMIT
+     files, XnatUtilsError is raised otherwise.
+
+    :param directory: folder the paths in the archive are relative to
+    :param fpaths: list of the full paths of the files to archive
+    :param chunk_size: size of the chunks read from the files
+    :return: generator of the bytes of the archive
+    """
+    if len(fpaths) >= zipfile.ZIP_FILECOUNT_LIMIT:
+        err = '%s: %d files, a zip without ZIP64 holds less than %d files.'
+        raise XnatUtilsError(err % ('stream_zip', len(fpaths),
+                                    zipfile.ZIP_FILECOUNT_LIMIT))
+
+    offset = 0
+    central_dir = list()
+    for fpath in fpaths:
+        if offset >= zipfile.ZIP64_LIMIT:
+            err = '%s: archive bigger than %d bytes, ZIP64 is not supported.'
+            raise XnatUtilsError(err % ('stream_zip', zipfile.ZIP64_LIMIT))
+
+        arcname = os.path.relpath(fpath, directory).replace(os.sep, '/')
+        arcname = arcname.encode('utf-8')
+        mtime = time.localtime(os.path.getmtime(fpath))
+        dostime = mtime[3] << 11 | mtime[4] << 5 | mtime[5] // 2
+        dosdate = (max(mtime[0], 1980) - 1980) << 9 | mtime[1] << 5 | mtime[2]
+
+        # flag 0x08: sizes and CRC in the data descriptor after the data
+        header = struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, 0x08,
+                             zipfile.ZIP_DEFLATED, dostime, dosdate, 0, 0, 0,
+                             len(arcname), 0) + arcname
+        yield header
+
+        crc = 0
+        size = 0
+        compressed_size = 0
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                      zlib.DEFLATED, -15)
+        with open(fpath, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                data = compressor.compress(chunk)
+                compressed_size += len(data)
+                if data:
+                    yield data
+        data = compressor.flush()
+        compressed_size += len(data)
+        if offset + compressed_size >= zipfile.ZIP64_LIMIT:
+            err = '%s: archive bigger than %d bytes, ZIP64 is not supported.'
+            raise XnatUtilsError(err % ('stream_zip', zipfile.ZIP64_LIMIT))
+        crc &= 0xffffffff
+        yield data + struct.pack('<IIII', 0x08074b50, crc, compressed_size,
+                                 size)
+
+        central_dir.append(struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014b50, 20, 20, 0x08,
+            zipfile.ZIP_DEFLATED, dostime, dosdate, crc, compressed_size,
+            size, len(arcname), 0, 0, 0, 0,
+            (os.stat(fpath).st_mode & 0xffff) << 16, offset) + arcname)
+        offset += len(header) + compressed_size + 16
+
+    central_dir = b''.join(central_dir)
+    yield central_dir + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0,
+                                    len(fpaths), len(fpaths),
+                                    len(central_dir), offset, 0)
+
+
 def upload_folder(directory, project_id=None, subject_id=None, session_id=None,
                   scan_id=None, assessor_id=None, resource=None, remove=False,
                   removeall=False, extract=True):
@@ -2737,25 +3107,65 @@ found, <type 'str'> or <type 'list'> required." % type(expressions)
         raise XnatUtilsError(err)
 
     for exp in expressions:
-        regex = extract_exp(exp, full_regex)
         if nor:
-            flist = [d for d in flist if not regex.match(d[key])]
+            mask = match_many([d[key] for d in flist], [exp], full_regex)
+            flist = [d for d, match in zip(flist, mask) if not match]
         else:
-            flist.extend([d for d in list_dicts
-                          if regex.match(d[key])])
+            mask = match_many([d[key] for d in list_dicts], [exp],
+                              full_regex)
+            flist.extend([d for d, match in zip(list_dicts, mask) if match])
     return flist
 
 
 def extract_exp(expression, full_regex=False):
     """Extract the experession with or without full_regex.
 
+    The compiled expressions are cached for the process (the last
+    PATTERN_CACHE_SIZE used).
+
     :param expression: string to filter
     :param full_regex: using full regex
     :return: regex Object from re package
     """
-    if not full_regex:
+    key = (expression, bool(full_regex))
+    with _PATTERN_CACHE_LOCK:
+        regex = _PATTERN_CACHE.pop(key, None)
+        if regex is not None:
+            _PATTERN_CACHE[key] = regex
+            return regex
+
+    if full_regex:
+        exp = expression
+    else:
         exp = fnmatch.translate(expression)
-    return re.compile(exp)
+    regex = re.compile(exp)
+
+    with _PATTERN_CACHE_LOCK:
+        _PATTERN_CACHE[key] = regex
+        while len(_PATTERN_CACHE) > PATTERN_CACHE_SIZE:
+            _PATTERN_CACHE.popitem(last=False)
+    return regex
+
+
+def match_many(values, expressions, full_regex=False):
+    """
+    Match strings against expressions, a string matching any of them is True
+
+    Each distinct string is only matched once.
+
+    :param values: list of strings to match
+    :param expressions: list of expressions (OR)
+    :param full_regex: use full regex
+    :return: list of booleans in the order of the values
+    """
+    regexes = [extract_exp(exp, full_regex) for exp in expressions]
+    matches = dict()
+    mask = list()
+    for value in values:
+        if value not in matches:
+            matches[value] = any(regex.match(value) for regex in regexes)
+        mask.append(matches[value])
+    return mask
 
 
 def clean_directory(directory):
@@ -2775,28 +3185,30 @@ def clean_directory(directory):
             os.remove(fpath)
 
 
-def gzip_nii(directory):
+def gzip_nii(directory, nb_threads=1):
     """
-    Gzip all the NIfTI files in a directory via system call.
+    Gzip all the NIfTI files in a directory (see gzip_file).
 
     :param directory: The directory to filter for *.nii files
+    :param nb_threads: number of threads compressing each file
     :return: None
 
     """
     for fpath in glob.glob(os.path.join(directory, '*.nii')):
-        os.system('gzip %s' % fpath)
+        gzip_file(fpath, nb_threads=nb_threads)
 
 
 def ungzip_nii(directory):
     """
-    Gunzip all of the NIfTI files in a directory via system call.
+    Gunzip all of the NIfTI files in a directory (see gunzip_file).
 
     :param directory: The directory to filter for *.nii.gz files
     :return: None
 
     """
     for fpath in glob.glob(os.path.join(directory, '*.nii.gz')):
-        os.system('gzip -d %s' % fpath)
+        gunzip_file(fpath)
+        os.remove(fpath)
 
 
 def run_matlab(matlab_script, verbose=False, matlab_bin='matlab'):
@@ -3057,8 +3469,13 @@ class CachedImageSession(object):
 
     """
     Class to cache the XML information for a session on XNAT
+
+    The XML of the session is only read (from the session cache or XNAT) the
+    first time it is needed, e.g. by scans() or assessors(). The datatype and
+    creation timestamp given by get_sessions are used without the XML.
     """
-    def __init__(self, intf, proj, subj, sess):
+    def __init__(self, intf, proj, subj, sess, last_modified=None,
+                 datatype=None, creation_timestamp=None):
         """
         Entry point for the CachedImageSession class
 
@@ -3066,37 +3483,156 @@ class CachedImageSession(object):
         :param proj: XNAT project ID
         :param subj: XNAT subject ID/label
         :param sess: XNAT session ID/label
+        :param last_modified: last_modified date of the session from
+         get_sessions. If set, the XML is read from the session cache when
+         the session did not change since it was stored.
+        :param datatype: xsiType of the session from get_sessions
+        :param creation_timestamp: insert date of the session from
+         get_sessions
         :return: None
 
         """
-        experiment = intf.select_experiment(proj, subj, sess)
-        self.datatype_ = experiment.datatype()
-        xml_str = experiment.get()
-        self.creation_timestamp_ =\
-            experiment.attrs.get(self.datatype_+'/meta/insert_date')
-        self.sess_element = ET.fromstring(xml_str)
         self.project = proj
         self.subject = subj
         self.session = sess
         self.intf = intf  # cache for later usage
-        self.full_object_ = experiment
+        self.last_modified_ = last_modified
+        self.datatype__ = datatype
+        self.creation_timestamp__ = creation_timestamp
+        self.sess_element_ = None
+        self.full_object_ = None
+        self.dirty_ = False
+        self.loads = 0
+        self.reloads = 0
+        self.reloads_avoided = 0
         self.sess_info_ = None
         self.scans_ = None
         self.assessors_ = None
 
+    def load(self):
+        """
+        Read the XML of the session from the session cache or XNAT
+
+        :return: None
+
+        """
+        cache = get_session_cache() if self.last_modified_ else None
+        cached = None
+        if cache is not None:
+            cached = cache.get(self.project, self.subject, self.session,
+                               self.last_modified_)
+
+        if cached is not None:
+            datatype, creation_timestamp, xml_str = cached
+        else:
+            experiment = self.full_object()
+            datatype = experiment.datatype()
+            xml_str = experiment.get()
+            creation_timestamp =\
+                experiment.attrs.get(datatype + '/meta/insert_date')
+            if cache is not None:
+                cache.put(self.project, self.subject, self.session,
+                          self.last_modified_, datatype, creation_timestamp,
+                          xml_str)
+
+        if self.datatype__ is None:
+            self.datatype__ = datatype
+        if self.creation_timestamp__ is None:
+            self.creation_timestamp__ = creation_timestamp
+        self.sess_element_ = ET.fromstring(xml_str)
+        self.loads += 1
+
+    def is_loaded(self):
+        """
+        Check if the XML of the session was read
+
+        :return: True if the XML was read, False otherwise
+
+        """
+        return self.sess_element_ is not None
+
+    @property
+    def sess_element(self):
+        """ XML element of the session, read the first time it is used """
+        if self.sess_element_ is None:
+            self.load()
+        return self.sess_element_
+
+    @property
+    def datatype_(self):
+        if self.datatype__ is None:
+            self.load()
+        return self.datatype__
+
+    @property
+    def creation_timestamp_(self):
+        if self.creation_timestamp__ is None:
+            self.load()
+        return self.creation_timestamp__
+
     def entity_type(self):
         return 'session'
 
     def reload(self):
+        # The session was modified: the cached XML is not valid anymore
+        invalidate_session(self.project, self.subject, self.session)
         experiment = self.intf.select_experiment(self.project,
                                               self.subject,
                                               self.session)
-        self.sess_element = ET.fromstring(experiment.get())
+        self.last_modified_ = self.get_last_modified(experiment)
+        self.sess_element_ = ET.fromstring(experiment.get())
         self.full_object_ = experiment
+        self.dirty_ = False
+        self.reloads += 1
         self.sess_info_ = None
         self.scans_ = None
         self.assessors_ = None
 
+    def mark_dirty(self):
+        """
+        Flag the session as modified by dax (e.g: assessor created or status
+        set) so the next reload_if_modified reloads the XML.
+
+        :return: None
+
+        """
+        self.dirty_ = True
+        invalidate_session(self.project, self.subject, self.session)
+
+    def get_last_modified(self, experiment=None):
+        """
+        Get the meta/last_modified date of the session on XNAT
+
+        :param experiment: pyxnat experiment object. Default: full_object()
+        :return: String of the last_modified date or None if not found
+        """
+        if experiment is None:
+            experiment = self.full_object()
+        return experiment.attrs.get(self.datatype_ + '/meta/last_modified')
+
+    def reload_if_modified(self):
+        """
+        Reload the session XML only if the session was marked as modified by
+        dax or if its meta/last_modified date changed on XNAT.
+
+        :return: True if the session was reloaded, False otherwise
+
+        """
+        if not self.is_loaded():
+            # The XML will be read when needed
+            self.dirty_ = False
+            return False
+
+        if not self.dirty_ and self.last_modified_:
+            last_modified = self.get_last_modified()
+            if last_modified and \
+                    last_modified[0:19] == self.last_modified_[0:19]:
+                self.reloads_avoided += 1
+                return False
+
+        self.reload()
+        return True
+
     def label(self):
         """
         Get the label of the session
@@ -3794,38 +4330,266 @@ class CachedResource(object):
         return res_info
 
 
+class ProjectSnapshot(object):
+    """
+    Class to query once the subjects, sessions, scans and assessors of a
+    project on XNAT and index them by ID, label and session
+    """
+    def __init__(self, intf, project_id, include_shared=True):
+        """
+        Entry point for the ProjectSnapshot class.
+
+        Nothing is queried until a list is needed. Each list is then queried
+        only once for the life of the snapshot.
+
+        :param intf: pyxnat Interface object (InterfaceTemp)
+        :param project_id: XNAT project ID
+        :param include_shared: include the scans shared into the project
+        :return: None
+        """
+        self.intf = intf
+        self.project_id = project_id
+        self.include_shared = include_shared
+        self.subjects_ = None
+        self.sessions_ = None
+        self.scans_ = None
+        self.assessors_ = None
+
+    def subjects(self):
+        """
+        Get the subjects of the project (see InterfaceTemp.get_subjects)
+
+        :return: list of dictionaries of subject info
+        """
+        if self.subjects_ is None:
+            self.subjects_ = self.intf.get_subjects(self.project_id)
+            self.subject_by_id_ = _index_by(self.subjects_, 'ID')
+            self.subject_by_label_ = _index_by(self.subjects_, 'label')
+        return self.subjects_
+
+    def sessions(self):
+        """
+        Get the sessions of the project (see InterfaceTemp.get_sessions)
+
+        :return: list of dictionaries of session info
+        """
+        if self.sessions_ is None:
+            self.sessions_ = self.intf.get_sessions(
+                self.project_id, subject_list=self.subjects())
+            self.session_by_id_ = _index_by(self.sessions_, 'ID')
+            self.session_by_label_ = _index_by(self.sessions_, 'label')
+            self.sessions_by_subject_ = utilities.groupby_to_dict(
+                self.sessions_, lambda x: x['subject_id'])
+        return self.sessions_
+
+    def scans(self):
+        """
+        Get the scans of the project (see InterfaceTemp.get_project_scans)
+
+        :return: list of dictionaries of scan info
+        """
+        if self.scans_ is None:
+            self.scans_ = self.intf.get_project_scans(
+                self.project_id, self.include_shared,
+                session_list=self.sessions())
+            self.scans_by_session_ = utilities.groupby_to_dict(
+                self.scans_, lambda x: x['session_id'])
+        return self.scans_
+
+    def assessors(self):
+        """
+        Get the assessors of the project (see list_project_assessors)
+
+        :return: list of dictionaries of assessor info
+        """
+        if self.assessors_ is None:
+            self.assessors_ = list_project_assessors(
+                self.intf, self.project_id, session_list=self.sessions())
+            self.assessor_by_id_ = _index_by(self.assessors_, 'ID')
+            self.assessor_by_label_ = _index_by(self.assessors_, 'label')
+            self.assessors_by_session_ = utilities.groupby_to_dict(
+                self.assessors_, lambda x: x['session_id'])
+        return self.assessors_
+
+    def get_subject(self, subject):
+        """
+        Get a subject of the project
+
+        :param subject: subject ID or label
+        :return: dictionary of subject info, None if not found
+        """
+        self.subjects()
+        return self.subject_by_id_.get(subject,
+                                       self.subject_by_label_.get(subject))
+
+    def get_session(self, session):
+        """
+        Get a session of the project
+
+        :param session: session ID or label
+        :return: dictionary of session info, None if not found
+        """
+        self.sessions()
+        return self.session_by_id_.get(session,
+                                       self.session_by_label_.get(session))
+
+    def get_subject_sessions(self, subject):
+        """
+        Get the sessions of a subject
+
+        :param subject: subject ID or label
+        :return: list of dictionaries of session info
+        """
+        subj_info = self.get_subject(subject)
+        if subj_info is None:
+            return list()
+        self.sessions()
+        return self.sessions_by_subject_.get(subj_info['ID'], list())
+
+    def get_session_scans(self, session):
+        """
+        Get the scans of a session
+
+        :param session: session ID or label
+        :return: list of dictionaries of scan info
+        """
+        sess_info = self.get_session(session)
+        if sess_info is None:
+            return list()
+        self.scans()
+        return self.scans_by_session_.get(sess_info['ID'], list())
+
+    def get_scan(self, session, scan_id):
+        """
+        Get a scan of a session
+
+        :param session: session ID or label
+        :param scan_id: scan ID
+        :return: dictionary of scan info, None if not found
+        """
+        return utilities.find_with_pred(self.get_session_scans(session),
+                                        lambda x: x['ID'] == scan_id)
+
+    def get_assessor(self, assessor):
+        """
+        Get an assessor of the project
+
+        :param assessor: assessor ID or label
+        :return: dictionary of assessor info, None if not found
+        """
+        self.assessors()
+        return self.assessor_by_id_.get(assessor,
+                                        self.assessor_by_label_.get(assessor))
+
+    def get_session_assessors(self, session):
+        """
+        Get the assessors of a session
+
+        :param session: session ID or label
+        :return: list of dictionaries of assessor info
+        """
+        sess_info = self.get_session(session)
+        if sess_info is None:
+            return list()
+        self.assessors()
+        return self.assessors_by_session_.get(sess_info['ID'], list())
+
+
+def _index_by(items, key):
+    return dict((item[key], item) for item in items)
+
+
 # File Utils
-def gzip_file(file_not_zipped):
+def gzip_file(file_not_zipped, nb_threads=1, compresslevel=9):
     """
     Method to gzip a file using the gzip python package
 
+    The file is copied by chunks, the memory used does not depend on its
+    size. With several threads, blocks of GZIP_BLOCK_SIZE bytes are
+    compressed at the same time and written as concatenated gzip members,
+    which gunzip and the gzip python package read as one file.
+
     :param file_not_zipped: Full path to a file to gzip
-    :return: Full path to the gzipped file
+    :param nb_threads: number of threads compressing the file
+    :param compresslevel: compression level from 1 (fastest) to 9 (smallest)
+    :return: list with the full path to the gzipped file
 
     """
-    file_out = list()
-    content = open(file_not_zipped, 'rb')
-    content = content.read()
-    fout = gzip.open(file_not_zipped + '.gz', 'wb')
-    fout.write(content)
-    fout.close()
-    file_out.append(file_not_zipped + '.gz')
+    file_zipped = file_not_zipped + '.gz'
+    try:
+        with open(file_not_zipped, 'rb') as fin:
+            if nb_threads > 1:
+                _gzip_blocks(fin, file_zipped, nb_threads, compresslevel)
+            else:
+                with gzip.open(file_zipped, 'wb', compresslevel) as fout:
+                    shutil.copyfileobj(fin, fout, GZIP_CHUNK_SIZE)
+    except Exception:
+        if os.path.exists(file_zipped):
+            os.remove(file_zipped)
+        raise
     os.remove(file_not_zipped)
-    return file_out
+    return [file_zipped]
+
+
+def _gzip_block(args):
+    """ Compress a block into a gzip member, zlib releases the GIL """
+    block, compresslevel = args
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush()
+
+
+def _gzip_blocks(fin, file_zipped, nb_threads, compresslevel):
+    """
+    Compress a file by blocks with a pool of threads
+
+    At most nb_threads blocks are in memory at the same time.
+
+    :param fin: file object of the file to gzip
+    :param file_zipped: Full path to the gzipped file
+    :param nb_threads: number of threads compressing the blocks
+    :param compresslevel: compression level from 1 to 9
+    :return: None
+
+    """
+    pool = ThreadPool(nb_threads)
+    try:
+        with open(file_zipped, 'wb') as fout:
+            nb_members = 0
+            while True:
+                blocks = list()
+                while len(blocks) < nb_threads:
+                    block = fin.read(GZIP_BLOCK_SIZE)
+                    if not block:
+                        break
+                    blocks.append((block, compresslevel))
+                if not blocks and nb_members > 0:
+                    break
+                if not blocks:
+                    # Empty file: one empty member for a valid gzip file
+                    blocks.append((b'', compresslevel))
+                for member in pool.map(_gzip_block, blocks):
+                    fout.write(member)
+                    nb_members += 1
+    finally:
+        pool.close()
+        pool.join()
 
 
 def gunzip_file(file_zipped):
     """
     Gunzips a file using the gzip python package
 
+    The file is copied by chunks, the memory used does not depend on its
+    size.
+
     :param file_zipped: Full path to the gzipped file
     :return: None
 
     """
-    gzfile = gzip.GzipFile(file_zipped)
-    gzdata = gzfile.read()
-    gzfile.close()
-    open(file_zipped[:-3], 'w').write(gzdata)
+    with gzip.open(file_zipped, 'rb') as fin:
+        with open(file_zipped[:-3], 'wb') as fout:
+            shutil.copyfileobj(fin, fout, GZIP_CHUNK_SIZE)
 
 
 def find_files(directory, ext):
@@ -3960,25 +4724,61 @@ def read_yaml(yaml_file):
 
 
 # DICOM Utils
+DICOM_PREAMBLE_SIZE = 128
+DICOM_MAGIC = b'DICM'
+# Groups of the first element of a DICOM without preamble: file meta
+# information or identifying information
+DICOM_FIRST_GROUPS = (0x0002, 0x0008)
+PIXEL_DATA_TAG = 0x7FE00010
+# Tags of a dicom converted from a nifti copied from the target dicom
+DICOM_TARGET_TAGS = [(0x18, 0x5100),  # Patient Position
+                     (0x18, 0x50),  # Slice Thickness
+                     (0x18, 0x88),  # Spacing Between Slices
+                     (0x18, 0x1312),  # In-plane Phase Encoding
+                     (0x20, 0x32),  # Image Position
+                     (0x20, 0x37),  # Image Orientation
+                     (0x20, 0x1041),  # Slice Location
+                     (0x28, 0x10),  # rows
+                     (0x28, 0x11),  # columns
+                     (0x28, 0x30)]  # Pixel spacing
+# Tags set for each dicom converted from a nifti
+DICOM_SLICE_KEYWORDS = ['SeriesNumber', 'SeriesDescription', 'SOPInstanceUID',
+                        'ProtocolName', 'InstanceNumber']
+DICOM_WRITE_THREADS = 4
+
+
 def is_dicom(fpath):
     """Check if the file is a DICOM medical data.
 
+    Only the 128 bytes preamble and the DICM prefix are read. A file without
+    preamble starting like a DICOM element is checked by reading its header
+    with pydicom.
+
     :param fpath: path of the file
     :return boolean: true if it's a DICOM, false otherwise
     """
     if not os.path.isfile(fpath):
         raise XnatUtilsError('File not found: %s' % fpath)
-    file_call = '''file {fpath}'''.format(fpath=fpath)
-    output = subprocess.check_output(file_call.split())
-    if 'dicom' in output.split(':')[1].lower():
+    with open(fpath, 'rb') as fin:
+        header = fin.read(DICOM_PREAMBLE_SIZE + len(DICOM_MAGIC))
+    if header[DICOM_PREAMBLE_SIZE:] == DICOM_MAGIC:
         return True
 
-    return False
+    if len(header) < 8 or \
+       struct.unpack('<H', header[:2])[0] not in DICOM_FIRST_GROUPS:
+        return False
+    try:
+        dst = pydicom.read_file(fpath, stop_before_pixels=True, force=True)
+    except Exception:
+        return False
+    return 'SOPClassUID' in dst
 
 
 def order_dicoms(folder):
     """Order the dicoms in a folder by the Slice Location.
 
+    Only the headers of the dicoms are read.
+
     :param folder: path to the folder
     :return: dictionary of the files with the key is the slice location
     """
@@ -3986,29 +4786,60 @@ def order_dicoms(folder):
         raise XnatUtilsError('Folder not found: %s' % folder)
     dcm_files = dict()
     for dc in glob.glob(os.path.join(folder, '*.dcm')):
-        dst = pydicom.read_file(dc)
+        dst = pydicom.read_file(dc, stop_before_pixels=True)
         dcm_files[float(dst.SliceLocation)] = dc
     return collections.OrderedDict(sorted(dcm_files.items()))
 
 
-def find_dicom_in_folder(folder, recursively=True):
+def list_folder_files(folder, recursively=True):
+    """List the files in a folder, depth first in the order of the folder.
+
+    os.scandir (or the scandir package on python 2) is used when available
+    to avoid a stat call per entry.
+
+    :param folder: path to the folder
+    :param recursively: list the files of the sub folders
+    :return: list of the paths of the files
+    """
+    files = list()
+    if scandir is not None:
+        for entry in scandir(folder):
+            if entry.is_file():
+                files.append(entry.path)
+            elif recursively and entry.is_dir():
+                files.extend(list_folder_files(entry.path, recursively=True))
+        return files
+
+    for ffname in os.listdir(folder):
+        ffpath = os.path.join(folder, ffname)
+        if os.path.isfile(ffpath):
+            files.append(ffpath)
+        elif os.path.isdir(ffpath) and recursively:
+            files.extend(list_folder_files(ffpath, recursively=True))
+    return files
+
+
+def find_dicom_in_folder(folder, recursively=True, nb_threads=1):
     """Find a dicom file in folder.
 
     :param folder: path to folder to search
     :param recursively: search sub folder
+    :param nb_threads: number of threads checking the files
     :return: list of dicoms
     """
-    dicom_list = list()
     if not os.path.isdir(folder):
         raise XnatUtilsError('Folder not found: %s' % folder)
-    for ffname in os.listdir(folder):
-        ffpath = os.path.join(folder, ffname)
-        if os.path.isfile(ffpath):
-            if is_dicom(ffpath):
-                dicom_list.append(ffpath)
-        elif os.path.isdir(ffpath) and recursively:
-            dicom_list.extend(find_dicom_in_folder(ffpath, recursively=True))
-    return dicom_list
+    files = list_folder_files(folder, recursively=recursively)
+    if nb_threads > 1 and len(files) > 1:
+        pool = ThreadPool(min(nb_threads, len(files)))
+        try:
+            mask = pool.map(is_dicom, files)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        mask = [is_dicom(ffpath) for ffpath in files]
+    return [ffpath for ffpath, dicom in zip(files, mask) if dicom]
 
 
 def write_dicom(pixel_array, filename, ds_copy, ds_ori, volume_number,
@@ -4026,55 +4857,107 @@ def write_dicom(pixel_array, filename, ds_copy, ds_ori, volume_number,
     """
     # Set to zero negatives values in the image:
     pixel_array[pixel_array < 0] = 0
+    if pixel_array.dtype != np.uint16:
+        pixel_array = pixel_array.astype(np.uint16)
 
-    # Set the DICOM dataset
-    file_meta = Dataset()
-    file_meta.MediaStorageSOPClassUID = 'Secondary Capture Image Storage'
-    file_meta.MediaStorageSOPInstanceUID = ds_ori.SOPInstanceUID
-    file_meta.ImplementationClassUID = ds_ori.SOPClassUID
-    ds = FileDataset(filename, {}, file_meta=file_meta, preamble="\0" * 128)
+    template = dicom_header_template(ds_ori, series_number)
+    write_dicom_slice(pixel_array.tostring(), filename, ds_copy, ds_ori,
+                      template, volume_number + 1, dicom_sop_uid(sop_id))
 
-    # Copy the tag from the original DICOM
-    for tag, value in list(ds_ori.items()):
-        if tag != ds_ori.data_element("PixelData").tag:
-            ds[tag] = value
 
-    # Other tags to set
-    ds.SeriesNumber = series_number
-    ds.SeriesDescription = ds_ori.SeriesDescription + ' fromNifti'
+def dicom_sop_uid(sop_id):
+    """Generate a SOP Instance UID from the root of a UID and the time.
+
+    :param sop_id: root of the UID ending with '.'
+    :return: string of the UID
+    """
     sop_uid = sop_id + str(datetime.now()).replace('-', '')\
                                           .replace(':', '')\
                                           .replace('.', '')\
                                           .replace(' ', '')
-    ds.SOPInstanceUID = sop_uid[:-1]
-    ds.ProtocolName = ds_ori.ProtocolName
-    ds.InstanceNumber = volume_number + 1
+    return sop_uid[:-1]
+
+
+def dicom_header_template(ds_ori, series_number):
+    """Build the header shared by the dicoms converted from a nifti.
+
+    The tags of the original dicom are copied once for all the dicoms of
+    the series, without the tags set for each dicom.
+
+    :param ds_ori: pydicom object of the dicom where the array comes from
+    :param series_number: number of the series being written
+    :return: dictionary of the data elements by tag
+    """
+    template = Dataset()
+    for tag, value in list(ds_ori.items()):
+        if tag != PIXEL_DATA_TAG:
+            template[tag] = value
+    # New elements: the ones copied are shared with ds_ori
+    for keyword in DICOM_SLICE_KEYWORDS:
+        if keyword in template:
+            delattr(template, keyword)
+    for tag in DICOM_TARGET_TAGS:
+        if tag in template:
+            del template[tag]
+    template.SeriesNumber = series_number
+    template.SeriesDescription = ds_ori.SeriesDescription + ' fromNifti'
+    template.ProtocolName = ds_ori.ProtocolName
+    return dict(template.items())
+
+
+def write_dicom_slice(pixel_data, filename, ds_copy, ds_ori, template,
+                      instance_number, sop_uid):
+    """Write a dicom from the header template of its series.
+
+    :param pixel_data: bytes of the uint16 pixels of the dicom
+    :param filename: file name for the dicom
+    :param ds_copy: pydicom object of the dicom to copy the orientation from
+    :param ds_ori: pydicom object of the dicom where the array comes from
+    :param template: header from dicom_header_template
+    :param instance_number: instance number of the dicom
+    :param sop_uid: SOP Instance UID of the dicom
+    :return: None
+    """
+    file_meta = Dataset()
+    file_meta.MediaStorageSOPClassUID = 'Secondary Capture Image Storage'
+    file_meta.MediaStorageSOPInstanceUID = ds_ori.SOPInstanceUID
+    file_meta.ImplementationClassUID = ds_ori.SOPClassUID
+    ds = FileDataset(filename, dict(template), file_meta=file_meta,
+                     preamble=b"\0" * 128)
+    ds.SOPInstanceUID = sop_uid
+    ds.InstanceNumber = instance_number
 
     # Copy from T2 the orientation tags:
-    ds.PatientPosition = ds_copy.PatientPosition
-    ds[0x18, 0x50] = ds_copy[0x18, 0x50]  # Slice Thicknes
-    ds[0x18, 0x88] = ds_copy[0x18, 0x88]  # Spacing Between Slices
-    ds[0x18, 0x1312] = ds_copy[0x18, 0x1312]  # In-plane Phase Encoding
-    ds[0x20, 0x32] = ds_copy[0x20, 0x32]  # Image Position
-    ds[0x20, 0x37] = ds_copy[0x20, 0x37]  # Image Orientation
-    ds[0x20, 0x1041] = ds_copy[0x20, 0x1041]  # Slice Location
-    ds[0x28, 0x10] = ds_copy[0x28, 0x10]  # rows
-    ds[0x28, 0x11] = ds_copy[0x28, 0x11]  # columns
-    ds[0x28, 0x30] = ds_copy[0x28, 0x30]  # Pixel spacing
-
-    # Set the Image pixel array
-    if pixel_array.dtype != np.uint16:
-        pixel_array = pixel_array.astype(np.uint16)
-    ds.PixelData = pixel_array.tostring()
+    for tag in DICOM_TARGET_TAGS:
+        ds[tag] = ds_copy[tag]
 
-    # Save the image
+    ds.PixelData = pixel_data
     ds.save_as(filename)
 
 
+def nifti_to_dicom_stack(data):
+    """Convert the data of a nifti to the pixels of its 2D dicoms.
+
+    The slices are rotated, the negative values set to zero and the data
+    cast to uint16 for the whole volume at once.
+
+    :param data: array or nibabel dataobj of the nifti
+    :return: C-contiguous uint16 array of the slices on the first axis
+    """
+    stack = np.rot90(np.asanyarray(data), axes=(0, 1))
+    stack = np.clip(stack, 0, None)
+    return np.ascontiguousarray(np.moveaxis(stack, 2, 0), dtype=np.uint16)
+
+
 def convert_nifti_2_dicoms(nifti_path, dicom_targets, dicom_source,
-                           output_folder, label=None):
+                           output_folder, label=None,
+                           nb_threads=DICOM_WRITE_THREADS):
     """Convert 4D niftis into DICOM files (2D dicoms).
 
+    The nifti is memory-mapped and converted to uint16 slices at once, the
+    header shared by the dicoms is built once and the slices are written by
+    a pool of threads.
+
     :param nifti_path: path to the nifti file
     :param dicom_target: list of dicom files from the target
      for the registration for header info
@@ -4082,18 +4965,19 @@ def convert_nifti_2_dicoms(nifti_path, dicom_targets, dicom_source,
      for the registration for header info
     :param output_folder: folder where the DICOM files will be saved
     :param label: name for the output dicom files
+    :param nb_threads: number of threads writing the dicoms
     :return: None
     """
     if not os.path.isfile(nifti_path):
         raise XnatUtilsError("NIFTI File %s not found." % nifti_path)
     # Load image from NIFTI
-    f_img = nib.load(nifti_path)
-    f_img_data = f_img.get_data()
+    f_img = nib.load(nifti_path, mmap=True)
+    stack = nifti_to_dicom_stack(f_img.dataobj)
 
     # Load dicom headers
     if not os.path.isfile(dicom_source):
         raise XnatUtilsError("DICOM File %s not found ." % dicom_source)
-    adc_dcm_obj = pydicom.read_file(dicom_source)
+    adc_dcm_obj = pydicom.read_file(dicom_source, stop_before_pixels=True)
 
     # Make output_folder:
     if not os.path.exists(output_folder):
@@ -4111,24 +4995,37 @@ def convert_nifti_2_dicoms(nifti_path, dicom_targets, dicom_source,
         # Load dicom headers
         if not os.path.isfile(dcm_file):
             raise XnatUtilsError("DICOM File %s not found." % dcm_file)
-        t2_dcm_obj = pydicom.read_file(dcm_file)
+        t2_dcm_obj = pydicom.read_file(dcm_file, stop_before_pixels=True)
         dcm_obj_sorted[t2_dcm_obj.InstanceNumber] = t2_dcm_obj
 
-    for vol_i in range(f_img_data.shape[2]):
-        if f_img_data.shape[2] > 100:
-            filename = os.path.join(output_folder, '%s_%03d.dcm' % (label,
-                                                                    vol_i + 1))
-        elif f_img_data.shape[2] > 10:
-            filename = os.path.join(output_folder, '%s_%02d.dcm' % (label,
-                                                                    vol_i + 1))
+    template = dicom_header_template(adc_dcm_obj, series_number)
+    # One UID for the series, numbered by slice
+    sop_uid = dicom_sop_uid(sop_id)
+    nb_slices = stack.shape[0]
+    if nb_slices > 100:
+        name_format = '%s_%03d.dcm'
+    elif nb_slices > 10:
+        name_format = '%s_%02d.dcm'
+    else:
+        name_format = '%s_%d.dcm'
 
-        else:
-            filename = os.path.join(output_folder, '%s_%d.dcm' % (label,
-                                                                  vol_i + 1))
+    def write_slice(vol_i):
+        filename = os.path.join(output_folder, name_format % (label,
+                                                              vol_i + 1))
+        write_dicom_slice(stack[vol_i].tostring(), filename,
+                          dcm_obj_sorted[vol_i + 1], adc_dcm_obj, template,
+                          vol_i + 1, '%s.%d' % (sop_uid, vol_i + 1))
 
-        write_dicom(np.rot90(f_img_data[:, :, vol_i]), filename,
-                    dcm_obj_sorted[vol_i + 1], adc_dcm_obj, vol_i,
-                    series_number, sop_id)
+    if nb_threads > 1 and nb_slices > 1:
+        pool = ThreadPool(min(nb_threads, nb_slices))
+        try:
+            pool.map(write_slice, range(nb_slices))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for vol_i in range(nb_slices):
+            write_slice(vol_i)
 
 
 # DEPRECATED Methods still in used in different Spiders
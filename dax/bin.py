@@ -104,7 +104,7 @@ def launch_jobs(settings_path, logfile, debug, projects=None, sessions=None,
 
 # TODO:BenM/assessor_of_assessor/starting point
 def build(settings_path, logfile, debug, projects=None, sessions=None,
-          mod_delta=None, proj_lastrun=None):
+          mod_delta=None, proj_lastrun=None, incremental=False):
     """
     Method that is responsible for running all modules and putting assessors
      into the database
@@ -114,6 +114,8 @@ def build(settings_path, logfile, debug, projects=None, sessions=None,
     :param debug: Should debug mode be used
     :param projects: Project(s) that need to be built
     :param sessions: Session(s) that need to be built
+    :param incremental: only build the subjects with sessions modified since
+     the last build
     :return: None
 
     """
@@ -124,7 +126,8 @@ def build(settings_path, logfile, debug, projects=None, sessions=None,
     lockfile_prefix = os.path.splitext(os.path.basename(settings_path))[0]
     try:
         _launcher_obj.build(lockfile_prefix, projects, sessions,
-                            mod_delta=mod_delta, proj_lastrun=proj_lastrun)
+                            mod_delta=mod_delta, proj_lastrun=proj_lastrun,
+                            incremental=incremental)
     except KeyboardInterrupt:
         logger.warn('Killed by user.')
         flagfile = os.path.join(os.path.join(
@@ -22,6 +22,14 @@ from .errors import ClusterError
 __copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
 DAX_SETTINGS = DAX_Settings()
 MAX_TRACE_DAYS = 30
+# Status of all the jobs in the queue, loaded once per run by
+# load_job_statuses(), and of the jobs polled since. None when job_status()
+# polls each job.
+_JOB_STATUSES = None
+# Usage of the jobs finished during the run, loaded by load_jobs_usage()
+_JOBS_USAGE = None
+# Number of job ids given to one call of cmd_get_all_jobs_usage
+JOBS_USAGE_CHUNK = 500
 # Logger to print logs
 LOGGER = logging.getLogger('dax')
 
@@ -74,22 +82,89 @@ def job_status(jobid):
     :return: job status
 
     """
+    statuses = _JOB_STATUSES
+    if statuses is not None and str(jobid) in statuses:
+        return statuses[str(jobid)]
+
+    # A job missing from the listing may have finished or may not be
+    # covered by it (e.g. submitted by another user): poll the job
     cmd = DAX_SETTINGS.get_cmd_get_job_status()\
                       .safe_substitute({'jobid': jobid})
     try:
         output = sb.check_output(cmd, stderr=sb.STDOUT, shell=True)
-        output = output.strip()
-        if output == DAX_SETTINGS.get_running_status():
-            return 'R'
-        elif output == DAX_SETTINGS.get_queue_status():
-            return 'Q'
-        elif output == DAX_SETTINGS.get_complete_status() or len(output) == 0:
-            return 'C'
-        else:
-            return None
+        status = parse_job_status(output.strip())
     except sb.CalledProcessError:
         return None
 
+    if statuses is not None:
+        statuses[str(jobid)] = status
+    return status
+
+
+def parse_job_status(output):
+    """
+    Convert the status printed by the scheduler to the dax job status
+
+    :param output: status string from the scheduler
+    :return: 'R', 'Q', 'C' or None if unknown
+    """
+    if output == DAX_SETTINGS.get_running_status():
+        return 'R'
+    elif output == DAX_SETTINGS.get_queue_status():
+        return 'Q'
+    elif output == DAX_SETTINGS.get_complete_status() or len(output) == 0:
+        return 'C'
+    else:
+        return None
+
+
+def load_job_statuses():
+    """
+    Get the status of all the jobs in the queue with one call to the scheduler
+
+    The statuses are kept until clear_job_statuses() is called and
+    job_status() uses them instead of polling each job, the jobs not listed
+    are still polled one by one. Nothing is loaded if
+    cmd_get_all_jobs_status is not set in the settings or if the command
+    fails, job_status() then polls each job.
+
+    :return: dictionary of jobid: job status, None if not loaded
+    """
+    global _JOB_STATUSES
+    _JOB_STATUSES = None
+    template = DAX_SETTINGS.get_cmd_get_all_jobs_status()
+    if not template:
+        return None
+
+    cmd = template.safe_substitute({})
+    try:
+        output = sb.check_output(cmd, stderr=sb.STDOUT, shell=True)
+    except sb.CalledProcessError as err:
+        LOGGER.warn('failed to get the status of all the jobs, checking each \
+job instead: %s' % err)
+        return None
+
+    statuses = dict()
+    for line in output.strip().splitlines():
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        statuses[fields[0]] = parse_job_status(fields[1])
+
+    LOGGER.info('%d jobs found in the queue' % len(statuses))
+    _JOB_STATUSES = statuses
+    return statuses
+
+
+def clear_job_statuses():
+    """
+    Forget the statuses loaded by load_job_statuses()
+
+    :return: None
+    """
+    global _JOB_STATUSES
+    _JOB_STATUSES = None
+
 
 def is_traceable_date(jobdate):
     """
@@ -114,6 +189,9 @@ def tracejob_info(jobid, jobdate):
     :param jobdate: launching date of the job
     :return: dictionary object with 'mem_used', 'walltime_used', 'jobnode'
     """
+    if _JOBS_USAGE is not None and str(jobid) in _JOBS_USAGE:
+        return dict(_JOBS_USAGE[str(jobid)])
+
     time_s = datetime.strptime(jobdate, "%Y-%m-%d")
     diff_days = (datetime.today() - time_s).days + 1
     jobinfo = dict()
@@ -124,6 +202,66 @@ def tracejob_info(jobid, jobdate):
     return jobinfo
 
 
+def load_jobs_usage(jobids, jobdate):
+    """
+    Get the usage of a list of jobs with one call to the scheduler
+
+    The usage is kept until clear_jobs_usage() is called and tracejob_info()
+    uses it instead of tracing each job. Nothing is loaded if
+    cmd_get_all_jobs_usage is not set in the settings. The jobs missing from
+    the output are still traced one by one.
+
+    :param jobids: list of job ids
+    :param jobdate: launching date of the oldest job ("%Y-%m-%d")
+    :return: dictionary of jobid: dictionary with 'mem_used',
+     'walltime_used', 'jobnode', None if not loaded
+    """
+    global _JOBS_USAGE
+    _JOBS_USAGE = None
+    template = DAX_SETTINGS.get_cmd_get_all_jobs_usage()
+    if not template or not jobids:
+        return None
+
+    time_s = datetime.strptime(jobdate, "%Y-%m-%d")
+    diff_days = (datetime.today() - time_s).days + 1
+    jobids = [str(jobid) for jobid in jobids]
+    usage = dict()
+    for i in range(0, len(jobids), JOBS_USAGE_CHUNK):
+        cmd = template.safe_substitute({
+            'jobids': ','.join(jobids[i:i + JOBS_USAGE_CHUNK]),
+            'numberofdays': diff_days})
+        try:
+            output = sb.check_output(cmd, stderr=sb.STDOUT, shell=True)
+        except sb.CalledProcessError as err:
+            LOGGER.warn('failed to get the usage of the jobs, tracing each \
+job instead: %s' % err)
+            continue
+
+        for line in output.strip().splitlines():
+            fields = line.split(None, 3)
+            if not fields:
+                continue
+            fields += [''] * (4 - len(fields))
+            usage[fields[0]] = {'mem_used': fields[1],
+                                'walltime_used': fields[2],
+                                'jobnode': fields[3].strip()}
+
+    LOGGER.info('usage found for %d/%d finished jobs'
+                % (len(usage), len(jobids)))
+    _JOBS_USAGE = usage
+    return usage
+
+
+def clear_jobs_usage():
+    """
+    Forget the usage loaded by load_jobs_usage()
+
+    :return: None
+    """
+    global _JOBS_USAGE
+    _JOBS_USAGE = None
+
+
 def get_job_mem_used(jobid, diff_days):
     """
     Get the memory used for the task from cluster
@@ -428,6 +428,25 @@ class DAX_Settings(object):
             return ''
         return self.read_file_and_return_template(filepath)
 
+    def get_cmd_get_all_jobs_status(self):
+        """Get the cmd_get_all_jobs_status value from the cluster section.
+
+        The command prints one line "<jobid> <status>" for each job of the
+        user in the queue. It is optional: the status of each job is checked
+        with cmd_get_job_status if not set.
+
+        :return: Template class of the file containing the command,
+         '' if empty or if the file doesn't exist
+        """
+        filepath = self.get('cluster', 'cmd_get_all_jobs_status')
+        if filepath is None:
+            return ''
+        if filepath.startswith('~/'):
+            filepath = os.path.join(self.get_user_home(), filepath)
+        if not os.path.isfile(filepath):
+            return ''
+        return self.read_file_and_return_template(filepath)
+
     def get_queue_status(self):
         """Get the queue_status value from the cluster section.
 
@@ -503,6 +522,26 @@ class DAX_Settings(object):
             return ''
         return self.read_file_and_return_template(filepath)
 
+    def get_cmd_get_all_jobs_usage(self):
+        """Get the cmd_get_all_jobs_usage value from the cluster section.
+
+        The command prints one line "<jobid> <memory> <walltime> <node>" for
+        each job in ${jobids} (comma separated) that ran during the last
+        ${numberofdays} days. It is optional: the usage of each job is
+        traced with cmd_get_job_memory/walltime/node if not set.
+
+        :return: Template class of the file containing the command,
+         '' if empty or if the file doesn't exist
+        """
+        filepath = self.get('cluster', 'cmd_get_all_jobs_usage')
+        if filepath is None:
+            return ''
+        if filepath.startswith('~/'):
+            filepath = os.path.join(self.get_user_home(), filepath)
+        if not os.path.isfile(filepath):
+            return ''
+        return self.read_file_and_return_template(filepath)
+
     def get_job_extension_file(self):
         """Get the job_extension_file value from the cluster section.
 
@@ -609,6 +648,156 @@ class DAX_Settings(object):
         """
         return self.get('cluster', 'upload_threads')
 
+    def get_upload_zip_max_size(self):
+        """
+        Get the size up to which a folder is uploaded to XNAT as one zip
+        (see XnatUtils.upload_folder_to_obj), bigger folders are uploaded
+        file by file
+
+        :return: int of the upload_zip_max_size value in MB, 1024 if empty
+        """
+        if self.get('cluster', 'upload_zip_max_size'):
+            return int(self.get('cluster', 'upload_zip_max_size'))
+        else:
+            return 1024
+
+    def get_upload_put_workers(self):
+        """
+        Get the number of files of a folder uploaded concurrently to XNAT
+
+        :return: int of the upload_put_workers value, 4 if empty
+        """
+        if self.get('cluster', 'upload_put_workers'):
+            return int(self.get('cluster', 'upload_put_workers'))
+        else:
+            return 4
+
+    def get_build_workers(self):
+        """
+        Get the number of subjects built concurrently by the launcher
+
+        :return: int of the build_workers value, 1 if empty
+        """
+        if self.get('cluster', 'build_workers'):
+            return int(self.get('cluster', 'build_workers'))
+        else:
+            return 1
+
+    def get_build_pool_type(self):
+        """
+        Get the type of worker pool used to build the subjects
+
+        :return: String of the pool type: thread or process. Default: thread
+        """
+        pool_type = self.get('cluster', 'build_pool_type')
+        if pool_type is None:
+            return 'thread'
+        return pool_type.strip().lower()
+
+    def get_build_projects(self):
+        """
+        Get the number of projects built concurrently by the launcher
+
+        :return: int of the build_projects value, 1 if empty
+        """
+        if self.get('cluster', 'build_projects'):
+            return int(self.get('cluster', 'build_projects'))
+        else:
+            return 1
+
+    def get_launch_workers(self):
+        """
+        Get the number of jobs submitted concurrently by the launcher
+
+        :return: int of the launch_workers value, 1 if empty
+        """
+        if self.get('cluster', 'launch_workers'):
+            return int(self.get('cluster', 'launch_workers'))
+        else:
+            return 1
+
+    def get_launch_resync_jobs(self):
+        """
+        Get the number of submissions before counting the jobs in the queue
+         on the cluster again
+
+        :return: int of the launch_resync_jobs value, 1 if empty
+        """
+        if self.get('cluster', 'launch_resync_jobs'):
+            return int(self.get('cluster', 'launch_resync_jobs'))
+        else:
+            return 1
+
+    def get_launch_resync_seconds(self):
+        """
+        Get the number of seconds before counting the jobs in the queue
+         on the cluster again
+
+        :return: int of the launch_resync_seconds value, 60 if empty
+        """
+        if self.get('cluster', 'launch_resync_seconds'):
+            return int(self.get('cluster', 'launch_resync_seconds'))
+        else:
+            return 60
+
+    def get_update_workers(self):
+        """
+        Get the number of tasks updated concurrently by the launcher
+
+        :return: int of the update_workers value, 1 if empty
+        """
+        if self.get('cluster', 'update_workers'):
+            return int(self.get('cluster', 'update_workers'))
+        else:
+            return 1
+
+    def get_update_task_timeout(self):
+        """
+        Get the number of seconds before giving up on the update of a task
+
+        :return: int of the update_task_timeout value, 0 (no timeout) if empty
+        """
+        if self.get('cluster', 'update_task_timeout'):
+            return int(self.get('cluster', 'update_task_timeout'))
+        else:
+            return 0
+
+    def get_session_cache_size(self):
+        """
+        Get the maximum size of the session XML cache in the results_dir
+
+        :return: int of the session_cache_size value in MB, 0 if empty
+        """
+        if self.get('cluster', 'session_cache_size'):
+            return int(self.get('cluster', 'session_cache_size'))
+        else:
+            return 0
+
+    def get_diskq_store(self):
+        """
+        Get the backend storing the attributes of the DiskQ tasks
+
+        :return: String of the diskq_store value ('files' or 'sqlite'),
+         'files' if empty
+        """
+        if self.get('cluster', 'diskq_store'):
+            return self.get('cluster', 'diskq_store').lower()
+        else:
+            return 'files'
+
+    def get_xnat_max_connections(self):
+        """
+        Get the maximum number of connections to a XNAT host shared by the
+        interfaces of a process
+
+        :return: int of the xnat_max_connections value, 0 if empty.
+         0 disables the sharing of the XNAT sessions.
+        """
+        if self.get('cluster', 'xnat_max_connections'):
+            return int(self.get('cluster', 'xnat_max_connections'))
+        else:
+            return 0
+
     def get_api_url(self):
         """Get the api_url value from the dax_manager section.
 
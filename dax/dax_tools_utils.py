@@ -43,7 +43,8 @@ if sys.version_info[0] == 2:
 else:
     import configparser
 
-from multiprocessing import Pool
+import matplotlib.image
+from multiprocessing.pool import ThreadPool
 
 from . import bin
 from . import launcher
@@ -51,6 +52,7 @@ from . import log
 from . import modules
 from . import processors
 from . import task
+from . import utilities
 from . import xnat_tools_utils
 from . import XnatUtils
 from . import assessor_utils
@@ -100,12 +102,14 @@ CLUSTER_DEFAULTS = OrderedDict([
     ('suffix_jobid', ''),
     ('cmd_count_nb_jobs', ''),
     ('cmd_get_job_status', ''),
+    ('cmd_get_all_jobs_status', ''),
     ('queue_status', ''),
     ('running_status', ''),
     ('complete_status', ''),
     ('cmd_get_job_memory', ''),
     ('cmd_get_job_walltime', ''),
     ('cmd_get_job_node', ''),
+    ('cmd_get_all_jobs_usage', ''),
     ('job_extension_file', '.pbs'),
     ('job_template', ''),
     ('email_opts', 'a'),
@@ -205,6 +209,9 @@ containing the command used to count the number of jobs in the queue: ',
     'cmd_get_job_status': {'msg': 'Please enter the full path to text file \
 containing the command used to check the running status of a job: ',
                            'is_path': True},
+    'cmd_get_all_jobs_status': {'msg': 'Please enter the full path to text \
+file containing the command used to list the status of all your jobs \
+(one "<jobid> <status>" per line, optional): ', 'is_path': True},
     'queue_status': {'msg': 'Please enter the string the job scheduler would \
 use to indicate that a job is "in the queue": ', 'is_path': False},
     'running_status': {'msg': 'Please enter the string the job scheduler \
@@ -220,6 +227,10 @@ file containing the command used to see how much walltime a job used: ',
     'cmd_get_job_node': {'msg': 'Please enter the full path to the text file \
 containing the command used to see which node a job used: ',
                          'is_path': True},
+    'cmd_get_all_jobs_usage': {'msg': 'Please enter the full path to the text \
+file containing the command used to get the memory, walltime and node used by \
+a list of jobs (one "<jobid> <memory> <walltime> <node>" per line, \
+optional): ', 'is_path': True},
     'job_extension_file': {'msg': 'Please enter an extension for the job \
 batch file: ', 'is_path': False},
     'job_template': {'msg': 'Please enter the full path to the text file \
@@ -290,6 +301,8 @@ DEFAULT_SGE_DICT = {'cmd_submit': 'qsub',
                     'cmd_get_job_node': "echo ''\n",
                     'cmd_get_job_status': "qstat -u $USER | grep ${jobid} \
 | awk {'print $5'}\n",
+                    'cmd_get_all_jobs_status': "qstat -u $USER | tail -n +3 \
+| awk {'print $1, $5'}\n",
                     'cmd_get_job_walltime': "echo ''\n",
                     'job_extension_file': '.pbs',
                     'job_template': SGE_TEMPLATE,
@@ -333,8 +346,14 @@ MaxRss --noheader | awk '{print $1+0}'\n",
 NodeList --noheader\n',
                       'cmd_get_job_status': 'slurm_load_jobs error: Invalid \
 job id specified\n',
+                      'cmd_get_all_jobs_status': "squeue -u $USER --noheader \
+-o '%i %t' | sed 's/ PD$/ Q/'\n",
                       'cmd_get_job_walltime': 'sacct -j ${jobid}.batch \
 --format CPUTime --noheader\n',
+                      'cmd_get_all_jobs_usage': "sacct -j ${jobids} \
+--starttime $(date -d '-${numberofdays} days' +%Y-%m-%d) --noheader \
+--parsable2 --format JobID,MaxRSS,CPUTime,NodeList | awk -F'|' \
+'$1 ~ /\\.batch$/ {sub(/\\.batch$/, \"\", $1); print $1, $2+0, $3, $4}'\n",
                       'job_extension_file': '.slurm',
                       'job_template': SLURM_TEMPLATE,
                       'email_opts': 'FAIL'}
@@ -376,6 +395,8 @@ ${jobid}'2> /dev/null | awk -v FS='(resources_used.mem=|kb)' '{print $2}' \
     'cmd_get_job_node': "echo ''\n",
     'cmd_get_job_status': "qstat -f ${jobid} | grep job_state \
 | awk {'print $3'}\n",
+    'cmd_get_all_jobs_status': "qstat -u $USER | tail -n +6 \
+| awk {'split($1, id, \".\"); print id[1], $10'}\n",
     'cmd_get_job_walltime': "rsh vmpsched 'tracejob -n ${numberofdays} \
 ${jobid}' 2> /dev/null | awk -v FS='(resources_used.walltime=|\n)' \
 '{print $2}' | sort -u | tail -1\n",
@@ -406,12 +427,12 @@ FLAGFILE_TEMPLATE = os.path.join(RESULTS_DIR, _FLAG_FILES,
                                  'Process_Upload_running')
 SNAPSHOTS_ORIGINAL = 'snapshot_original.png'
 SNAPSHOTS_PREVIEW = 'snapshot_preview.png'
+SNAPSHOTS_PREVIEW_HEIGHT = 200
 DEFAULT_HEADER = ['host', 'username', 'password', 'projects']
 
 # Cmd:
 GS_CMD = """gs -q -o {original} -sDEVICE=pngalpha -dLastPage=1 {assessor_path}\
 /PDF/*.pdf"""
-CONVERT_CMD = """convert {original} -resize x200 {preview}"""
 
 # WARNING content for emails
 WARNING_START_CONTENT = """
@@ -846,6 +867,9 @@ def generate_snapshots(assessor_path):
     """
     Generate Snapshots from the PDF if it exists.
 
+    The original snapshot saved by the spider (see spiders.render_report) is
+    used when it exists instead of rendering the first page of the PDF.
+
     :param assessor_path: path for the assessor
     :return: None
     """
@@ -864,10 +888,22 @@ def generate_snapshots(assessor_path):
     # Create the preview snapshot from the original if Snapshots exist :
     if os.path.exists(snapshot_original):
         LOGGER.debug('    +creating preview of SNAPSHOTS')
-        # Make the snapshot_thumbnail
-        cmd = CONVERT_CMD.format(original=snapshot_original,
-                                 preview=snapshot_preview)
-        os.system(cmd)
+        make_snapshot_preview(snapshot_original, snapshot_preview)
+
+
+def make_snapshot_preview(snapshot_original, snapshot_preview,
+                          height=SNAPSHOTS_PREVIEW_HEIGHT):
+    """
+    Resize the original snapshot to make the preview
+
+    :param snapshot_original: path to the original png
+    :param snapshot_preview: path to the preview png to write
+    :param height: height of the preview in pixels
+    :return: None
+    """
+    rows = matplotlib.image.imread(snapshot_original).shape[0]
+    matplotlib.image.thumbnail(snapshot_original, snapshot_preview,
+                               scale=float(height) / rows)
 
 
 def copy_outlog(assessor_dict, assessor_path):
@@ -983,24 +1019,27 @@ def should_upload_assessor(assessor_obj, assessor_dict, assessor_path, version):
     return True
 
 
-def upload_assessor(xnat, assessor_dict, assessor_path):
+def upload_assessor(xnat, assessor_dict, assessor_path, session_obj=None):
     """
     Upload results to an assessor
 
     :param xnat: pyxnat.Interface object
     :param assessor_dict: assessor dictionary
-    :return: None
+    :param session_obj: pyxnat session EObject of the assessor, already
+     checked to exist. Selected from assessor_dict if None
+    :return: True if uploaded, False/None otherwise
     """
     # get spiderpath from version.txt file:
     version = get_version_assessor(assessor_path)
     dax_docker_version = get_dax_docker_version_assessor(assessor_path)
-    session_obj = XnatUtils.select_obj(xnat,
-                                       assessor_dict['project_id'],
-                                       assessor_dict['subject_label'],
-                                       assessor_dict['session_label'])
-    if not session_obj.exists():
-        LOGGER.error('Cannot upload assessor, session does not exist.')
-        return True
+    if session_obj is None:
+        session_obj = XnatUtils.select_obj(xnat,
+                                           assessor_dict['project_id'],
+                                           assessor_dict['subject_label'],
+                                           assessor_dict['session_label'])
+        if not session_obj.exists():
+            LOGGER.error('Cannot upload assessor, session does not exist.')
+            return True
 
     # Select assessor
     assessor_dict =\
@@ -1073,6 +1112,9 @@ unable to find XML file: %s'
             assessor_obj.attrs.set(xsitype + '/procstatus', READY_TO_COMPLETE)
         else:
             assessor_obj.attrs.set(xsitype + '/procstatus', JOB_FAILED)
+        XnatUtils.invalidate_session(assessor_dict['project_id'],
+                                     assessor_dict['subject_label'],
+                                     assessor_dict['session_label'])
 
         # Remove the folder
         shutil.rmtree(assessor_path)
@@ -1165,57 +1207,135 @@ def upload_snapshots(assessor_obj, resource_path):
         except XnatUtilsError as err:
             print(ERR_MSG % err)
 
-def upload_assessors(xnat, projects):
+def upload_assessors(xnat, projects, interface_args=None):
     """
     Upload all assessors to XNAT
 
-    :param xnat: pyxnat.Interface object
+    The assessors are grouped by session and upload_threads workers upload
+    the sessions concurrently. Each worker opens its own interface (sharing
+    the pooled XNAT connections) when interface_args is given.
+
+    :param xnat: pyxnat.Interface object, used by all the workers if
+     interface_args is None
     :param projects: list of projects to upload to XNAT
-    :return: None
+    :param interface_args: dictionary of the host, user and pwd arguments of
+     XnatUtils.get_interface for the interfaces of the workers
+    :return: list of warnings for the assessors not uploaded
     """
     # Get the assessor label from the directory :
     assessors_list = get_assessor_list(projects)
-    number_of_processes = len(assessors_list)
-    warnings = list()
+    sessions = OrderedDict()
+    for index, assessor_label in enumerate(assessors_list):
+        try:
+            assessor_dict =\
+                assessor_utils.parse_full_assessor_name(assessor_label)
+        except ValueError:
+            LOGGER.warn('     --> wrong label: %s' % assessor_label)
+            continue
+        key = (assessor_dict['project_id'], assessor_dict['subject_label'],
+               assessor_dict['session_label'])
+        sessions.setdefault(key, list()).append((index, assessor_label))
+
+    num_threads = int(DAX_SETTINGS.get_upload_threads() or 1)
+    num_threads = max(1, min(num_threads, len(sessions)))
+    LOGGER.info('Uploading %d assessors of %d sessions with %d threads'
+                % (len(assessors_list), len(sessions), num_threads))
+
+    def upload_session(item):
+        session_key, assessors = item
+        if interface_args is None:
+            return upload_session_assessors(xnat, session_key, assessors,
+                                            len(assessors_list))
+        with XnatUtils.get_interface(**interface_args) as intf:
+            return upload_session_assessors(intf, session_key, assessors,
+                                            len(assessors_list))
+
+    start = time.time()
+    pool = ThreadPool(num_threads)
+    try:
+        results = pool.map(upload_session, list(sessions.items()))
+    finally:
+        pool.close()
+        pool.join()
 
-    num_threads = int(DAX_SETTINGS.get_upload_threads())
+    results = list(itertools.chain.from_iterable(results))
+    return report_upload_results(results, time.time() - start)
 
-    print('Starting pool with: ' + str(num_threads) + ' threads')
-    sys.stdout.flush()
 
-    pool = Pool(processes=num_threads) 
-    for index, assessor_label in enumerate(assessors_list):
-        print(index)
-        sys.stdout.flush()
+def upload_session_assessors(xnat, session_key, assessors,
+                             number_of_processes):
+    """
+    Upload the assessors of a session, the session is selected once
+
+    :param xnat: pyxnat.Interface object
+    :param session_key: tuple (project ID, subject label, session label)
+    :param assessors: list of tuples (index, assessor label)
+    :param number_of_processes: total number of assessors to upload
+    :return: list of dictionaries with the label, status (uploaded,
+     not uploaded, failed or no session), bytes and seconds of each assessor
+    """
+    results = list()
+    session_obj = XnatUtils.select_obj(xnat, *session_key)
+    session_exists = session_obj.exists()
+    for index, assessor_label in assessors:
+        assessor_path = os.path.join(RESULTS_DIR, assessor_label)
+        msg = "    *Process: %s/%s -- label: %s / time: %s"
+        LOGGER.info(msg % (str(index + 1), str(number_of_processes),
+                           assessor_label, str(datetime.now())))
+        result = {'label': assessor_label, 'status': 'no session',
+                  'bytes': utilities.get_disk_size(assessor_path),
+                  'seconds': 0, 'error': None}
+        results.append(result)
+        if not session_exists:
+            LOGGER.error('Cannot upload assessor, session does not exist.')
+            continue
 
-        pool.apply_async(upload_thread,[xnat, index, assessor_label, number_of_processes])
-    
-    print('Waiting for pool to finish...')
-    sys.stdout.flush()
+        start = time.time()
+        try:
+            assessor_dict =\
+                assessor_utils.parse_full_assessor_name(assessor_label)
+            if upload_assessor(xnat, assessor_dict, assessor_path,
+                               session_obj=session_obj):
+                result['status'] = 'uploaded'
+            else:
+                result['status'] = 'not uploaded'
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = str(e)
+            LOGGER.error('failed to upload assessor %s: %s'
+                         % (assessor_label, e))
+            LOGGER.debug(traceback.format_exc())
+        result['seconds'] = time.time() - start
+
+    return results
 
-    pool.close()
-    pool.join()
 
-    print('Pool finished')
-    sys.stdout.flush()    
+def report_upload_results(results, duration):
+    """
+    Log the results of the upload of the assessors
 
+    :param results: list of results from upload_session_assessors
+    :param duration: duration of the upload in seconds
+    :return: list of warnings for the assessors not uploaded
+    """
+    warnings = list()
+    uploaded = [r for r in results if r['status'] == 'uploaded']
+    nb_bytes = sum(r['bytes'] for r in uploaded)
+    duration = max(duration, 0.001)
+    LOGGER.info('Uploaded %d/%d assessors in %.1fs: %.1f uploads/min, '
+                '%.0f bytes/s' % (len(uploaded), len(results), duration,
+                                  len(uploaded) * 60.0 / duration,
+                                  nb_bytes / duration))
+
+    mess = """    - Assessor label : {label}\n"""
+    for result in results:
+        if result['status'] in ['not uploaded', 'failed']:
+            LOGGER.warn('    - %s: %s%s' % (
+                result['label'], result['status'],
+                ' (%s)' % result['error'] if result['error'] else ''))
+            warnings.append(mess.format(label=result['label']))
     return warnings
 
-def upload_thread(xnat, index, assessor_label, number_of_processes):
-    assessor_path = os.path.join(RESULTS_DIR, assessor_label)
-    msg = "    *Process: %s/%s -- label: %s / time: %s"
-    LOGGER.info(msg % (str(index + 1), str(number_of_processes),
-                       assessor_label, str(datetime.now())))
-
-    #assessor_dict = get_assessor_dict(assessor_label, assessor_path)
-    assessor_dict = assessor_utils.parse_full_assessor_name(assessor_label)
-    if assessor_dict:
-        uploaded = upload_assessor(xnat, assessor_dict, assessor_path)
-        if not uploaded:
-            mess = """    - Assessor label : {label}\n"""
-            warnings.append(mess.format(label=assessor_dict['label']))
-    else:
-        LOGGER.warn('     --> wrong label')
 
 def upload_pbs(xnat, projects):
     """
@@ -1431,7 +1551,11 @@ def upload_results(upload_settings, emailaddress):
                     LOGGER.info('using upload by reference, dir is:{}'.format(
                         DAX_SETTINGS.get_reference_dir()))
 
-                warnings.extend(upload_assessors(intf, upload_dict['projects']))
+                interface_args = {'host': upload_dict['host'],
+                                  'user': upload_dict['username'],
+                                  'pwd': upload_dict['password']}
+                warnings.extend(upload_assessors(
+                    intf, upload_dict['projects'], interface_args))
 
                 # 2) Upload the PBS files
                 # For each file, upload it to the PBS resource
@@ -0,0 +1,405 @@
+""" diskq_store.py: storage of the attributes of the DiskQ tasks """
+
+from builtins import object
+
+from collections import defaultdict
+import errno
+import logging
+import os
+import sqlite3
+
+from .dax_settings import DAX_Settings
+from .errors import DaxSetupError
+
+
+__copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
+__all__ = ['FileTaskStore', 'SQLiteTaskStore', 'get_diskq_store',
+           'migrate_diskq']
+DAX_SETTINGS = DAX_Settings()
+LOGGER = logging.getLogger('dax')
+# Attributes of a ClusterTask saved in the DiskQ
+TASK_ATTRIBUTES = ['jobid', 'jobnode', 'procstatus', 'walltimeused',
+                   'memused', 'jobstartdate']
+DISKQ_STORE_TYPES = ['files', 'sqlite']
+DB_FILENAME = 'diskq.sqlite'
+CREATE_TABLE = '''CREATE TABLE IF NOT EXISTS attrs (
+    label TEXT NOT NULL,
+    project TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (label, name))'''
+CREATE_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS attrs_name_value ON attrs (name, value)',
+    'CREATE INDEX IF NOT EXISTS attrs_project ON attrs (project)']
+
+_DISKQ_STORES = dict()
+
+
+def _project_of(label):
+    """ Project ID from an assessor label (proj-x-subj-x-sess-x-...) """
+    return label.split('-x-')[0]
+
+
+class FileTaskStore(object):
+    """
+    Task attributes saved one per file in the DiskQ: <diskq>/<attr>/<label>
+
+    This is the original layout of the DiskQ. Every attribute is one file
+    to open, so only the procstatus is preloaded with the queue and the
+    other attributes are read when a task needs them.
+    """
+    PRELOAD_ATTRIBUTES = ['procstatus']
+
+    def __init__(self, diskq):
+        """
+        Entry point for the FileTaskStore class
+
+        :param diskq: path to the DiskQ folder
+        :return: None
+        """
+        self.diskq = diskq
+
+    def attr_path(self, label, name):
+        """
+        Path of the file storing an attribute of a task
+
+        :param label: assessor label
+        :param name: attribute name
+        :return: path to the file
+        """
+        return os.path.join(self.diskq, name, label)
+
+    def get_attr(self, label, name):
+        """
+        Get an attribute of a task
+
+        :param label: assessor label
+        :param name: attribute name
+        :return: string value or None if not set
+        """
+        apath = self.attr_path(label, name)
+        if not os.path.exists(apath):
+            return None
+
+        with open(apath, 'r') as f:
+            return f.read().strip()
+
+    def set_attr(self, label, name, value):
+        """
+        Set an attribute of a task
+
+        :param label: assessor label
+        :param name: attribute name
+        :param value: value to set
+        :return: None
+        """
+        self.set_attrs(label, {name: value})
+
+    def set_attrs(self, label, attrs):
+        """
+        Set several attributes of a task
+
+        :param label: assessor label
+        :param attrs: dictionary of attribute name: value
+        :return: None
+        """
+        for name, value in attrs.items():
+            apath = self.attr_path(label, name)
+            try:
+                os.makedirs(os.path.dirname(apath))
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+            with open(apath, 'w') as f:
+                f.write(str(value) + '\n')
+
+    def set_many(self, tasks_attrs):
+        """
+        Set the attributes of several tasks
+
+        :param tasks_attrs: dictionary of label: dictionary of attributes
+        :return: None
+        """
+        for label, attrs in tasks_attrs.items():
+            self.set_attrs(label, attrs)
+
+    def delete_attr(self, label, name):
+        """
+        Delete an attribute of a task
+
+        :param label: assessor label
+        :param name: attribute name
+        :return: None
+        """
+        try:
+            os.remove(self.attr_path(label, name))
+        except OSError:
+            pass
+
+    def delete(self, label):
+        """
+        Delete all the attributes of a task
+
+        :param label: assessor label
+        :return: None
+        """
+        for name in TASK_ATTRIBUTES:
+            self.delete_attr(label, name)
+
+    def load_attrs(self, projects=None, status=None, labels=None,
+                   names=None):
+        """
+        Get the attributes of all the tasks
+
+        :param projects: list of project IDs to keep, None for all
+        :param status: only keep the tasks with this procstatus, None for all
+        :param labels: list of the assessor labels to keep, None for all
+        :param names: list of the attributes to load, None for all
+        :return: dictionary of label: dictionary of attributes
+        """
+        names = list(names or TASK_ATTRIBUTES)
+        if status and 'procstatus' not in names:
+            names.append('procstatus')
+
+        tasks_attrs = defaultdict(dict)
+        for name in names:
+            attr_dir = os.path.join(self.diskq, name)
+            if not os.path.isdir(attr_dir):
+                continue
+            # Only the files of the labels asked for are opened
+            if labels is None:
+                attr_labels = os.listdir(attr_dir)
+            else:
+                attr_labels = [label for label in labels
+                               if os.path.exists(self.attr_path(label, name))]
+            for label in attr_labels:
+                if projects and _project_of(label) not in projects:
+                    continue
+                tasks_attrs[label][name] = self.get_attr(label, name)
+
+        if status:
+            return dict((label, attrs) for label, attrs in tasks_attrs.items()
+                        if attrs.get('procstatus') == status)
+        return dict(tasks_attrs)
+
+
+class SQLiteTaskStore(object):
+    """
+    Task attributes saved in a SQLite database in the DiskQ
+
+    Every write is a transaction so a task is never left half updated and
+    the queue can be loaded or filtered by status/project with one query.
+    The database uses the WAL journal, so all the dax commands using the
+    DiskQ must run on the same host (WAL does not work across NFS clients).
+    """
+    PRELOAD_ATTRIBUTES = None
+
+    def __init__(self, diskq, db_path=None):
+        """
+        Entry point for the SQLiteTaskStore class
+
+        :param diskq: path to the DiskQ folder
+        :param db_path: path to the SQLite database,
+         default: <diskq>/diskq.sqlite
+        :return: None
+        """
+        self.diskq = diskq
+        self.db_path = db_path or os.path.join(diskq, DB_FILENAME)
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(CREATE_TABLE)
+            for index in CREATE_INDEXES:
+                conn.execute(index)
+
+    def _connect(self):
+        # One connection per call: launcher and upload share the database
+        return _ClosingConnection(sqlite3.connect(self.db_path, timeout=60))
+
+    def get_attr(self, label, name):
+        """
+        Get an attribute of a task
+
+        :param label: assessor label
+        :param name: attribute name
+        :return: string value or None if not set
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT value FROM attrs WHERE label = ? AND name = ?',
+                (label, name)).fetchone()
+        return row[0] if row else None
+
+    def set_attr(self, label, name, value):
+        """
+        Set an attribute of a task
+
+        :param label: assessor label
+        :param name: attribute name
+        :param value: value to set
+        :return: None
+        """
+        self.set_attrs(label, {name: value})
+
+    def set_attrs(self, label, attrs):
+        """
+        Set several attributes of a task in one transaction
+
+        :param label: assessor label
+        :param attrs: dictionary of attribute name: value
+        :return: None
+        """
+        self.set_many({label: attrs})
+
+    def set_many(self, tasks_attrs):
+        """
+        Set the attributes of several tasks in one transaction
+
+        :param tasks_attrs: dictionary of label: dictionary of attributes
+        :return: None
+        """
+        rows = [(label, _project_of(label), name, str(value))
+                for label, attrs in tasks_attrs.items()
+                for name, value in attrs.items()]
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO attrs VALUES (?, ?, ?, ?)', rows)
+
+    def delete_attr(self, label, name):
+        """
+        Delete an attribute of a task
+
+        :param label: assessor label
+        :param name: attribute name
+        :return: None
+        """
+        with self._connect() as conn:
+            conn.execute('DELETE FROM attrs WHERE label = ? AND name = ?',
+                         (label, name))
+
+    def delete(self, label):
+        """
+        Delete all the attributes of a task
+
+        :param label: assessor label
+        :return: None
+        """
+        with self._connect() as conn:
+            conn.execute('DELETE FROM attrs WHERE label = ?', (label,))
+
+    def load_attrs(self, projects=None, status=None, labels=None,
+                   names=None):
+        """
+        Get the attributes of all the tasks
+
+        :param projects: list of project IDs to keep, None for all
+        :param status: only keep the tasks with this procstatus, None for all
+        :param labels: list of the assessor labels to keep, None for all
+        :param names: list of the attributes to load, None for all
+        :return: dictionary of label: dictionary of attributes
+        """
+        query = 'SELECT label, name, value FROM attrs'
+        where = list()
+        params = list()
+        if projects:
+            where.append('project IN (%s)' % ','.join('?' * len(projects)))
+            params.extend(projects)
+        if names:
+            where.append('name IN (%s)' % ','.join('?' * len(names)))
+            params.extend(names)
+        if status:
+            where.append('label IN (SELECT label FROM attrs WHERE '
+                         'name = ? AND value = ?)')
+            params.extend(['procstatus', status])
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+
+        # The labels are filtered here, the queue can be larger than the
+        # number of parameters allowed in a query
+        labels = set(labels) if labels is not None else None
+        tasks_attrs = defaultdict(dict)
+        with self._connect() as conn:
+            for label, name, value in conn.execute(query, params):
+                if labels is None or label in labels:
+                    tasks_attrs[label][name] = value
+        return dict(tasks_attrs)
+
+
+class _ClosingConnection(object):
+    """ Commit and close a sqlite3 connection at the end of a with block """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        try:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.conn.close()
+
+
+def get_diskq_store(diskq):
+    """
+    Get the store of the task attributes for a DiskQ folder
+
+    The backend is set by diskq_store in dax_settings.ini.
+
+    :param diskq: path to the DiskQ folder
+    :return: FileTaskStore or SQLiteTaskStore object
+    """
+    store = _DISKQ_STORES.get(diskq)
+    if store is not None:
+        return store
+
+    store_type = DAX_SETTINGS.get_diskq_store()
+    if store_type not in DISKQ_STORE_TYPES:
+        err = 'diskq_store must be one of %s, not %s'
+        raise DaxSetupError(err % (DISKQ_STORE_TYPES, store_type))
+
+    if store_type == 'sqlite':
+        db_path = os.path.join(diskq, DB_FILENAME)
+        if not os.path.exists(db_path) and \
+           os.path.isdir(os.path.join(diskq, 'procstatus')):
+            LOGGER.warn('DiskQ %s still uses the file layout, run '
+                        '"dax migrate_diskq" to move it to SQLite.' % diskq)
+        store = SQLiteTaskStore(diskq, db_path)
+    else:
+        store = FileTaskStore(diskq)
+
+    _DISKQ_STORES[diskq] = store
+    return store
+
+
+def migrate_diskq(diskq, remove_files=False):
+    """
+    Copy the task attributes from the file layout to the SQLite database
+
+    The attributes already in the database are overwritten by the files.
+
+    :param diskq: path to the DiskQ folder
+    :param remove_files: remove the attribute files once copied
+    :return: number of tasks migrated
+    """
+    file_store = FileTaskStore(diskq)
+    tasks_attrs = file_store.load_attrs()
+    SQLiteTaskStore(diskq).set_many(tasks_attrs)
+    LOGGER.info('migrated %d tasks from %s to %s'
+                % (len(tasks_attrs), diskq, DB_FILENAME))
+
+    if remove_files:
+        for label in tasks_attrs:
+            file_store.delete(label)
+        for name in TASK_ATTRIBUTES:
+            try:
+                os.rmdir(os.path.join(diskq, name))
+            except OSError:
+                pass
+
+    return len(tasks_attrs)
@@ -8,20 +8,36 @@ from builtins import str
 from builtins import object
 from past.builtins import basestring
 
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+import itertools
+import json
 import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import redcap
 import sys
 import os
+import shutil
+import threading
+import time
 import traceback
 
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
 from . import processors, modules, XnatUtils, task, cluster
-from .task import Task, ClusterTask, XnatTask
+from .task import ClusterTask, XnatTask, LazyTask
 from .dax_settings import DAX_Settings, DAX_Netrc
 from .errors import (ClusterCountJobsException, ClusterLaunchException,
                      DaxXnatError, DaxLauncherError)
 from . import yaml_doc
 from .processor_graph import ProcessorGraph
+from .processor_parser import ProcessorParser
+from .task_updater import TaskUpdater
+from .diskq_store import get_diskq_store
 from .utilities import find_with_pred, groupby_to_dict, groupby_groupby_to_dict
 
 try:
@@ -37,8 +53,36 @@ UPDATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 BUILD_SUFFIX = 'BUILD_RUNNING.txt'
 UPDATE_SUFFIX = 'UPDATE_RUNNING.txt'
 LAUNCH_SUFFIX = 'LAUNCHER_RUNNING.txt'
+BUILD_POOL_TYPES = ['thread', 'process']
+BUILD_STATE_DIRNAME = 'BUILD_STATE'
+# Seconds taken off the high-water mark of an incremental build, for the
+# sessions still being written on XNAT when they were listed
+BUILD_MARK_MARGIN = 300
 # Logger to print logs
 LOGGER = logging.getLogger('dax')
+# Logs of the subject built by the current worker (see SubjectLogFilter)
+_SUBJECT_LOGS = threading.local()
+# Launchers and build arguments shared with the build workers
+_BUILD_CONTEXTS = dict()
+_BUILD_COUNTER = itertools.count()
+
+
+class SubjectLogFilter(logging.Filter):
+    """
+    Filter holding back the records logged while a worker builds a subject
+
+    The records are kept in a buffer local to the worker and emitted all
+    together once the subject is built so the logs stay ordered per subject.
+    """
+    def filter(self, record):
+        records = getattr(_SUBJECT_LOGS, 'records', None)
+        if records is None:
+            return True
+        records.append(record)
+        return False
+
+
+LOGGER.addFilter(SubjectLogFilter())
 
 
 def str_to_timedelta(delta_str):
@@ -86,7 +130,9 @@ class Launcher(object):
                  xnat_user=None, xnat_pass=None, xnat_host=None, cr=None,
                  job_email=None, job_email_options='bae', max_age=7,
                  launcher_type=DAX_SETTINGS.get_launcher_type(),
-                 skip_lastupdate=None):
+                 skip_lastupdate=None,
+                 build_workers=None, build_pool_type=None,
+                 build_projects=None):
 
         """
         Entry point for the Launcher class
@@ -103,6 +149,14 @@ class Launcher(object):
         :param job_email: job email address for report
         :param job_email_options: email options for the jobs
         :param max_age: maximum time before updating again a session
+        :param build_workers: number of subjects built at the same time.
+         Either a number or a dictionary with project name as a key.
+         By default, use the build_workers value from dax_settings.ini.
+        :param build_pool_type: type of pool building the subjects (thread or
+         process). Either a string or a dictionary with project name as a key.
+         By default, use the build_pool_type value from dax_settings.ini.
+        :param build_projects: number of projects built at the same time.
+         By default, use the build_projects value from dax_settings.ini.
         :return: None
         """
         self.queue_limit = queue_limit
@@ -155,6 +209,12 @@ name as a key and list of yaml filepaths as values.'
                 else:
                     self.project_process_dict[project].append(proc)
 
+        # Processors by (xsiType, proctype) to match the assessors
+        self.project_proc_index = dict()
+        for project, proc_list in list(self.project_process_dict.items()):
+            self.project_proc_index[project] = \
+                processors.processors_by_key(proc_list)
+
         if isinstance(priority_project, list):
             self.priority_project = priority_project
         elif isinstance(priority_project, basestring):
@@ -169,6 +229,9 @@ name as a key and list of yaml filepaths as values.'
             self.skip_lastupdate = False
         else:
             self.skip_lastupdate = True
+        self.build_workers = build_workers
+        self.build_pool_type = build_pool_type
+        self.build_projects = build_projects
 
         # Creating Folders for flagfile/pbs/outlog in RESULTS_DIR
         res_dir = DAX_SETTINGS.get_results_dir()
@@ -294,12 +357,19 @@ name as a key and list of yaml filepaths as values.'
         Launch tasks from the passed list until the queue is full or
          the list is empty
 
+        The number of jobs in the queue is counted on the cluster once, then
+         tracked locally and counted again every launch_resync_jobs
+         submissions or launch_resync_seconds seconds (dax_settings.ini).
+         For DiskQ launchers, launch_workers jobs are submitted at the
+         same time.
+
         :param task_list: list of task to launch
         :param writeonly: write the job files without submitting them
         :param pbsdir: folder to store the pbs file
         :param force_no_qsub: run the job locally on the computer (serial mode)
         :return: None
         """
+        cjobs = 0
         if force_no_qsub:
             LOGGER.info('No qsub - Running job locally on your computer.')
         else:
@@ -312,54 +382,116 @@ name as a key and list of yaml filepaths as values.'
             if cluster.command_found(cmd=DAX_SETTINGS.get_cmd_submit()):
                 LOGGER.info('%s jobs currently in queue' % str(cjobs))
 
-        # Launch until we reach cluster limit or no jobs left to launch
-        while (cjobs < self.queue_limit or writeonly) and len(task_list) > 0:
-            cur_task = task_list.pop()
-
-            # Confirm task is still ready to run
-            # I don't think that we need to make this get here.
-            # We've already filtered the assessors as need to run.
-            # if cur_task.get_status() != task.NEED_TO_RUN:
-            #     continue
-
-            if writeonly:
-                msg = "  +Writing PBS file for job:%s, currently %s jobs in \
-cluster queue"
-                LOGGER.info(msg % (cur_task.assessor_label,
-                                   str(cjobs)))
-            else:
-                msg = '  +Launching job:%s, currently %s jobs in cluster queue'
-                LOGGER.info(msg % (cur_task.assessor_label, str(cjobs)))
-
-            try:
-                if self.launcher_type in ['diskq-cluster',
-                                          'diskq-combined']:
-                    success = cur_task.launch(force_no_qsub=force_no_qsub)
+        # XnatTask/Task use the shared XNAT interface: only the DiskQ tasks
+        # are submitted concurrently
+        nb_workers = 1
+        if self.launcher_type in ['diskq-cluster', 'diskq-combined'] and \
+           not force_no_qsub:
+            nb_workers = max(1, DAX_SETTINGS.get_launch_workers())
+        resync_jobs = max(1, DAX_SETTINGS.get_launch_resync_jobs())
+        resync_seconds = DAX_SETTINGS.get_launch_resync_seconds()
+
+        pool = None
+        if nb_workers > 1:
+            pool = ThreadPool(nb_workers)
+        start_time = time.time()
+        sync_time = start_time
+        nb_launched = 0
+        nb_since_sync = 0
+        try:
+            # Launch until we reach cluster limit or no jobs left to launch
+            while (cjobs < self.queue_limit or writeonly) and \
+                  len(task_list) > 0:
+                nb_jobs = min(len(task_list), nb_workers,
+                              resync_jobs - nb_since_sync)
+                if not writeonly:
+                    nb_jobs = min(nb_jobs, self.queue_limit - cjobs)
+                cur_tasks = [task_list.pop() for _ in range(nb_jobs)]
+
+                for index, cur_task in enumerate(cur_tasks):
+                    if writeonly:
+                        msg = "  +Writing PBS file for job:%s, currently %s \
+jobs in cluster queue"
+                    else:
+                        msg = '  +Launching job:%s, currently %s jobs in \
+cluster queue'
+                    LOGGER.info(msg % (cur_task.assessor_label,
+                                       str(cjobs + index)))
+
+                launch_args = [(cur_task, writeonly, pbsdir, force_no_qsub)
+                               for cur_task in cur_tasks]
+                if pool is not None and len(cur_tasks) > 1:
+                    results = pool.map(self.launch_task_star, launch_args)
                 else:
-                    success = cur_task.launch(self.root_job_dir,
-                                              self.job_email,
-                                              self.job_email_options,
-                                              self.xnat_host,
-                                              writeonly, pbsdir,
-                                              force_no_qsub=force_no_qsub)
-            except Exception as E:
-                LOGGER.critical('Caught exception launching job %s'
-                                % cur_task.assessor_label)
-                LOGGER.critical('Exception class %s caught with message %s'
-                                % (E.__class__, E.message))
-                LOGGER.critical(traceback.format_exc())
-
-                success = False
-
-            if not success:
-                LOGGER.error('ERROR: failed to launch job')
-                raise ClusterLaunchException
+                    results = [self.launch_task_star(args)
+                               for args in launch_args]
+
+                if not all(results):
+                    LOGGER.error('ERROR: failed to launch job')
+                    raise ClusterLaunchException
+
+                nb_launched += len(cur_tasks)
+                nb_since_sync += len(cur_tasks)
+                if not force_no_qsub:
+                    cjobs += len(cur_tasks)
+
+                # Count again before stopping at the queue limit: jobs may
+                # have finished since the last count
+                if not force_no_qsub and \
+                   (nb_since_sync >= resync_jobs or
+                    cjobs >= self.queue_limit or
+                    time.time() - sync_time >= resync_seconds):
+                    cjobs = cluster.count_jobs()
+                    if cjobs == -1:
+                        LOGGER.error('ERROR: cannot get count of jobs from \
+cluster')
+                        raise ClusterCountJobsException
+                    nb_since_sync = 0
+                    sync_time = time.time()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            duration = time.time() - start_time
+            if nb_launched > 0:
+                LOGGER.info('%d jobs launched in %.1fs (%.2f submissions/s)'
+                            % (nb_launched, duration,
+                               nb_launched / max(duration, 0.001)))
+
+    def launch_task_star(self, args):
+        """ launch_task() with its arguments as a tuple for the pool """
+        return self.launch_task(*args)
+
+    def launch_task(self, cur_task, writeonly=False, pbsdir=None,
+                    force_no_qsub=False):
+        """
+        Launch one task
 
-            cjobs = cluster.count_jobs()
+        :param cur_task: task to launch
+        :param writeonly: write the job files without submitting them
+        :param pbsdir: folder to store the pbs file
+        :param force_no_qsub: run the job locally on the computer (serial mode)
+        :return: True if the task was launched, False otherwise
+        """
+        try:
+            if self.launcher_type in ['diskq-cluster',
+                                      'diskq-combined']:
+                return cur_task.launch(force_no_qsub=force_no_qsub)
+            else:
+                return cur_task.launch(self.root_job_dir,
+                                       self.job_email,
+                                       self.job_email_options,
+                                       self.xnat_host,
+                                       writeonly, pbsdir,
+                                       force_no_qsub=force_no_qsub)
+        except Exception as E:
+            LOGGER.critical('Caught exception launching job %s'
+                            % cur_task.assessor_label)
+            LOGGER.critical('Exception class %s caught with message %s'
+                            % (E.__class__, E.message))
+            LOGGER.critical(traceback.format_exc())
 
-            if cjobs == -1:
-                LOGGER.error('ERROR: cannot get count of jobs from cluster')
-                raise ClusterCountJobsException
+            return False
 
     # UPDATE Main Method
     def update_tasks(self, lockfile_prefix, project_local, sessions_local):
@@ -387,41 +519,122 @@ cluster queue"
         project_list = self.init_script(flagfile, project_local,
                                         type_update=2, start_end=1)
 
-        if self.launcher_type in ['diskq-cluster', 'diskq-combined']:
-            msg = 'Loading task queue from: %s'
-            LOGGER.info(msg % os.path.join(res_dir, 'DISKQ'))
-            task_list = load_task_queue(
-                proj_filter=list(self.project_process_dict.keys()))
+        # Tasks updated concurrently, each one for at most
+        # update_task_timeout seconds
+        updater = TaskUpdater(DAX_SETTINGS.get_update_workers(),
+                              DAX_SETTINGS.get_update_task_timeout())
 
-            LOGGER.info('%s tasks found.' % str(len(task_list)))
+        # Status of all the jobs from one call to the scheduler if the
+        # cmd_get_all_jobs_status template is set
+        updater.start_phase('job statuses')
+        job_statuses = cluster.load_job_statuses()
+        try:
+            if self.launcher_type in ['diskq-cluster', 'diskq-combined']:
+                msg = 'Loading task queue from: %s'
+                LOGGER.info(msg % os.path.join(res_dir, 'DISKQ'))
+                updater.start_phase('task list')
+                task_list = load_task_queue(
+                    proj_filter=list(self.project_process_dict.keys()))
+
+                LOGGER.info('%s tasks found.' % str(len(task_list)))
+                updater.start_phase('jobs usage')
+                load_finished_jobs_usage(
+                    [dict((name, t.get_attr(name))
+                          for name in ['procstatus', 'jobid', 'jobstartdate'])
+                     for t in task_list
+                     if t.get_attr('procstatus') == task.JOB_RUNNING],
+                    job_statuses)
 
-            LOGGER.info('Updating tasks...')
-            for cur_task in task_list:
-                LOGGER.info('Updating task: %s' % cur_task.assessor_label)
-                cur_task.update_status()
-        else:
-            LOGGER.info('Connecting to XNAT at %s' % self.xnat_host)
-            with XnatUtils.get_interface(self.xnat_host, self.xnat_user,
-                                         self.xnat_pass) as intf:
+                LOGGER.info('Updating tasks...')
+                updater.start_phase('update')
+                updater.update(task_list)
+            else:
+                LOGGER.info('Connecting to XNAT at %s' % self.xnat_host)
+                with XnatUtils.get_interface(self.xnat_host, self.xnat_user,
+                                             self.xnat_pass) as intf:
+
+                    if not XnatUtils.has_dax_datatypes(intf):
+                        err = 'error: dax datatypes are not installed on \
+xnat <%s>'
+                        raise DaxXnatError(err % (self.xnat_host))
+
+                    LOGGER.info('Getting task list...')
+                    updater.start_phase('task list')
+                    assr_infos = list()
+
+                    def is_updatable(assr_info):
+                        """ Keep the info of the tasks to update """
+                        if self.is_updatable_tasks(assr_info):
+                            assr_infos.append(assr_info)
+                            return True
+                        return False
+
+                    task_list = self.get_tasks(intf,
+                                               is_updatable,
+                                               project_list,
+                                               sessions_local)
+
+                    LOGGER.info('%s open tasks found' % str(len(task_list)))
+                    updater.start_phase('jobs usage')
+                    load_finished_jobs_usage(assr_infos, job_statuses)
+                    LOGGER.info('Updating tasks...')
+                    updater.start_phase('update')
+                    # The attributes are written at the end in one pass
+                    updater.update_kwargs = {'flush': False}
+                    # pyxnat interfaces are not thread safe: the tasks
+                    # updated in threads use the interface of their worker
+                    worker_intfs = Queue()
+                    if updater.nb_workers > 1 or updater.timeout is not None:
+                        for _ in range(updater.nb_workers):
+                            worker_intfs.put(None)
+                        updater.worker_context = \
+                            lambda t: self.worker_interface(worker_intfs, t)
+                    try:
+                        updater.update(task_list)
+                    finally:
+                        # One call per assessor to set the new attributes,
+                        # the tasks timed out write their own when they end
+                        updater.start_phase('write attributes')
+                        nb_written = task.flush_tasks(
+                            [t for t in task_list
+                             if t not in updater.timed_out])
+                        LOGGER.info('%d assessors updated on XNAT'
+                                    % nb_written)
+                        while not worker_intfs.empty():
+                            worker_intf = worker_intfs.get()
+                            if worker_intf is not None:
+                                worker_intf.disconnect()
+        finally:
+            # Last chance for the tasks timed out to save their status
+            # before the daemon threads are stopped at exit
+            updater.wait_abandoned(updater.timeout)
+            cluster.clear_job_statuses()
+            cluster.clear_jobs_usage()
+            updater.log_summary()
 
-                if not XnatUtils.has_dax_datatypes(intf):
-                    err = 'error: dax datatypes are not installed on xnat <%s>'
-                    raise DaxXnatError(err % (self.xnat_host))
+        self.finish_script(flagfile, project_list, 2, 2, project_local)
 
-                LOGGER.info('Getting task list...')
-                task_list = self.get_tasks(intf,
-                                           self.is_updatable_tasks,
-                                           project_list,
-                                           sessions_local)
+    @contextmanager
+    def worker_interface(self, interfaces, cur_task):
+        """
+        Give a task one of the XNAT interfaces of the update workers
 
-                LOGGER.info('%s open tasks found' % str(len(task_list)))
-                LOGGER.info('Updating tasks...')
-                for cur_task in task_list:
-                    msg = '     Updating task: %s'
-                    LOGGER.info(msg % cur_task.assessor_label)
-                    cur_task.update_status()
+        The interfaces are opened the first time they are used, a worker
+        takes one from the queue and puts it back once its task is updated.
 
-        self.finish_script(flagfile, project_list, 2, 2, project_local)
+        :param interfaces: Queue of the interfaces, None for not opened yet
+        :param cur_task: LazyTask object to update
+        :return: context manager yielding the interface
+        """
+        intf = interfaces.get()
+        try:
+            if intf is None:
+                intf = XnatUtils.get_interface(self.xnat_host, self.xnat_user,
+                                               self.xnat_pass)
+            cur_task.use_interface(intf)
+            yield intf
+        finally:
+            interfaces.put(intf)
 
     @staticmethod
     def is_updatable_tasks(assr_info):
@@ -438,7 +651,7 @@ cluster queue"
 
     # BUILD Main Method
     def build(self, lockfile_prefix, project_local, sessions_local,
-              mod_delta=None, proj_lastrun=None):
+              mod_delta=None, proj_lastrun=None, incremental=False):
         """
         Main method to build the tasks and the sessions
 
@@ -446,6 +659,8 @@ cluster queue"
         :param project_local: project to run locally
         :param sessions_local: list of sessions to launch tasks
          associated to the project locally
+        :param incremental: only build the subjects with sessions modified
+         since the last build (see build_project)
         :return: None
 
         """
@@ -478,37 +693,148 @@ cluster queue"
                 project_list = self.get_project_list(list(unique_list))
 
             # Build projects
-            for project_id in project_list:
-                LOGGER.info('===== PROJECT: %s =====' % project_id)
-                try:
-                    if ((proj_lastrun) and
-                            (project_id in proj_lastrun) and
-                            (proj_lastrun[project_id] is not None)):
-                        lastrun = proj_lastrun[project_id]
-                    else:
-                        lastrun = None
-
-                    self.build_project(intf, project_id, lockfile_prefix,
-                                       sessions_local,
-                                       mod_delta=mod_delta, lastrun=lastrun)
-                except Exception as E:
-                    err1 = 'Caught exception building project %s'
-                    err2 = 'Exception class %s caught with message %s'
-                    LOGGER.critical(err1 % project_id)
-                    LOGGER.critical(err2 % (E.__class__, E.message))
-                    LOGGER.critical(traceback.format_exc())
+            nb_projects = min(self.get_build_projects(), len(project_list))
+            if nb_projects > 1:
+                self.build_projects_parallel(
+                    project_list, nb_projects, lockfile_prefix,
+                    sessions_local, mod_delta=mod_delta,
+                    proj_lastrun=proj_lastrun, incremental=incremental)
+            else:
+                for project_id in project_list:
+                    LOGGER.info('===== PROJECT: %s =====' % project_id)
+                    try:
+                        lastrun = get_project_lastrun(proj_lastrun,
+                                                      project_id)
+                        self.build_project(intf, project_id, lockfile_prefix,
+                                           sessions_local,
+                                           mod_delta=mod_delta,
+                                           lastrun=lastrun,
+                                           incremental=incremental)
+                    except Exception as E:
+                        err1 = 'Caught exception building project %s'
+                        err2 = 'Exception class %s caught with message %s'
+                        LOGGER.critical(err1 % project_id)
+                        LOGGER.critical(err2 % (E.__class__, E.message))
+                        LOGGER.critical(traceback.format_exc())
 
         self.finish_script(flagfile, project_list, 1, 2, project_local)
 
+    def get_build_projects(self):
+        """
+        Get the number of projects built at the same time
+
+        :return: int, build_projects given to the launcher or the value from
+         dax_settings.ini
+        """
+        if self.build_projects is None:
+            return max(1, DAX_SETTINGS.get_build_projects())
+        return max(1, int(self.build_projects))
+
+    def build_projects_parallel(self, project_list, nb_projects,
+                                lockfile_prefix, sessions_local,
+                                mod_delta=None, proj_lastrun=None,
+                                incremental=False):
+        """
+        Build projects concurrently
+
+        The projects start in the order of the list (priority projects
+         first) as soon as a worker is free. Each project is built with its
+         own XNAT interface and lock file, and its subjects with the workers
+         of get_build_pool. An error in a project does not stop the others.
+
+        :param project_list: list of project IDs, in order of priority
+        :param nb_projects: number of projects built at the same time
+        :param lockfile_prefix: prefix for flag file to lock the launcher
+        :param sessions_local: list of sessions to launch tasks
+        :param mod_delta: only build the sessions modified within this delta
+        :param proj_lastrun: dictionary of the last run date per project
+        :param incremental: only build the subjects with sessions modified
+         since the last build (see build_project)
+        :return: list of the projects built
+        """
+        LOGGER.info('Building %d projects with %d workers'
+                    % (len(project_list), nb_projects))
+        jobs = [(project_id, lockfile_prefix, sessions_local, mod_delta,
+                 get_project_lastrun(proj_lastrun, project_id), incremental)
+                for project_id in project_list]
+        built = list()
+        pool = ThreadPool(nb_projects)
+        try:
+            for project_id, project_built in pool.imap_unordered(
+                    self.build_project_star, jobs):
+                if project_built:
+                    built.append(project_id)
+        finally:
+            pool.close()
+            pool.join()
+        return built
+
+    def build_project_star(self, args):
+        """ Call build_project_locked with the arguments in a tuple """
+        return self.build_project_locked(*args)
+
+    def build_project_locked(self, project_id, lockfile_prefix,
+                             sessions_local, mod_delta=None, lastrun=None,
+                             incremental=False):
+        """
+        Build a project with its own XNAT interface and lock file
+
+        The project is skipped if its lock file exists (i.e. it is being
+         built by another dax_build).
+
+        :param project_id: project ID on XNAT
+        :param lockfile_prefix: prefix for flag file to lock the launcher
+        :param sessions_local: list of sessions to launch tasks
+        :param mod_delta: only build the sessions modified within this delta
+        :param lastrun: date of the last run for the project
+        :param incremental: only build the subjects with sessions modified
+         since the last build (see build_project)
+        :return: tuple (project ID, True if the project was built)
+        """
+        flagfile = project_flagfile(lockfile_prefix, project_id, BUILD_SUFFIX)
+        if not self.lock_flagfile(flagfile):
+            LOGGER.warn('project %s: failed to get lock. Already running.'
+                        % project_id)
+            return project_id, False
+
+        LOGGER.info('===== PROJECT: %s =====' % project_id)
+        try:
+            with XnatUtils.get_interface(self.xnat_host, self.xnat_user,
+                                         self.xnat_pass) as intf:
+                self.build_project(intf, project_id, lockfile_prefix,
+                                   sessions_local, mod_delta=mod_delta,
+                                   lastrun=lastrun, incremental=incremental)
+            return project_id, True
+        except Exception as E:
+            err1 = 'Caught exception building project %s'
+            err2 = 'Exception class %s caught with message %s'
+            LOGGER.critical(err1 % project_id)
+            LOGGER.critical(err2 % (E.__class__, E.message))
+            LOGGER.critical(traceback.format_exc())
+            return project_id, False
+        finally:
+            self.unlock_flagfile(flagfile)
+            LOGGER.info('===== PROJECT: %s finished =====' % project_id)
+
     def build_project(self, intf, project_id, lockfile_prefix, sessions_local,
-                      mod_delta=None, lastrun=None):
+                      mod_delta=None, lastrun=None, incremental=False):
         """
         Build the project
 
+        In incremental mode, the most recent last_modified date of the
+         sessions listed for the build, minus a margin, is saved after each
+         build in a state file in the results_dir, ignoring the changes made
+         by dax itself (see get_build_mark). The next build only lists the
+         dates of the sessions and the full sessions of the subjects with a
+         session modified since that date. A full build runs when there is
+         no state yet or when the processors of the project changed.
+
         :param intf: pyxnat.Interface object
         :param project_id: project ID on XNAT
         :param lockfile_prefix: prefix for flag file to lock the launcher
         :param sessions_local: list of sessions to launch tasks
+        :param incremental: only build the subjects with sessions modified
+         since the last build
         :return: None
         """
         # Modules prerun
@@ -538,113 +864,276 @@ cluster queue"
         # get the list of processors for this project
         processor_types = set(map(lambda x: x.name, session_procs + scan_procs + auto_procs))
 
-        sessions_by_subject = groupby_to_dict(
-            self.get_sessions_list(intf, project_id, sessions_local),
-            lambda x: x['subject_id'])
-
-        # check to see if there are processor types that are new to this project
-        assessors = XnatUtils.list_project_assessors(intf, project_id)
-        has_new = self.has_new_processors(assessors, processor_types)
-
-        for subject_id, sessions in sessions_by_subject.items():
-            # Get the cached session objects for this subject
-
-            sessions_to_update = dict()
-            # Check which sessions (if any) require an update:
-            for sess_info in sessions:
-
-                if not self.skip_lastupdate and not has_new and not sessions_local:
-                    last_mod = datetime.strptime(sess_info['last_modified'][0:19],
-                                                 UPDATE_FORMAT)
-                    now_date = datetime.today()
-                    last_up = self.get_lastupdated(sess_info)
-                    if last_up is not None and \
-                            last_mod < last_up and \
-                            now_date < last_mod + timedelta(days=int(self.max_age)):
-                        mess = "  + Session %s: skipping, last_mod=%s,last_up=%s"
-                        mess_str = mess % (sess_info['label'], str(last_mod),
-                                           str(last_up))
-                        LOGGER.info(mess_str)
-                        continue
-
-                elif lastrun:
-                    last_mod = datetime.strptime(sess_info['last_modified'][0:19],
-                                                 UPDATE_FORMAT)
-                    if last_mod < lastrun:
-                        mess = "  + Session %s:skipping not modified since last run,\
+        state_file = None
+        build_state = None
+        if incremental and not sessions_local:
+            state_file = build_state_path(lockfile_prefix, project_id)
+            build_state = load_build_state(state_file)
+            if build_state and \
+               sorted(build_state.get('processors', [])) != \
+               sorted(processor_types):
+                LOGGER.info('  * Processors changed since the last build, \
+building all the sessions')
+                build_state = None
+
+        if build_state and build_state.get('last_modified'):
+            # Incremental: only the subjects with modified sessions
+            since = build_state['last_modified']
+            sessions_dates = intf.get_sessions_last_modified(project_id)
+            latest = get_build_mark(sessions_dates)
+            sessions = intf.get_modified_sessions(
+                project_id, since,
+                is_modified=lambda x: not is_modified_by_dax(x),
+                sessions_dates=sessions_dates)
+            LOGGER.info('  * Incremental build: %d sessions in the subjects \
+modified since %s' % (len(sessions), since))
+            sessions_list = self.get_sessions_list(intf, project_id, None,
+                                                   sessions=sessions)
+            has_new = False
+        else:
+            # Sessions and assessors are queried once for the project
+            snapshot = XnatUtils.ProjectSnapshot(intf, project_id)
+            sessions_list = self.get_sessions_list(
+                intf, project_id, sessions_local, snapshot=snapshot)
+            latest = get_build_mark(sessions_list)
+
+            # check to see if there are processor types that are new to this
+            # project
+            assessors = snapshot.assessors()
+            has_new = self.has_new_processors(assessors, processor_types)
+
+        sessions_by_subject = groupby_to_dict(sessions_list,
+                                              lambda x: x['subject_id'])
+
+        build_args = (sessions_local, has_new, lastrun, lastmod_delta,
+                      session_procs, scan_procs, auto_procs,
+                      exp_mods, scan_mods)
+        nb_workers, pool_type = self.get_build_pool(project_id)
+        if nb_workers > 1 and len(sessions_by_subject) > 1:
+            built = self.build_subjects_parallel(
+                project_id, sessions_by_subject, build_args,
+                nb_workers, pool_type)
+            # Modules are not thread safe: run them once all subjects are built
+            if built:
+                self.build_modules_afterrun(intf, project_id, sessions_local)
+        else:
+            for sessions in sessions_by_subject.values():
+                if self.build_subject(intf, sessions, *build_args):
+                    self.build_modules_afterrun(intf, project_id,
+                                                sessions_local)
+
+        if state_file:
+            if build_state and not latest:
+                latest = build_state['last_modified']
+            save_build_state(state_file,
+                             {'last_modified': latest,
+                              'processors': sorted(processor_types)})
+
+    def get_build_pool(self, project_id):
+        """
+        Get the number of workers and the type of pool building the subjects
+
+        :param project_id: project ID on XNAT
+        :return: tuple (number of workers, pool type)
+        """
+        nb_workers = self.build_workers
+        if isinstance(nb_workers, dict):
+            nb_workers = nb_workers.get(project_id)
+        if nb_workers is None:
+            nb_workers = DAX_SETTINGS.get_build_workers()
+
+        pool_type = self.build_pool_type
+        if isinstance(pool_type, dict):
+            pool_type = pool_type.get(project_id)
+        if pool_type is None:
+            pool_type = DAX_SETTINGS.get_build_pool_type()
+
+        if pool_type not in BUILD_POOL_TYPES:
+            err = 'build_pool_type %s unknown for project %s. Choices: %s'
+            raise DaxLauncherError(err % (pool_type, project_id,
+                                          ', '.join(BUILD_POOL_TYPES)))
+        return int(nb_workers), pool_type
+
+    def build_subjects_parallel(self, project_id, sessions_by_subject,
+                                build_args, nb_workers, pool_type):
+        """
+        Build the subjects of a project concurrently
+
+        Each subject is built by a worker with its own XNAT interface. The
+        logs of a subject are emitted together once the subject is built.
+
+        :param project_id: project ID on XNAT
+        :param sessions_by_subject: dictionary of the sessions per subject
+        :param build_args: arguments for build_subject after the sessions
+        :param nb_workers: number of subjects built at the same time
+        :param pool_type: type of the worker pool: thread or process
+        :return: True if at least one session was built, False otherwise
+        """
+        LOGGER.info('  * Building %d subjects with %d %s workers'
+                    % (len(sessions_by_subject), nb_workers, pool_type))
+        # The context is set before creating the pool so that the worker
+        # processes inherit it instead of pickling the processors
+        token = next(_BUILD_COUNTER)
+        _BUILD_CONTEXTS[token] = (self, build_args)
+        jobs = [(token, subject_id, sessions)
+                for subject_id, sessions in sessions_by_subject.items()]
+        built = False
+        if pool_type == 'process':
+            pool = multiprocessing.Pool(nb_workers)
+        else:
+            pool = ThreadPool(nb_workers)
+        # The modules of each subject run on copies, their reports are
+        # added back to the modules of the project for afterrun
+        project_mods = build_args[7] + build_args[8]
+        try:
+            for _, subject_built, records, reports in pool.imap_unordered(
+                    build_subject_worker, jobs):
+                for record in records:
+                    LOGGER.handle(record)
+                for mod, report in zip(project_mods, reports):
+                    mod.merge_report(*report)
+                built = built or subject_built
+        except Exception:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+            del _BUILD_CONTEXTS[token]
+        return built
+
+    def build_subject(self, intf, sessions, sessions_local, has_new,
+                      lastrun, lastmod_delta, session_procs, scan_procs,
+                      auto_procs, exp_mods, scan_mods):
+        """
+        Build the sessions of a subject that require an update
+
+        :param intf: pyxnat.Interface object
+        :param sessions: list of the sessions info for the subject
+        :param sessions_local: list of sessions to launch tasks
+        :param has_new: True if the project has new processors
+        :param lastrun: date of the last run for the project
+        :param lastmod_delta: timedelta for the sessions modified recently
+        :param session_procs: list of processors running on a session
+        :param scan_procs: list of processors running on a scan
+        :param auto_procs: list of yaml processors
+        :param exp_mods: list of modules running on a session
+        :param scan_mods: list of modules running on a scan
+        :return: True if at least one session was built, False otherwise
+        """
+        # Get the cached session objects for this subject
+
+        sessions_to_update = dict()
+        # Check which sessions (if any) require an update:
+        for sess_info in sessions:
+
+            if not self.skip_lastupdate and not has_new and not sessions_local:
+                last_mod = datetime.strptime(sess_info['last_modified'][0:19],
+                                             UPDATE_FORMAT)
+                now_date = datetime.today()
+                last_up = self.get_lastupdated(sess_info)
+                if last_up is not None and \
+                        last_mod < last_up and \
+                        now_date < last_mod + timedelta(days=int(self.max_age)):
+                    mess = "  + Session %s: skipping, last_mod=%s,last_up=%s"
+                    mess_str = mess % (sess_info['label'], str(last_mod),
+                                       str(last_up))
+                    LOGGER.info(mess_str)
+                    continue
+
+            elif lastrun:
+                last_mod = datetime.strptime(sess_info['last_modified'][0:19],
+                                             UPDATE_FORMAT)
+                if last_mod < lastrun:
+                    mess = "  + Session %s:skipping not modified since last run,\
      last_mod=%s, last_run=%s"
-                        LOGGER.info(mess % (sess_info['label'], str(last_mod),
-                                            str(lastrun)))
-                        continue
-
-                elif lastmod_delta:
-                    last_mod = datetime.strptime(sess_info['last_modified'][0:19],
-                                                 UPDATE_FORMAT)
-                    now_date = datetime.today()
-                    if now_date > last_mod + lastmod_delta:
-                        mess = "  + Session %s:skipping not modified within delta,\
+                    LOGGER.info(mess % (sess_info['label'], str(last_mod),
+                                        str(lastrun)))
+                    continue
+
+            elif lastmod_delta:
+                last_mod = datetime.strptime(sess_info['last_modified'][0:19],
+                                             UPDATE_FORMAT)
+                now_date = datetime.today()
+                if now_date > last_mod + lastmod_delta:
+                    mess = "  + Session %s:skipping not modified within delta,\
      last_mod=%s"
-                        LOGGER.info(mess % (sess_info['label'], str(last_mod)))
-                        continue
-                    else:
-                        LOGGER.info('lastmod = %s' % str(last_mod))
+                    LOGGER.info(mess % (sess_info['label'], str(last_mod)))
+                    continue
+                else:
+                    LOGGER.info('lastmod = %s' % str(last_mod))
 
-                mess = "  + Session %s: building..."
-                LOGGER.info(mess % sess_info['label'])
-                sessions_to_update[sess_info['ID']] = sess_info
+            mess = "  + Session %s: building..."
+            LOGGER.info(mess % sess_info['label'])
+            sessions_to_update[sess_info['ID']] = sess_info
 
-            if len(sessions_to_update) == 0:
-                continue
+        if len(sessions_to_update) == 0:
+            return False
 
-            # build a full list of sessions for the subject: they may be needed even if not all sessions are getting
-            # updated
-            cached_sessions = [XnatUtils.CachedImageSession(
-                intf, x['project_label'], x['subject_label'], x['session_label']) for x in sessions]
-            cached_sessions = sorted(cached_sessions, key=lambda s: s.creation_timestamp_, reverse=True)
+        # build a full list of sessions for the subject: they may be needed even if not all sessions are getting
+        # updated. The XML of a session is only read when it is used, the
+        # creation timestamps to order them come from the session list
+        cached_sessions = [XnatUtils.CachedImageSession(
+            intf, x['project_label'], x['subject_label'], x['session_label'],
+            last_modified=x['last_modified'], datatype=x.get('xsiType'),
+            creation_timestamp=x.get('creation_timestamp'))
+            for x in sessions]
+        cached_sessions = sorted(cached_sessions, key=lambda s: s.creation_timestamp_, reverse=True)
 
-            # update each of the sessions that require it
+        # update each of the sessions that require it
 
-            for sess_info in sessions_to_update.values():
+        for sess_info in sessions_to_update.values():
 
-                if not self.skip_lastupdate:
-                    update_start_time = datetime.now()
+            if not self.skip_lastupdate:
+                update_start_time = datetime.now()
 
-                try:
-                    # TODO: BenM - ensure that this code is robust to subjects
-                    # without sessions and sessions without assessors / scans
-                    self.build_session(
-                        intf, sess_info, session_procs, scan_procs, auto_procs,
-                        exp_mods, scan_mods,
-                        sessions=cached_sessions)
-                except Exception as E:
-                    err1 = 'Caught exception building sessions %s'
-                    err2 = 'Exception class %s caught with message %s'
-                    LOGGER.critical(err1 % sess_info['session_label'])
-                    LOGGER.critical(err2 % (E.__class__, E.message))
-                    LOGGER.critical(traceback.format_exc())
+            try:
+                # TODO: BenM - ensure that this code is robust to subjects
+                # without sessions and sessions without assessors / scans
+                self.build_session(
+                    intf, sess_info, session_procs, scan_procs, auto_procs,
+                    exp_mods, scan_mods,
+                    sessions=cached_sessions)
+            except Exception as E:
+                err1 = 'Caught exception building sessions %s'
+                err2 = 'Exception class %s caught with message %s'
+                LOGGER.critical(err1 % sess_info['session_label'])
+                LOGGER.critical(err2 % (E.__class__, E.message))
+                LOGGER.critical(traceback.format_exc())
 
-                try:
-                    if not self.skip_lastupdate:
-                        self.set_session_lastupdated(intf, self.cr, sess_info,
-                                                     update_start_time)
-                except Exception as E:
-                    err1 = 'Caught exception setting session timestamp %s'
-                    err2 = 'Exception class %s caught with message %s'
-                    LOGGER.critical(err1 % sess_info['session_label'])
-                    LOGGER.critical(err2 % (E.__class__, E.message))
-                    LOGGER.critical(traceback.format_exc())
+            try:
+                if not self.skip_lastupdate:
+                    self.set_session_lastupdated(intf, self.cr, sess_info,
+                                                 update_start_time)
+            except Exception as E:
+                err1 = 'Caught exception setting session timestamp %s'
+                err2 = 'Exception class %s caught with message %s'
+                LOGGER.critical(err1 % sess_info['session_label'])
+                LOGGER.critical(err2 % (E.__class__, E.message))
+                LOGGER.critical(traceback.format_exc())
 
-            if not sessions_local or sessions_local.lower() == 'all':
-                # Modules after run
-                LOGGER.debug('* Modules Afterrun')
-                try:
-                    self.module_afterrun(intf, project_id)
-                except Exception as E:
-                    err2 = 'Exception class %s caught with message %s'
-                    LOGGER.critical('Caught exception after running modules')
-                    LOGGER.critical(err2 % (E.__class__, E.message))
-                    LOGGER.critical(traceback.format_exc())
+        return True
 
+    def build_modules_afterrun(self, intf, project_id, sessions_local):
+        """
+        Run the modules after run if the whole project was built
+
+        :param intf: pyxnat.Interface object
+        :param project_id: project ID on XNAT
+        :param sessions_local: list of sessions to launch tasks
+        :return: None
+        """
+        if not sessions_local or sessions_local.lower() == 'all':
+            # Modules after run
+            LOGGER.debug('* Modules Afterrun')
+            try:
+                self.module_afterrun(intf, project_id)
+            except Exception as E:
+                err2 = 'Exception class %s caught with message %s'
+                LOGGER.critical('Caught exception after running modules')
+                LOGGER.critical(err2 % (E.__class__, E.message))
+                LOGGER.critical(traceback.format_exc())
 
     # TODO:BenM/assessor_of_assessor/modify from here for one to many
     # processor to assessor mapping
@@ -732,6 +1221,7 @@ cluster queue"
                 if p_assr is None or \
                    p_assr.info()['procstatus'] == task.NEED_INPUTS or \
                    p_assr.info()['qcstatus'] in [task.RERUN, task.REPROC]:
+                    csess.mark_dirty()
                     assessor = csess.full_object().assessor(assr_name)
                     xtask = XnatTask(sess_proc, assessor, res_dir,
                                      os.path.join(res_dir, 'DISKQ'))
@@ -754,6 +1244,7 @@ cluster queue"
             else:
                 if p_assr is None or \
                    p_assr.info()['procstatus'] == task.NEED_INPUTS:
+                    csess.mark_dirty()
                     sess_task = sess_proc.get_task(xnat, csess, res_dir)
                     log_updating_status(sess_proc.name,
                                         sess_task.assessor_label)
@@ -834,6 +1325,7 @@ setting assessor status'
                    p_assr.info()['procstatus'] in [task.NEED_INPUTS,
                                                    task.NEED_TO_RUN] or \
                    p_assr.info()['qcstatus'] in [task.RERUN, task.REPROC]:
+                    cscan.parent().mark_dirty()
                     # TODO: get session object directly
                     scan = XnatUtils.get_full_object(xnat, scan_info)
                     assessor = scan.parent().assessor(assr_name)
@@ -858,6 +1350,7 @@ setting assessor status'
             else:
                 if p_assr is None or \
                    p_assr.info()['procstatus'] == task.NEED_INPUTS:
+                    cscan.parent().mark_dirty()
                     scan_task = scan_proc.get_task(xnat, cscan, res_dir)
                     log_updating_status(scan_proc.name,
                                         scan_task.assessor_label)
@@ -921,17 +1414,30 @@ in session %s'
         sess_info = csess.info()
         res_dir = DAX_SETTINGS.get_results_dir()
         xnat_session = csess.full_object()
+        # Artefacts shared by the processors: of csess only until a
+        # longitudinal processor needs the prior sessions as well
+        artefacts = None
+        artefacts_sessions = None
 
         for sess_proc in sess_proc_list:
             if not sess_proc.should_run(sess_info):
                 continue
 
-            # TODO: use mod time to decide if we need to reload
-            csess.reload()
+            # Reload only if a previous processor modified the session
+            if csess.reload_if_modified():
+                artefacts = None
+            if sess_proc.is_longitudinal():
+                relevant_sessions = sessions[sessions.index(csess):]
+            else:
+                relevant_sessions = [csess]
+            if artefacts is None or \
+                    len(relevant_sessions) > len(artefacts_sessions):
+                artefacts = ProcessorParser.parse_artefacts(relevant_sessions)
+                artefacts_sessions = relevant_sessions
 
             # return a mapping between the assessor input sets and existing
             # assessors that map to those input sets
-            sess_proc.parse_session(csess, sessions)
+            sess_proc.parse_session(csess, sessions, artefacts)
             mapping = sess_proc.get_assessor_mapping()
 
             if mapping is None:
@@ -942,6 +1448,7 @@ in session %s'
                     if len(p_assrs) == 0:
                         assessor = sess_proc.create_assessor(xnat_session,
                                                              inputs, relabel=True)
+                        csess.mark_dirty()
                         assessors =\
                             [(assessor, task.NEED_TO_RUN, task.DOES_NOT_EXIST)]
                     else:
@@ -957,6 +1464,7 @@ in session %s'
                         procstatus = assessor[1]
                         qcstatus = assessor[2]
                         if task_needs_to_run(procstatus, qcstatus):
+                            csess.mark_dirty()
                             xtask = XnatTask(sess_proc, assessor[0], res_dir,
                                              os.path.join(res_dir, 'DISKQ'))
 
@@ -982,6 +1490,7 @@ in session %s'
                     if len(p_assrs) == 0:
                         assessor = sess_proc.create_assessor(xnat_session,
                                                              inputs)
+                        csess.mark_dirty()
                         assessors =\
                             [(assessor, task.NEED_TO_RUN, task.DOES_NOT_EXIST)]
                     else:
@@ -997,6 +1506,7 @@ in session %s'
                         procstatus = assessor[1]
                         qcstatus = assessor[2]
                         if task_needs_to_run(procstatus, qcstatus):
+                            csess.mark_dirty()
                             sess_task =\
                                 task.Task(sess_proc, assessor[0], res_dir)
 
@@ -1025,6 +1535,8 @@ in session %s'
                             # Other statuses handled by dax_update_tasks
                             pass
 
+        deg = 'session XML reloads=%d, reloads avoided=%d'
+        LOGGER.debug(deg % (csess.reloads, csess.reloads_avoided))
 
     def module_prerun(self, project_id, settings_filename=''):
         """
@@ -1176,15 +1688,18 @@ The project is not part of the settings."""
         # iterate projects
         for project_id in project_list:
             LOGGER.info('===== PROJECT:%s =====' % project_id)
+            # The sessions and assessors are queried once for the project
+            snapshot = XnatUtils.ProjectSnapshot(xnat, project_id)
             task_list.extend(self.get_project_tasks(xnat,
                                                     project_id,
                                                     sessions_local,
-                                                    is_valid_assessor))
+                                                    is_valid_assessor,
+                                                    snapshot=snapshot))
 
         return task_list
 
     def get_project_tasks(self, xnat, project_id, sessions_local,
-                          is_valid_assessor):
+                          is_valid_assessor, snapshot=None):
         """
         Get list of tasks for a specific project where each task agrees
          the is_valid_assessor conditions
@@ -1194,6 +1709,8 @@ The project is not part of the settings."""
         :param sessions_local: list of sessions to update tasks associated
          to the project locally
         :param is_valid_assessor: method to validate the assessor
+        :param snapshot: XnatUtils.ProjectSnapshot of the project to share
+         the XNAT queries with the caller
         :return: list of tasks
         """
         task_list = list()
@@ -1202,15 +1719,20 @@ The project is not part of the settings."""
         pp_dict = self.project_process_dict.get(project_id, None)
         sess_procs, scan_procs, auto_procs =\
             processors.processors_by_type(pp_dict)
+        proc_index = self.project_proc_index.get(project_id)
+        if proc_index is None:
+            proc_index = processors.processors_by_key(pp_dict)
 
         # Get lists of assessors for this project
-        assr_list = self.get_assessors_list(xnat, project_id, sessions_local)
+        assr_list = self.get_assessors_list(xnat, project_id, sessions_local,
+                                            snapshot=snapshot)
 
         # Match each assessor to a processor, get a task, and add to list
         for assr_info in assr_list:
             if is_valid_assessor(assr_info):
                 cur_task = self.generate_task(xnat, assr_info, sess_procs,
-                                              scan_procs, auto_procs)
+                                              scan_procs, auto_procs,
+                                              proc_index)
                 if cur_task:
                     task_list.append(cur_task)
 
@@ -1248,22 +1770,33 @@ The project is not part of the settings."""
         return None
 
     def generate_task(self, xnat, assr_info,
-                      sess_proc_list, scan_proc_list, auto_proc_list):
+                      sess_proc_list, scan_proc_list, auto_proc_list,
+                      proc_index=None):
         """
         Generate a task for the assessor in the info
 
+        The assessor object is only selected on XNAT when the task needs it
+         (see task.LazyTask).
+
         :param xnat: pyxnat.Interface object
         :param assr_info: dictionary containing the assessor info
                           (See XnatUtils.list_assessors)
         :param sess_proc_list: list of processors running on a session
         :param scan_proc_list: list of processors running on a scan
         :param auto_proc_list: list of yaml processors
+        :param proc_index: processors indexed by (xsiType, proctype)
+         (see processors.processors_by_key). If not given, the assessor is
+         matched with match_proc.
         :return: task if processor and assessor match, None otherwise
         """
-        task_proc = self.match_proc(assr_info,
-                                    sess_proc_list,
-                                    scan_proc_list,
-                                    auto_proc_list)
+        if proc_index is not None:
+            task_proc = proc_index.get((assr_info['xsiType'],
+                                        assr_info['proctype']))
+        else:
+            task_proc = self.match_proc(assr_info,
+                                        sess_proc_list,
+                                        scan_proc_list,
+                                        auto_proc_list)
 
         if task_proc is None:
             warn = 'no matching processor found: %s'
@@ -1271,25 +1804,27 @@ The project is not part of the settings."""
             return None
         else:
             # Get a new task with the matched processor
-            assr = xnat.select_assessor(assr_info['project_id'],
-                                        assr_info['subject_id'],
-                                        assr_info['session_id'],
-                                        assr_info['ID'])
-            cur_task = Task(task_proc, assr, DAX_SETTINGS.get_results_dir())
+            cur_task = LazyTask(task_proc, assr_info,
+                                DAX_SETTINGS.get_results_dir(), xnat)
             return cur_task
 
     @staticmethod
-    def get_assessors_list(xnat, project_id, slocal):
+    def get_assessors_list(xnat, project_id, slocal, snapshot=None):
         """
         Get the assessor list from XNAT and filter it if necessary
 
         :param xnat: pyxnat.Interface object
         :param project_id: project ID on XNAT
         :param slocal: session selected by user
+        :param snapshot: XnatUtils.ProjectSnapshot of the project. If not
+         given, the assessors are queried from XNAT.
         :return: list of assessors for a project
         """
         # Get lists of assessors for this project
-        assr_list = XnatUtils.list_project_assessors(xnat, project_id)
+        if snapshot is not None:
+            assr_list = snapshot.assessors()
+        else:
+            assr_list = XnatUtils.list_project_assessors(xnat, project_id)
 
         # filter the assessors to the sessions given as parameters if given
         if slocal and slocal.lower() != 'all':
@@ -1304,7 +1839,8 @@ The project is not part of the settings."""
         return assr_list
 
     @staticmethod
-    def get_sessions_list(xnat, project_id, slocal):
+    def get_sessions_list(xnat, project_id, slocal, snapshot=None,
+                          sessions=None):
         """
         Get the sessions list from XNAT and sort it.
          Move the new sessions to the front.
@@ -1312,9 +1848,17 @@ The project is not part of the settings."""
         :param xnat: pyxnat.Interface object
         :param project_id: project ID on XNAT
         :param slocal: session selected by user
+        :param snapshot: XnatUtils.ProjectSnapshot of the project. If not
+         given, the sessions are queried from XNAT.
+        :param sessions: list of sessions already queried to sort instead
         :return: list of sessions sorted for a project
         """
-        list_sessions = xnat.get_sessions(project_id)
+        if sessions is not None:
+            list_sessions = sessions
+        elif snapshot is not None:
+            list_sessions = snapshot.sessions()
+        else:
+            list_sessions = xnat.get_sessions(project_id)
         if slocal and slocal.lower() != 'all':
             # filter the list and keep the match between both list:
             val = slocal.split(',')
@@ -1397,6 +1941,9 @@ The project is not part of the settings."""
                 sess_obj.attrs.set('%s/original' % xsi_type,
                                    UPDATE_PREFIX + update_str, params={
                         "event_reason": "DAX setting session_lastupdated"})
+                XnatUtils.invalidate_session(sess_info['project_label'],
+                                             sess_info['subject_label'],
+                                             sess_info['session_label'])
         except Exception as E:
             err1 = 'Caught exception setting update timestamp for session %s'
             err2 = 'Exception class %s caught with message %s'
@@ -1422,6 +1969,235 @@ The project is not part of the settings."""
         return proc_types.difference(assr_types) > 0
 
 
+def build_subject_worker(job):
+    """
+    Build a subject from a worker of the build pool
+
+    The launcher and the build arguments are looked up in _BUILD_CONTEXTS so
+    that the worker processes do not need to pickle them. Errors are caught
+    here so one subject can't stop the build of the others.
+
+    :param job: tuple (context key, subject ID, list of the sessions info)
+    :return: tuple (subject ID, True if a session was built, log records,
+     list of the (report, send_an_email) of the session and scan modules)
+    """
+    token, subject_id, sessions = job
+    launcher, build_args = _BUILD_CONTEXTS[token]
+    _SUBJECT_LOGS.records = list()
+    built = False
+    mods = list()
+    try:
+        build_args = copy_build_args(build_args, 'subject_%s' % subject_id)
+        mods = build_args[7] + build_args[8]
+        with XnatUtils.get_interface(launcher.xnat_host, launcher.xnat_user,
+                                     launcher.xnat_pass) as intf:
+            built = launcher.build_subject(intf, sessions, *build_args)
+    except Exception as E:
+        err1 = 'Caught exception building subject %s'
+        err2 = 'Exception class %s caught with message %s'
+        LOGGER.critical(err1 % subject_id)
+        LOGGER.critical(err2 % (E.__class__, E.message))
+        LOGGER.critical(traceback.format_exc())
+    finally:
+        records = _SUBJECT_LOGS.records
+        _SUBJECT_LOGS.records = None
+        for mod in mods:
+            if mod.directory:
+                shutil.rmtree(mod.directory, ignore_errors=True)
+    reports = [(mod.text_report, mod.send_an_email) for mod in mods]
+    return (subject_id, built, [freeze_log_record(r) for r in records],
+            reports)
+
+
+def copy_build_args(build_args, suffix):
+    """
+    Copy the yaml processors and the modules of the build arguments
+
+    parse_session keeps the state of the session on the yaml processors and
+    the modules keep their temp directory and report: each subject built at
+    the same time needs its own copies.
+
+    :param build_args: arguments for build_subject after the sessions
+    :param suffix: name of the sub-folder of the modules temp directory
+    :return: tuple of the arguments with the yaml processors and the modules
+     copied
+    """
+    (sessions_local, has_new, lastrun, lastmod_delta, session_procs,
+     scan_procs, auto_procs, exp_mods, scan_mods) = build_args
+    auto_procs = [proc.copy_for_build() for proc in auto_procs]
+    exp_mods = [mod.copy_for_build(suffix) for mod in exp_mods]
+    scan_mods = [mod.copy_for_build(suffix) for mod in scan_mods]
+    return (sessions_local, has_new, lastrun, lastmod_delta, session_procs,
+            scan_procs, auto_procs, exp_mods, scan_mods)
+
+
+def freeze_log_record(record):
+    """
+    Format the message of a log record so it can be sent between processes
+
+    :param record: logging.LogRecord object
+    :return: the record with its message formatted and no arguments
+    """
+    record.msg = record.getMessage()
+    record.args = None
+    if record.exc_info:
+        record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+    return record
+
+
+def load_finished_jobs_usage(jobs_info, job_statuses):
+    """
+    Get the usage of the jobs that finished since the last update at once
+
+    The jobs no longer in the queue are the ones check_job_usage() traces
+    during this update, their usage is loaded with one call to the scheduler
+    (see cluster.load_jobs_usage).
+
+    :param jobs_info: list of dictionaries with the procstatus, jobid and
+     jobstartdate of the tasks to update
+    :param job_statuses: statuses returned by cluster.load_job_statuses(),
+     nothing is loaded if None
+    :return: None
+    """
+    if job_statuses is None:
+        return
+
+    jobids = list()
+    jobdates = list()
+    for info in jobs_info:
+        jobid = info.get('jobid')
+        jobdate = info.get('jobstartdate')
+        if info.get('procstatus') != task.JOB_RUNNING or \
+           jobid in [None, '', '0', 'NotFound', 'no_qsub'] or \
+           not jobdate or not cluster.is_traceable_date(jobdate):
+            continue
+        if cluster.job_status(jobid) == 'C':
+            jobids.append(jobid)
+            jobdates.append(jobdate)
+
+    if jobids:
+        cluster.load_jobs_usage(jobids, min(jobdates))
+
+
+def get_project_lastrun(proj_lastrun, project_id):
+    """
+    Get the date of the last run of a project
+
+    :param proj_lastrun: dictionary of the last run date per project or None
+    :param project_id: project ID on XNAT
+    :return: date of the last run, None if not set
+    """
+    if proj_lastrun:
+        return proj_lastrun.get(project_id)
+    return None
+
+
+def project_flagfile(lockfile_prefix, project_id, suffix):
+    """
+    Path of the flag file locking a project
+
+    :param lockfile_prefix: prefix for flag file to lock the launcher
+    :param project_id: project ID on XNAT
+    :param suffix: suffix of the flag file (e.g. BUILD_SUFFIX)
+    :return: path to the flag file in the FlagFiles folder of the results_dir
+    """
+    return os.path.join(DAX_SETTINGS.get_results_dir(), 'FlagFiles',
+                        '%s_%s_%s' % (lockfile_prefix, project_id, suffix))
+
+
+def is_modified_by_dax(sess_info):
+    """
+    Check if the last change of a session is dax setting its last_updated
+
+    dax sets last_updated one minute in the future (see
+    set_session_lastupdated), the session was not modified since if its
+    last_modified date is older.
+
+    :param sess_info: dictionary with the last_modified and last_updated of
+     a session
+    :return: True if the session was last modified by dax, False otherwise
+    """
+    if not sess_info.get('last_modified') or \
+       not sess_info.get('last_updated'):
+        return False
+    try:
+        last_up = Launcher.get_lastupdated(sess_info)
+        last_mod = datetime.strptime(sess_info['last_modified'][0:19],
+                                     UPDATE_FORMAT)
+    except ValueError:
+        return False
+    return last_up is not None and last_mod < last_up
+
+
+def get_build_mark(sessions, margin=BUILD_MARK_MARGIN):
+    """
+    Get the high-water mark of an incremental build
+
+    Only the XNAT dates of the sessions listed for the build are used, not
+    the local clock. The sessions last modified by dax are not counted.
+
+    :param sessions: list of dictionaries with the last_modified and
+     last_updated of the sessions listed for the build
+    :param margin: seconds taken off the most recent last_modified
+    :return: last_modified string of the mark, None if no session
+    """
+    dates = [s['last_modified'][0:19] for s in sessions
+             if s['last_modified'] and not is_modified_by_dax(s)]
+    if not dates:
+        return None
+    latest = datetime.strptime(max(dates), UPDATE_FORMAT)
+    return (latest - timedelta(seconds=margin)).strftime(UPDATE_FORMAT)
+
+
+def build_state_path(lockfile_prefix, project_id):
+    """
+    Path of the file storing the state of the incremental build of a project
+
+    :param lockfile_prefix: prefix for flag file to lock the launcher
+    :param project_id: project ID on XNAT
+    :return: path to the json file in the results_dir
+    """
+    return os.path.join(DAX_SETTINGS.get_results_dir(), BUILD_STATE_DIRNAME,
+                        '%s_%s.json' % (lockfile_prefix, project_id))
+
+
+def load_build_state(state_file):
+    """
+    Read the state of the incremental build of a project
+
+    :param state_file: path to the json file
+    :return: dictionary with last_modified and processors, None if no state
+    """
+    if not os.path.isfile(state_file):
+        return None
+    try:
+        with open(state_file, 'r') as f:
+            return json.load(f)
+    except ValueError as err:
+        LOGGER.warn('ignoring corrupted build state %s: %s'
+                    % (state_file, err))
+        return None
+
+
+def save_build_state(state_file, state):
+    """
+    Write the state of the incremental build of a project
+
+    The file is replaced atomically so an interrupted build keeps the
+     previous state.
+
+    :param state_file: path to the json file
+    :param state: dictionary with last_modified and processors
+    :return: None
+    """
+    check_dir(os.path.dirname(state_file))
+    tmp_file = '%s.%d.tmp' % (state_file, os.getpid())
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f)
+    os.rename(tmp_file, state_file)
+
+
 # TODO: BenM/assessor_of_assessor/check path.txt to get the project_id
 def load_task_queue(status=None, proj_filter=None):
     """ Load the task queue for DiskQ"""
@@ -1429,6 +2205,7 @@ def load_task_queue(status=None, proj_filter=None):
     diskq_dir = os.path.join(DAX_SETTINGS.get_results_dir(), 'DISKQ')
     results_dir = DAX_SETTINGS.get_results_dir()
 
+    batch_files = list()
     for t in os.listdir(os.path.join(diskq_dir, 'BATCH')):
         # TODO:complete filtering by project/subject/session/type
         if proj_filter:
@@ -1436,9 +2213,21 @@ def load_task_queue(status=None, proj_filter=None):
             if assr.get_project_id() not in proj_filter:
                 LOGGER.debug('ignoring:' + t)
                 continue
+        batch_files.append(t)
+
+    # Attributes of the tasks in BATCH read at once from the DiskQ store,
+    # the ones not preloaded by the store are read when needed
+    store = get_diskq_store(diskq_dir)
+    tasks_attrs = store.load_attrs(
+        projects=proj_filter,
+        labels=[os.path.splitext(t)[0] for t in batch_files],
+        names=store.PRELOAD_ATTRIBUTES)
 
+    for t in batch_files:
         LOGGER.debug('loading:' + t)
-        task = ClusterTask(os.path.splitext(t)[0], results_dir, diskq_dir)
+        assr_label = os.path.splitext(t)[0]
+        task = ClusterTask(assr_label, results_dir, diskq_dir,
+                           attrs=tasks_attrs.get(assr_label, dict()))
         LOGGER.debug('status = ' + task.get_status())
 
         if not status or task.get_status() == status:
@@ -3,6 +3,7 @@
 from builtins import str
 from builtins import object
 
+import copy
 from datetime import datetime
 from email.mime.text import MIMEText
 import logging
@@ -88,6 +89,38 @@ class Module(object):
         """
         return self.text_report
 
+    def copy_for_build(self, suffix):
+        """
+        Copy the module with its own report and temp directory
+
+        The subjects built at the same time each run their own copy: the
+        report of the copy starts empty and its data are stored in a
+        sub-folder of the module directory. The report is added back to the
+        module with merge_report().
+
+        :param suffix: name of the sub-folder of the copy
+        :return: Module object
+        """
+        mod = copy.copy(self)
+        mod.text_report = ''
+        mod.send_an_email = 0
+        if self.directory:
+            mod.directory = os.path.join(self.directory, suffix)
+            if not os.path.exists(mod.directory):
+                os.makedirs(mod.directory)
+        return mod
+
+    def merge_report(self, text_report, send_an_email):
+        """
+        Add the report of a copy made by copy_for_build() to the module
+
+        :param text_report: report text of the copy
+        :param send_an_email: 1 if the copy has something to report
+        :return: None
+        """
+        self.text_report += text_report
+        self.send_an_email = max(self.send_an_email, send_an_email)
+
     def make_dir(self, suffix=''):
         """
         Create the tmp directory for the modules
@@ -127,6 +127,7 @@ class ProcessorParser:
         self.iteration_map,\
         self.prior_session_count =\
             ProcessorParser.parse_inputs(yaml_source)
+        self.compiled_types = ProcessorParser.compile_types(self.inputs)
 
         self.match_filters = ProcessorParser.parse_match_filters(yaml_source)
         self.variables_to_inputs = ProcessorParser.parse_variables(self.inputs)
@@ -149,13 +150,16 @@ class ProcessorParser:
         self.is_longitudinal_ = ProcessorParser.is_longitudinal(yaml_source)
 
 
-    def parse_session(self, csess, sessions):
+    def parse_session(self, csess, sessions, artefacts=None):
         """
         Parse a session to determine whether new assessors should be created.
         This call populates assessor_parameter_map.
         :param csess: the session in question
         :param sessions: the full list of sessions, including csess, for the
         subject
+        :param artefacts: artefact index from parse_artefacts covering at
+        least the relevant sessions, shared between the processors running on
+        csess. Built from the relevant sessions if None
         :return: None
         """
         self.csess = None
@@ -173,12 +177,14 @@ class ProcessorParser:
 
         relevant_sessions = [csess] if not self.is_longitudinal_ else sessions[index:]
 
-        artefacts = ProcessorParser.parse_artefacts(relevant_sessions)
+        if artefacts is None:
+            artefacts = ProcessorParser.parse_artefacts(relevant_sessions)
 
         artefacts_by_input = \
             ProcessorParser.map_artefacts_to_inputs(relevant_sessions,
                                                     self.inputs,
-                                                    self.inputs_by_type)
+                                                    self.inputs_by_type,
+                                                    self.compiled_types)
 
         parameter_matrix = \
             ProcessorParser.generate_parameter_matrix(
@@ -655,6 +661,21 @@ class ProcessorParser:
         return (inputs, inputs_by_type, iteration_sources, iteration_map,
                 prior_session_count)
 
+    @staticmethod
+    def compile_types(inputs):
+        """
+        Compile the scan type patterns of the scan inputs
+
+        :param inputs: inputs from parse_inputs
+        :return: dictionary of input name: list of compiled regex
+        """
+        compiled_types = {}
+        for i, iv in inputs.iteritems():
+            if iv['artefact_type'] == 'scan':
+                compiled_types[i] = [XnatUtils.extract_exp(expression)
+                                     for expression in iv['types']]
+        return compiled_types
+
     @staticmethod
     def is_longitudinal(yaml_source):
         inputs = yaml_source['inputs']['xnat']
@@ -726,10 +747,19 @@ class ProcessorParser:
 
 
     @staticmethod
-    def map_artefacts_to_inputs(csesses, inputs, inputs_by_type):
+    def map_artefacts_to_inputs(csesses, inputs, inputs_by_type,
+                                compiled_types=None):
+
+        if compiled_types is None:
+            compiled_types = ProcessorParser.compile_types(inputs)
 
         artefacts_by_input = {k: [] for k in inputs}
         for i, iv in inputs.iteritems():
+            # a scan type matches or not whatever the scan, so test each
+            # distinct type only once
+            regexes = compiled_types.get(i, [])
+            type_matches = {}
+
             if iv['select-session'].mode in ['prior', 'prior-with']:
                 if iv['select-session'].delta >= len(csesses):
                     csess = None
@@ -742,15 +772,17 @@ class ProcessorParser:
 
             if csess is not None:
                 for cscan in csess.scans():
-                    for expression in iv['types']:
-                        regex = XnatUtils.extract_exp(expression)
-                        if regex.match(cscan.type()):
-                            if iv.get('select')[0] == 'all' and cscan.info().get('quality') == 'unusable':
-                                print('excluding unusable scan')
-                            else:
-                                artefacts_by_input[i].append(cscan.full_path())
-                            # Break here so we don't match multiple times
-                            break
+                    scan_type = cscan.type()
+                    if scan_type not in type_matches:
+                        # any() stops at the first match so we don't match
+                        # multiple times
+                        type_matches[scan_type] = any(
+                            regex.match(scan_type) for regex in regexes)
+                    if type_matches[scan_type]:
+                        if iv.get('select')[0] == 'all' and cscan.info().get('quality') == 'unusable':
+                            print('excluding unusable scan')
+                        else:
+                            artefacts_by_input[i].append(cscan.full_path())
 
                 for cassr in csess.assessors():
                     if cassr.type() in iv['types']:
@@ -3,6 +3,7 @@
 from builtins import object
 from past.builtins import basestring
 
+import copy
 import logging
 import re
 import os
@@ -361,11 +362,8 @@ class ScanProcessor(Processor):
         if self.scan_types == 'all':
             return True
         else:
-            for expression in self.scan_types:
-                regex = XnatUtils.extract_exp(expression, self.full_regex)
-                if regex.match(scan_dict['scan_type']):
-                    return True
-            return False
+            return XnatUtils.match_many([scan_dict['scan_type']],
+                                        self.scan_types, self.full_regex)[0]
 
 
 class SessionProcessor(Processor):
@@ -648,8 +646,30 @@ defined by yaml file {}'
     def get_assessor_mapping(self):
         return self.parser.assessor_parameter_map
 
+    def copy_for_build(self):
+        """
+        Copy the processor with its own session state
+
+        The parsed yaml is shared with the original processor, the state set
+        by parse_session is only set on the copy: the subjects built at the
+        same time use their own copy.
+
+        :return: AutoProcessor object
+        """
+        proc = copy.copy(self)
+        proc.parser = copy.copy(self.parser)
+        return proc
+
+    def is_longitudinal(self):
+        """
+        Check if the processor uses the prior sessions of the subject
+
+        :return: True if the yaml has inputs on the prior sessions
+        """
+        return self.parser.is_longitudinal_
 
-    def parse_session(self, csess, sessions):
+
+    def parse_session(self, csess, sessions, artefacts=None):
         """
         Method to run the processor parser on this session, in order to
         calculate the pattern matches for this processor and the sessions
@@ -660,9 +680,11 @@ defined by yaml file {}'
         are numbered for the purposes of pattern matching
         :param sessions: the full, time-ordered list of sessions that should be
         considered for longitudinal studies.
+        :param artefacts: artefact index of the sessions shared between the
+        processors (see ProcessorParser.parse_artefacts)
         :return: None
         """
-        self.parser.parse_session(csess, sessions)
+        self.parser.parse_session(csess, sessions, artefacts)
 
 
     def should_run(self, obj_dict):
@@ -1113,6 +1135,23 @@ def processors_by_type(proc_list):
     return scan_proc_list, sess_proc_list, auto_proc_list
 
 
+def processors_by_key(proc_list):
+    """
+    Index the processors by the xsiType and proctype of their assessors
+
+    When several processors have the same key, the first one in the order
+     of processors_by_type is kept, like Launcher.match_proc.
+
+    :param proc_list: List of Processor classes from the DAX settings file
+    :return: dictionary mapping (xsitype, name) to the processor
+    """
+    proc_index = dict()
+    for type_list in processors_by_type(proc_list):
+        for proc in type_list:
+            proc_index.setdefault((proc.xsitype, proc.name), proc)
+    return proc_index
+
+
 def load_from_yaml(xnat, filepath, user_inputs=None, singularity_imagedir=None):
     """
     Load processor from yaml
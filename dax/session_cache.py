@@ -0,0 +1,249 @@
+""" session_cache.py: on-disk cache of the session XML downloaded from XNAT """
+
+from builtins import object
+
+from datetime import datetime, timedelta
+import logging
+import os
+import sqlite3
+import time
+import zlib
+
+from .dax_settings import DAX_Settings
+
+
+__copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
+__all__ = ['SessionXmlCache', 'get_session_cache', 'invalidate_session']
+DAX_SETTINGS = DAX_Settings()
+LOGGER = logging.getLogger('dax')
+CACHE_FILENAME = 'session_xml_cache.sqlite'
+CREATE_TABLE = '''CREATE TABLE IF NOT EXISTS sessions (
+    key TEXT PRIMARY KEY,
+    last_modified TEXT,
+    datatype TEXT,
+    creation_timestamp TEXT,
+    xml BLOB,
+    size INTEGER,
+    stored REAL,
+    last_access REAL)'''
+
+_SESSION_CACHE = None
+_SESSION_CACHE_LOADED = False
+
+
+class SessionXmlCache(object):
+    """
+    Cache of the session XML stored zlib compressed in a SQLite database
+
+    An entry is keyed by project/subject/session labels and is only returned
+    when the last_modified date given by the caller (from XNAT get_sessions)
+    matches the one stored with the XML. The least recently used entries are
+    evicted when the cache goes over its maximum size.
+    """
+    def __init__(self, db_path, max_size, max_age=None):
+        """
+        Entry point for the SessionXmlCache class
+
+        :param db_path: path to the SQLite database file
+        :param max_size: maximum size of the cache in bytes (compressed XML)
+        :param max_age: number of days before an entry is refreshed from XNAT
+         even if last_modified did not change. None to keep it forever.
+        :return: None
+        """
+        self.db_path = db_path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        with self._connect() as conn:
+            conn.execute(CREATE_TABLE)
+
+    def _connect(self):
+        # One connection per call: the cache is shared by the build workers
+        return _ClosingConnection(sqlite3.connect(self.db_path, timeout=60))
+
+    @staticmethod
+    def key(project, subject, session):
+        """
+        Key of a session in the cache
+
+        :param project: XNAT project ID
+        :param subject: XNAT subject label
+        :param session: XNAT session label
+        :return: string key
+        """
+        return '/'.join([project, subject, session])
+
+    def get(self, project, subject, session, last_modified):
+        """
+        Get the cached XML for a session if it is still valid
+
+        :param project: XNAT project ID
+        :param subject: XNAT subject label
+        :param session: XNAT session label
+        :param last_modified: last_modified value of the session on XNAT
+        :return: tuple (datatype, creation_timestamp, xml string) or None
+        """
+        key = self.key(project, subject, session)
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT last_modified, datatype, creation_timestamp, xml, '
+                'stored FROM sessions WHERE key = ?', (key,)).fetchone()
+            if row is None or row[0] != last_modified or self._expired(row[4]):
+                self.misses += 1
+                return None
+            conn.execute('UPDATE sessions SET last_access = ? WHERE key = ?',
+                         (time.time(), key))
+        self.hits += 1
+        return row[1], row[2], zlib.decompress(bytes(row[3]))
+
+    def put(self, project, subject, session, last_modified, datatype,
+            creation_timestamp, xml_str):
+        """
+        Store the XML of a session in the cache
+
+        :param project: XNAT project ID
+        :param subject: XNAT subject label
+        :param session: XNAT session label
+        :param last_modified: last_modified value of the session on XNAT
+        :param datatype: session datatype
+        :param creation_timestamp: insert date of the session on XNAT
+        :param xml_str: XML string of the session
+        :return: None
+        """
+        if not isinstance(xml_str, bytes):
+            xml_str = xml_str.encode('utf-8')
+        data = zlib.compress(xml_str)
+        if len(data) > self.max_size:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.key(project, subject, session), last_modified, datatype,
+                 creation_timestamp, sqlite3.Binary(data), len(data), now,
+                 now))
+            self._evict(conn)
+
+    def invalidate(self, project, subject, session):
+        """
+        Remove a session from the cache (e.g: dax wrote to the session)
+
+        :param project: XNAT project ID
+        :param subject: XNAT subject label
+        :param session: XNAT session label
+        :return: None
+        """
+        with self._connect() as conn:
+            conn.execute('DELETE FROM sessions WHERE key = ?',
+                         (self.key(project, subject, session),))
+
+    def clear(self):
+        """
+        Remove all the sessions from the cache
+
+        :return: None
+        """
+        with self._connect() as conn:
+            conn.execute('DELETE FROM sessions')
+
+    def size(self):
+        """
+        Get the size of the cache
+
+        :return: size in bytes of the compressed XML stored
+        """
+        with self._connect() as conn:
+            return conn.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM sessions').fetchone()[0]
+
+    def _expired(self, stored):
+        if self.max_age is None:
+            return False
+        stored_date = datetime.fromtimestamp(stored)
+        return datetime.now() > stored_date + timedelta(days=self.max_age)
+
+    def _evict(self, conn):
+        total = conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM sessions').fetchone()[0]
+        if total <= self.max_size:
+            return
+        rows = conn.execute(
+            'SELECT key, size FROM sessions ORDER BY last_access').fetchall()
+        evicted = list()
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            evicted.append((key,))
+            total -= size
+        conn.executemany('DELETE FROM sessions WHERE key = ?', evicted)
+        LOGGER.debug('session cache: evicted %d sessions' % len(evicted))
+
+
+class _ClosingConnection(object):
+    """ Commit and close a sqlite3 connection at the end of a with block """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        try:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.conn.close()
+
+
+def get_session_cache():
+    """
+    Get the session XML cache set in dax_settings.ini
+
+    The cache is stored in the results_dir. It is disabled when
+    session_cache_size is not set or set to 0.
+
+    :return: SessionXmlCache object or None if disabled
+    """
+    global _SESSION_CACHE, _SESSION_CACHE_LOADED
+    if not _SESSION_CACHE_LOADED:
+        _SESSION_CACHE_LOADED = True
+        max_size = DAX_SETTINGS.get_session_cache_size()
+        if not max_size:
+            return None
+        db_path = os.path.join(DAX_SETTINGS.get_results_dir(), 'CACHE',
+                               CACHE_FILENAME)
+        try:
+            _SESSION_CACHE = SessionXmlCache(db_path, max_size * 1024 * 1024,
+                                             DAX_SETTINGS.get_max_age())
+        except (sqlite3.Error, OSError) as err:
+            LOGGER.warn('session cache disabled, cannot open %s: %s'
+                        % (db_path, err))
+            return None
+    return _SESSION_CACHE
+
+
+def invalidate_session(project, subject, session):
+    """
+    Remove a session from the cache if the cache is enabled
+
+    Call it when dax modifies a session or one of its assessors.
+
+    :param project: XNAT project ID
+    :param subject: XNAT subject label
+    :param session: XNAT session label
+    :return: None
+    """
+    cache = get_session_cache()
+    if cache is None:
+        return
+    try:
+        cache.invalidate(project, subject, session)
+    except sqlite3.Error as err:
+        LOGGER.warn('failed to invalidate session %s in cache: %s'
+                    % (session, err))
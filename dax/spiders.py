@@ -21,7 +21,11 @@ import collections
 import csv
 from datetime import datetime
 import glob
-import matplotlib.pyplot as plt
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
 import nibabel as nib
 import numpy as np
 import os
@@ -34,7 +38,13 @@ import subprocess as sb
 import sys
 import time
 
+try:
+    from PyPDF2 import PdfFileMerger
+except ImportError:
+    PdfFileMerger = None
+
 from . import XnatUtils
+from . import utilities
 from .errors import SpiderError, AutoSpiderError
 
 
@@ -46,6 +56,8 @@ except NameError:
 __copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
 __all__ = ["Spider", "ScanSpider", "SessionSpider", "AutoSpider",
            "TimedWriter"]
+# Maximum number of inputs copied/downloaded at the same time by AutoSpider
+MAX_TRANSFERS = 4
 UNICODE_SPIDER = """
 Spider information:
   -- General --
@@ -65,6 +77,10 @@ Spider information:
 FSLSWAP_VAL = {0: 'x',
                1: 'y',
                2: 'z'}
+# Executables found in PATH, looked up once per process
+_EXECUTABLES = dict()
+IMAGES_PAGE_DPI = 100
+STATS_PAGE_DPI = 300
 
 
 class Spider(object):
@@ -625,6 +641,15 @@ for resource %s : %s"
         """
         return merge_pdfs(pdf_pages, pdf_final, self.time_writer)
 
+    def render_report(self, pages, pdf_final, nb_processes=1,
+                      snapshot=None):
+        """Build a PDF report from the pages without intermediate pdfs.
+
+        See function at the end of the file.
+        """
+        return render_report(pages, pdf_final, nb_processes=nb_processes,
+                             snapshot=snapshot, time_writer=self.time_writer)
+
     def run_cmd_args(self):
         """
         Run a command line via os.system() with arguments set in self.cmd_args
@@ -868,7 +893,7 @@ UNICODE_AUTOSPIDER = """AutoSpider information:
 class AutoSpider(object):
     """ Class for Autospider """
     def __init__(self, name, params, outputs, template, version=None,
-                 exe_lang=None):
+                 exe_lang=None, max_transfers=MAX_TRANSFERS):
         """
         Entry point for Autospider class
 
@@ -878,12 +903,14 @@ class AutoSpider(object):
         :param template: template to run
         :param version: spider version
         :param exe_lang: executable language (python, matlab, bash, ruby)
+        :param max_transfers: number of inputs copied at the same time
         """
         self.name = name
         self.params = params
         self.outputs = list()
         self.template = template
         self.exe_lang = exe_lang
+        self.max_transfers = max_transfers
         self.copy_list = []
 
         # Make the parser
@@ -989,30 +1016,61 @@ class AutoSpider(object):
         return parser
 
     def copy_inputs(self):
-        """ Copy the inputs data for AutoSpider."""
+        """ Copy the inputs data for AutoSpider.
+
+        The inputs are copied max_transfers at a time, the XNAT interfaces
+        opened by the downloads share their connections to the host.
+        """
         self.run_inputs = self.src_inputs
 
         if not os.path.exists(self.input_dir):
             os.mkdir(self.input_dir)
 
+        # Split the lists to copy each individual file/dir
+        copies = list()
         for _input in self.copy_list:
-            # Split the list and handle each copy each individual file/dir
             src_list = self.src_inputs[_input].split(',')
-            dst_list = []
             for i, src in enumerate(src_list):
-                input_name = '%s_%s' % (_input, str(i))
-                dst = self.copy_input(src, input_name)
-                if not dst:
-                    self.time_writer('ERROR: copying inputs')
-                    return None
-                else:
-                    dst_list.append(dst)
+                copies.append((_input, '%s_%s' % (_input, str(i)), src))
+
+        start = time.time()
+        nb_threads = max(1, min(self.max_transfers, len(copies)))
+        pool = ThreadPool(nb_threads)
+        try:
+            dsts = pool.map(self.copy_input_star, copies)
+        finally:
+            pool.close()
+            pool.join()
+        self.time_writer(' - %d inputs copied in %.1fs'
+                         % (len(copies), time.time() - start))
+
+        if not all(dsts):
+            self.time_writer('ERROR: copying inputs')
+            return None
 
-            # Build new comma-separated list with local paths
+        # Build new comma-separated list with local paths
+        dst_lists = collections.OrderedDict(
+            (_input, list()) for _input in self.copy_list)
+        for (_input, _, _), dst in zip(copies, dsts):
+            dst_lists[_input].append(dst)
+        for _input, dst_list in dst_lists.items():
             self.run_inputs[_input] = ','.join(dst_list)
 
         return self.run_inputs
 
+    def copy_input_star(self, args):
+        """Copy an input and log the time it took, args unpacked for
+        ThreadPool.map: (input, input_name, src)."""
+        _, input_name, src = args
+        start = time.time()
+        dst = self.copy_input(src, input_name)
+        duration = time.time() - start
+        size_mb = old_div(utilities.get_disk_size(dst), 1024.0 * 1024.0) if dst else 0
+        self.time_writer(' - %s copied: %.1f MB in %.1fs (%.1f MB/s)'
+                         % (input_name, size_mb, duration,
+                            old_div(size_mb, max(duration, 0.001))))
+        return dst
+
     def _populate_from_inputs(self, outputs):
         """ Populate the outputs with the inputs if set"""
         for output in outputs:
@@ -1227,7 +1285,11 @@ GeneratorAutoSpider.')
         return dst
 
     def download_xnat_file(self, src, dst):
-        """Download XNAT specific file."""
+        """Download XNAT specific file.
+
+        The file is streamed to <dst>.part and checked against the size/MD5
+        given by XNAT, a failed download is resumed.
+        """
         results = None
         with XnatUtils.get_interface(host=self.host, user=self.user,
                                      pwd=self.pwd) as intf:
@@ -1243,7 +1305,18 @@ wrong for XNAT. Please check https://wiki.xnat.org/display/XNAT16/\
 XNAT+REST+API+Directory for the path.'
                 raise AutoSpiderError(msg % src)
             try:
-                results = res.file(_file).get(dst)
+                fdicts = [f for f in XnatUtils.list_resource_files(intf, _res)
+                          if f['path'] == _file]
+                if not fdicts:
+                    msg = 'file specified by %s not found on XNAT.'
+                    raise AutoSpiderError(msg % src)
+                XnatUtils.download_file_resumable(
+                    intf, fdicts[0]['URI'], dst,
+                    size=fdicts[0].get('Size') or None,
+                    digest=fdicts[0].get('digest') or None)
+                results = dst
+            except AutoSpiderError:
+                raise
             except Exception:
                 raise AutoSpiderError('downloading files from XNAT failed.')
 
@@ -1267,7 +1340,8 @@ XNAT+REST+API+Directory for the path.'
 
             try:
                 # res.get(dst, extract=True)
-                results = XnatUtils.download_files_from_obj(dst, res)
+                results, _ = XnatUtils.download_resource_resumable(
+                    intf, src, dst)
                 if len(results) == 1:
                     return results[0]
                 else:
@@ -1578,12 +1652,147 @@ def execute_cmd(cmd, time_writer=None):
     return True
 
 
+def has_executable(executable):
+    """
+    Check if an executable is in PATH, looked up once per process
+
+    :param executable: name of the executable
+    :return: True if the executable exists, False otherwise
+    """
+    if executable not in _EXECUTABLES:
+        _EXECUTABLES[executable] = XnatUtils.executable_exists(executable)
+    return _EXECUTABLES[executable]
+
+
+def canonical_shape(nii_image):
+    """
+    Shape of the three spatial axes of an image in the closest canonical
+    (RAS+) orientation, see nibabel.as_closest_canonical
+
+    :param nii_image: nibabel image
+    :return: tuple of the three dimensions
+    """
+    ornt = nib.orientations.io_orientation(nii_image.affine)
+    shape = [0, 0, 0]
+    for in_axis in range(3):
+        shape[int(ornt[in_axis, 0])] = nii_image.shape[in_axis]
+    return tuple(shape)
+
+
+def canonical_slice(nii_image, axis, index, volume_ind=None):
+    """
+    Read one slice of an image in the closest canonical (RAS+) orientation
+
+    Only the slice is read from the file through the image dataobj:
+    the result is the same as as_closest_canonical(nii_image).get_data()
+    sliced on the axis, without loading the whole volume.
+
+    :param nii_image: nibabel image (3D or 4D)
+    :param axis: canonical axis of the slice (0: sag, 1: cor, 2: ax)
+    :param index: index of the slice on the canonical axis
+    :param volume_ind: volume of a 4D image, default: the mid volume
+    :return: 2D numpy array
+    """
+    ornt = nib.orientations.io_orientation(nii_image.affine)
+    shape = nii_image.shape
+    slicer = list()
+    kept_axes = list()
+    for in_axis in range(3):
+        out_axis, flip = int(ornt[in_axis, 0]), ornt[in_axis, 1]
+        if out_axis == axis:
+            slicer.append(index if flip > 0 else shape[in_axis] - 1 - index)
+        else:
+            slicer.append(slice(None))
+            kept_axes.append((out_axis, flip))
+    if len(shape) > 3:
+        if not isinstance(volume_ind, int):
+            volume_ind = old_div(shape[3], 2)
+        slicer.append(volume_ind)
+        slicer.extend([0] * (len(shape) - 4))
+
+    dslice = np.asanyarray(nii_image.dataobj[tuple(slicer)])
+    for dim, (_, flip) in enumerate(kept_axes):
+        if flip < 0:
+            dslice = np.flip(dslice, dim)
+    if kept_axes[0][0] > kept_axes[1][0]:
+        dslice = np.transpose(dslice)
+    return dslice
+
+
+def fslswapdim_reorient(image, time_writer=None):
+    """
+    Reorient an image for display with fslswapdim, see plot_images
+
+    :param image: path to the nifti image
+    :param time_writer: function to print with time (default using print)
+    :return: nibabel image reoriented
+    """
+    if image.endswith('.nii.gz'):
+        ext = '.nii.gz'
+    else:
+        ext = '.nii'
+    image_name = ('%s_reorient%s'
+                  % (os.path.basename(image).split('.')[0], ext))
+    image_reorient = os.path.join(os.path.dirname(image), image_name)
+    qform = nib.load(image).header.get_qform()
+    v = np.argmax(np.absolute(qform[0:3, 0:3]), axis=0)
+    neg = {0: '', 1: '', 2: ''}
+    if qform[v[0]][0] < 0:
+        neg[0] = '-'
+    if qform[v[1]][1] < 0:
+        neg[1] = '-'
+    if qform[v[2]][2] < 0:
+        neg[2] = '-'
+    args = '%s%s %s%s %s%s' % (neg[np.where(v == 0)[0][0]],
+                               FSLSWAP_VAL[np.where(v == 0)[0][0]],
+                               neg[np.where(v == 1)[0][0]],
+                               FSLSWAP_VAL[np.where(v == 1)[0][0]],
+                               neg[np.where(v == 2)[0][0]],
+                               FSLSWAP_VAL[np.where(v == 2)[0][0]])
+    cmd = 'fslswapdim %s %s %s' % (image, args, image_reorient)
+    use_time_writer(time_writer, 'INFO: command: %s' % cmd)
+    os.system(cmd)
+
+    if not os.path.exists(image_reorient) and \
+       image_reorient.endswith('.nii'):
+        image_reorient = '%s.gz' % image_reorient
+    return nib.load(image_reorient)
+
+
 # PDF Generator for spiders:
+def page_figure():
+    """Create the figure of a PDF page, rendered with Agg.
+
+    The figure is not managed by pyplot: no display is needed and the figure
+    can be pickled from a process rendering the pages, see render_report.
+
+    :return: matplotlib Figure
+    """
+    fig = Figure(figsize=(7.5, 10))
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def downsample_slice(dslice, max_image_size=None):
+    """Downsample a slice to display by taking one voxel out of n.
+
+    :param dslice: 2D numpy array
+    :param max_image_size: maximum number of voxels on each side,
+        None to keep the slice as it is
+    :return: 2D numpy array
+    """
+    if not max_image_size or max(dslice.shape) <= max_image_size:
+        return dslice
+    step = -(-max(dslice.shape) // max_image_size)
+    return dslice[::step, ::step]
+
+
 # Display images:
 def plot_images(pdf_path, page_index, nii_images, title,
                 image_labels, slices=None, cmap='gray',
                 vmins=None, vmaxs=None, volume_ind=None,
-                orient='ax', time_writer=None):
+                orient='ax', time_writer=None, use_fslswapdim=False,
+                max_image_size=None):
     """Plot list of images (3D-4D) on a figure (PDF page).
 
     plot_images_figure will create one pdf page with only images.
@@ -1608,6 +1817,11 @@ def plot_images(pdf_path, page_index, nii_images, title,
                        select volume
     :param orient: 'ax' or 'cor' or 'sag', default: 'sag'
     :param time_writer: function to print with time (default using print)
+    :param use_fslswapdim: reorient the images with fslswapdim if it is in
+        PATH instead of reading the displayed slices in RAS orientation
+        with nibabel
+    :param max_image_size: downsample the slices displayed to this number
+        of voxels at most on each side, default: full size
     :return: pdf path created
 
     E.g for two images:
@@ -1623,10 +1837,28 @@ def plot_images(pdf_path, page_index, nii_images, title,
     vmaxs = {'0':100,
              '1':150}
     """
-    plt.ioff()
+    fig = images_figure(page_index, nii_images, title, image_labels,
+                        slices=slices, cmap=cmap, vmins=vmins, vmaxs=vmaxs,
+                        volume_ind=volume_ind, orient=orient,
+                        time_writer=time_writer,
+                        use_fslswapdim=use_fslswapdim,
+                        max_image_size=max_image_size)
+    fig.savefig(pdf_path, transparent=True, orientation='portrait',
+                dpi=IMAGES_PAGE_DPI)
+    return pdf_path
+
+
+def images_figure(page_index, nii_images, title, image_labels, slices=None,
+                  cmap='gray', vmins=None, vmaxs=None, volume_ind=None,
+                  orient='ax', time_writer=None, use_fslswapdim=False,
+                  max_image_size=None):
+    """Build the figure of a PDF page with images, see plot_images.
+
+    :return: matplotlib Figure
+    """
     use_time_writer(time_writer, 'INFO: generating pdf page %d with images.'
                                  % page_index)
-    fig = plt.figure(page_index, figsize=(7.5, 10))
+    fig = page_figure()
     # Titles:
     if not isinstance(cmap, dict):
         default_cmap = cmap
@@ -1651,52 +1883,21 @@ Using default.")
         use_time_writer(time_writer, 'INFO: display different plan view \
 (ax/sag/cor) of the mid slice.')
     for index, image in enumerate(nii_images):
-        # Open niftis with nibabel
-        f_img_ori = nib.load(image)
-        # Reorient for display with python if fslswapdim exists:
-        if True in [os.path.isfile(os.path.join(path, 'fslswapdim')) and
-                    os.access(os.path.join(path, 'fslswapdim'), os.X_OK)
-                    for path in os.environ["PATH"].split(os.pathsep)]:
-            if image.endswith('.nii.gz'):
-                ext = '.nii.gz'
-            else:
-                ext = '.nii'
-            image_name = ('%s_reorient%s'
-                          % (os.path.basename(image).split('.')[0], ext))
-            image_reorient = os.path.join(os.path.dirname(image),
-                                          image_name)
-            qform = f_img_ori.header.get_qform()
-            v = np.argmax(np.absolute(qform[0:3, 0:3]), axis=0)
-            neg = {0: '', 1: '', 2: ''}
-            if qform[v[0]][0] < 0:
-                neg[0] = '-'
-            if qform[v[1]][1] < 0:
-                neg[1] = '-'
-            if qform[v[2]][2] < 0:
-                neg[2] = '-'
-            args = '%s%s %s%s %s%s' % (neg[np.where(v == 0)[0][0]],
-                                       FSLSWAP_VAL[np.where(v == 0)[0][0]],
-                                       neg[np.where(v == 1)[0][0]],
-                                       FSLSWAP_VAL[np.where(v == 1)[0][0]],
-                                       neg[np.where(v == 2)[0][0]],
-                                       FSLSWAP_VAL[np.where(v == 2)[0][0]])
-            cmd = 'fslswapdim %s %s %s' % (image, args, image_reorient)
-            use_time_writer(time_writer, 'INFO: command: %s' % cmd)
-            os.system(cmd)
-
-            if not os.path.exists(image_reorient) and \
-               image_reorient.endswith('.nii'):
-                image_reorient = '%s.gz' % image_reorient
-            data = nib.load(image_reorient).get_data()
-        else:
-            data = f_img_ori.get_data()
-        if len(data.shape) > 3:
-            if isinstance(volume_ind, int):
-                data = data[:, :, :, volume_ind]
-            else:
-                data = data[:, :, :, old_div(data.shape[3], 2)]
-        default_slices = [old_div(data.shape[2], 4), old_div(data.shape[2], 2),
-                          3 * old_div(data.shape[2], 4)]
+        # Open niftis with nibabel: only the slices displayed are read
+        f_img = nib.load(image)
+        if use_fslswapdim and has_executable('fslswapdim'):
+            f_img = fslswapdim_reorient(image, time_writer)
+            # Already reoriented, slice it as it is
+            f_img = nib.Nifti1Image(f_img.dataobj, np.eye(4), f_img.header)
+        shape = canonical_shape(f_img)
+
+        def get_slice(axis, slice_index):
+            return downsample_slice(
+                canonical_slice(f_img, axis, slice_index, volume_ind),
+                max_image_size)
+
+        default_slices = [old_div(shape[2], 4), old_div(shape[2], 2),
+                          3 * old_div(shape[2], 4)]
         default_label = 'Line %s' % index
         if slices:
             if not isinstance(slices, dict):
@@ -1709,11 +1910,11 @@ dictionary. Using default.")
                 ind = slices_number * index + slice_ind + 1
                 ax = fig.add_subplot(number_im, slices_number, ind)
                 if orient == 'cor':
-                    dslice = data[:, slice_value, :]
+                    dslice = get_slice(1, slice_value)
                 elif orient == 'ax':
-                    dslice = data[:, :, slice_value]
+                    dslice = get_slice(2, slice_value)
                 else:
-                    dslice = data[slice_value, :, :]
+                    dslice = get_slice(0, slice_value)
                 ax.imshow(np.rot90(np.transpose(dslice), 2),
                           cmap=cmap.get(str(index), default_cmap),
                           vmin=vmins.get(str(index), None),
@@ -1728,15 +1929,15 @@ dictionary. Using default.")
         else:
             # Fix Orientation:
             dslice = []
-            dslice_z = data[:, :, old_div(data.shape[2], 2)]
+            dslice_z = get_slice(2, old_div(shape[2], 2))
             if dslice_z.shape[0] != dslice_z.shape[1]:
                 dslice_z = imresize(dslice_z, (max(dslice_z.shape),
                                                max(dslice_z.shape)))
-            dslice_y = data[:, old_div(data.shape[1], 2), :]
+            dslice_y = get_slice(1, old_div(shape[1], 2))
             if dslice_y.shape[0] != dslice_y.shape[1]:
                 dslice_y = imresize(dslice_y, (max(dslice_y.shape),
                                                max(dslice_y.shape)))
-            dslice_x = data[old_div(data.shape[0], 2), :, :]
+            dslice_x = get_slice(0, old_div(shape[0], 2))
             if dslice_x.shape[0] != dslice_x.shape[1]:
                 dslice_x = imresize(dslice_x, (max(dslice_x.shape),
                                                max(dslice_x.shape)))
@@ -1770,14 +1971,11 @@ dictionary. Using default.")
     fig.tight_layout()
     date = datetime.now()
     # Titles page
-    plt.figtext(0.5, 0.985, '-- %s PDF report --' % title,
-                horizontalalignment='center', fontsize=12)
-    plt.figtext(0.5, 0.02, 'Date: %s -- page %d' % (str(date), page_index),
-                horizontalalignment='center', fontsize=8)
-    fig.savefig(pdf_path, transparent=True, orientation='portrait',
-                dpi=100)
-    plt.close(fig)
-    return pdf_path
+    fig.text(0.5, 0.985, '-- %s PDF report --' % title,
+             horizontalalignment='center', fontsize=12)
+    fig.text(0.5, 0.02, 'Date: %s -- page %d' % (str(date), page_index),
+             horizontalalignment='center', fontsize=8)
+    return fig
 
 
 # Plot statistics in a table
@@ -1805,7 +2003,25 @@ def plot_stats(pdf_path, page_index, stats_dict, title,
     :param time_writer: function to print with time (default using print)
     :return: pdf path created
     """
-    plt.ioff()
+    fig = stats_figure(page_index, stats_dict, title,
+                       tables_number=tables_number,
+                       columns_header=columns_header,
+                       limit_size_text_column1=limit_size_text_column1,
+                       limit_size_text_column2=limit_size_text_column2,
+                       time_writer=time_writer)
+    fig.savefig(pdf_path, transparent=True, orientation='portrait',
+                dpi=STATS_PAGE_DPI)
+    return pdf_path
+
+
+def stats_figure(page_index, stats_dict, title, tables_number=3,
+                 columns_header=['Header', 'Value'],
+                 limit_size_text_column1=30, limit_size_text_column2=10,
+                 time_writer=None):
+    """Build the figure of a PDF page with stats, see plot_stats.
+
+    :return: matplotlib Figure
+    """
     use_time_writer(time_writer,
                     'INFO: generating pdf page %d with stats.' % page_index)
 
@@ -1818,7 +2034,7 @@ def plot_stats(pdf_path, page_index, stats_dict, title,
         cell_text.append([txt, "%s" % val])
 
     # Make the table
-    fig = plt.figure(page_index, figsize=(7.5, 10))
+    fig = page_figure()
     nb_stats = len(list(stats_dict.keys()))
     for i in range(tables_number):
         ax = fig.add_subplot(1, tables_number, i + 1)
@@ -1841,17 +2057,14 @@ def plot_stats(pdf_path, page_index, stats_dict, title,
 
     # Set footer and title
     date = datetime.now()
-    plt.figtext(0.5, 0.985, '-- %s PDF report --' % title,
-                horizontalalignment='center', fontsize=12)
-    plt.figtext(0.5, 0.02, 'Date: %s -- page %d' % (str(date), page_index),
-                horizontalalignment='center', fontsize=8)
-    fig.savefig(pdf_path, transparent=True, orientation='portrait',
-                dpi=300)
-    plt.close(fig)
-    return pdf_path
+    fig.text(0.5, 0.985, '-- %s PDF report --' % title,
+             horizontalalignment='center', fontsize=12)
+    fig.text(0.5, 0.02, 'Date: %s -- page %d' % (str(date), page_index),
+             horizontalalignment='center', fontsize=8)
+    return fig
 
 
-# Merge PDF pages together using ghostscript 'gs'
+# Merge PDF pages together
 def merge_pdfs(pdf_pages, pdf_final, time_writer=None):
     """Concatenate all pdf pages in the list into a final pdf.
 
@@ -1859,23 +2072,103 @@ def merge_pdfs(pdf_pages, pdf_final, time_writer=None):
     with each page specify by a number:
       pdf_pages = {'1': pdf_page1, '2': pdf_page2}
 
+    The pages are copied as they are with PyPDF2 if it is installed,
+    otherwise ghostscript 'gs' renders them again in the final pdf.
+
     :param pdf_pages: python list or dictionary of pdf page path
     :param pdf_final: final PDF path
     :param time_writer: function to print with time (default using print)
     :return: pdf path created
     """
     use_time_writer(time_writer, 'INFO: Concatenate all pdfs pages.')
-    pages = ''
     if isinstance(pdf_pages, dict):
-        for key in sorted(pdf_pages.keys()):
-            pages = '%s %s ' % (pages, pdf_pages[key])
+        pages = [pdf_pages[key] for key in sorted(pdf_pages.keys())]
     elif isinstance(pdf_pages, list):
-        pages = ' '.join(pdf_pages)
+        pages = pdf_pages
     else:
         raise TypeError('Wrong type for pdf_pages (list or dict).')
+
+    if PdfFileMerger is not None:
+        use_time_writer(time_writer, 'INFO:saving final PDF: %s ' % pdf_final)
+        merger = PdfFileMerger()
+        for page in pages:
+            merger.append(page)
+        merger.write(pdf_final)
+        merger.close()
+        return pdf_final
+
     args = '-q -sPAPERSIZE=letter -dNOPAUSE -dBATCH -sDEVICE=pdfwrite \
 -dPDFSETTINGS=/prepress'
-    cmd = 'gs %s -sOutputFile=%s %s' % (args, pdf_final, pages)
+    cmd = 'gs %s -sOutputFile=%s %s' % (args, pdf_final, ' '.join(pages))
     use_time_writer(time_writer, 'INFO:saving final PDF: %s ' % cmd)
     os.system(cmd)
     return pdf_final
+
+
+# Pages of render_report: function building the figure and dpi
+REPORT_PAGES = {'images': (images_figure, IMAGES_PAGE_DPI),
+                'stats': (stats_figure, STATS_PAGE_DPI)}
+
+
+def render_page(page):
+    """Build the figure of a page of render_report.
+
+    :param page: tuple (page type, keyword arguments of the page function)
+    :return: matplotlib Figure
+    """
+    page_type, kwargs = page
+    return REPORT_PAGES[page_type][0](**kwargs)
+
+
+def render_report(pages, pdf_final, nb_processes=1, snapshot=None,
+                  time_writer=None):
+    """Build a PDF report from the pages without intermediate pdfs.
+
+    The figures of the pages are built by a pool of processes (Agg canvas,
+    no display needed) and written one after the other in the final pdf by
+    matplotlib: the pages are not rendered again.
+
+    E.g:
+    pages = [('images', {'nii_images': [image1], 'title': 'FS',
+                         'image_labels': {'0': 'T1'}}),
+             ('stats', {'stats_dict': stats, 'title': 'FS'})]
+
+    :param pages: list of tuples (page type, keyword arguments), with the
+        type 'images' for plot_images or 'stats' for plot_stats. The page
+        index is set from the position of the page if not given.
+    :param pdf_final: final PDF path
+    :param nb_processes: number of processes building the pages
+    :param snapshot: path to save the first page as png (e.g. the
+        SNAPSHOTS/snapshot_original.png of the assessor), None to skip
+    :param time_writer: function to print with time (default using print)
+    :return: pdf path created
+    """
+    pages = [(page_type, dict(kwargs)) for page_type, kwargs in pages]
+    for index, (page_type, kwargs) in enumerate(pages):
+        if page_type not in REPORT_PAGES:
+            raise SpiderError('Unknown type of page: %s' % page_type)
+        kwargs.setdefault('page_index', index + 1)
+        if nb_processes <= 1:
+            kwargs.setdefault('time_writer', time_writer)
+
+    use_time_writer(time_writer, 'INFO: rendering %d pages of %s'
+                                 % (len(pages), pdf_final))
+    if nb_processes > 1 and len(pages) > 1:
+        pool = Pool(min(nb_processes, len(pages)))
+        try:
+            figures = pool.map(render_page, pages)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        figures = [render_page(page) for page in pages]
+
+    if snapshot and figures:
+        # The figures unpickled from the processes have no Agg canvas
+        FigureCanvasAgg(figures[0])
+        figures[0].savefig(snapshot, dpi=REPORT_PAGES[pages[0][0]][1])
+    with PdfPages(pdf_final) as pdf:
+        for (page_type, _), fig in zip(pages, figures):
+            pdf.savefig(fig, transparent=True, orientation='portrait',
+                        dpi=REPORT_PAGES[page_type][1])
+    return pdf_final
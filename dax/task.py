@@ -5,6 +5,7 @@ from builtins import object
 
 from datetime import date
 import errno
+import functools
 import logging
 import os
 import shutil
@@ -16,10 +17,12 @@ from .errors import (NeedInputsException, NoDataException,
                      ClusterLaunchException)
 from .dax_settings import DAX_Settings, DEFAULT_DATATYPE, DEFAULT_FS_DATATYPE
 from . import assessor_utils
+from .session_cache import invalidate_session
+from .diskq_store import get_diskq_store
 
 
 __copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
-__all__ = ['Task', 'ClusterTask', 'XnatTask']
+__all__ = ['Task', 'LazyTask', 'ClusterTask', 'XnatTask']
 DAX_SETTINGS = DAX_Settings()
 # Logger to print logs
 LOGGER = logging.getLogger('dax')
@@ -113,6 +116,49 @@ def create_flag(flag_path):
     open(flag_path, 'w').close()
 
 
+def buffer_attrs(method):
+    """
+    Decorator for the Task methods setting several attributes on XNAT
+
+    The attributes set by the method are buffered and written with a single
+     attrs.mset() when it returns. Call the method with flush=False to keep
+     them buffered and write them later with flush_tasks().
+
+    :param method: Task method to decorate
+    :return: decorated method
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        flush = kwargs.pop('flush', True)
+        self.hold_attrs()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.release_attrs(flush)
+    return wrapper
+
+
+def flush_tasks(tasks):
+    """
+    Write the attributes buffered by the tasks on XNAT, one call per assessor
+
+    A task failing to write its attributes is logged and keeps them buffered,
+     the other tasks are still flushed.
+
+    :param tasks: list of Task objects
+    :return: number of tasks written on XNAT
+    """
+    nb_written = 0
+    for cur_task in tasks:
+        try:
+            if cur_task.flush_attrs():
+                nb_written += 1
+        except Exception as err:
+            LOGGER.error('failed to set the attributes of %s: %s'
+                         % (cur_task.assessor_label, err))
+    return nb_written
+
+
 class Task(object):
     """ Class Task to generate/manage the assessor with the cluster """
     def __init__(self, processor, assessor, upload_dir):
@@ -129,9 +175,16 @@ class Task(object):
         self.assessor = assessor
         self.upload_dir = upload_dir
         self.atype = processor.xsitype.lower()
+        self.assessor_label = None
+        # Attributes waiting to be written on XNAT (see write_attrs)
+        self.pending_attrs = dict()
+        self.attrs_held = 0
 
         # Create assessor if needed
+        created = False
         if not assessor.exists():
+            created = True
+            self.hold_attrs()
             if self.atype == DEFAULT_FS_DATATYPE.lower():
                 kwargs = {'%s/fsversion' % DEFAULT_FS_DATATYPE.lower(): '0'}
                 assessor.create(assessors=DEFAULT_FS_DATATYPE.lower(),
@@ -142,15 +195,110 @@ class Task(object):
             self.set_createdate_today()
             atype = self.atype.lower()
             if atype == DEFAULT_DATATYPE.lower():
-                assessor.attrs.mset(
+                self.write_attrs(
                     {'%s/proctype' % atype: self.get_processor_name(),
                      '%s/procversion' % atype: self.get_processor_version()})
 
             self.set_proc_and_qc_status(NEED_INPUTS, JOB_PENDING)
+            self.release_attrs()
 
         # Cache for convenience
         self.assessor_id = assessor.id()
         self.assessor_label = assessor_utils.full_label_from_assessor(assessor)
+        if created:
+            self.invalidate_session()
+
+    def invalidate_session(self):
+        """
+        Remove the session of the assessor from the session XML cache
+
+        :return: None
+
+        """
+        if self.assessor_label:
+            labels = self.assessor_label.split('-x-')
+            invalidate_session(labels[0], labels[1], labels[2])
+
+    def hold_attrs(self):
+        """
+        Buffer the attributes set on the assessor until release_attrs()
+
+        Calls can be nested: the attributes are written when the outermost
+         hold is released.
+
+        :return: None
+
+        """
+        self.attrs_held += 1
+
+    def release_attrs(self, flush=True):
+        """
+        Release a hold on the attributes, write them if it was the last one
+
+        :param flush: write the buffered attributes, False to keep them
+         buffered until flush_attrs() or flush_tasks()
+        :return: None
+
+        """
+        self.attrs_held -= 1
+        if flush and self.attrs_held == 0:
+            self.flush_attrs()
+
+    def write_attrs(self, attrs):
+        """
+        Set attributes of the assessor, buffered if the attributes are held
+
+        :param attrs: dictionary of xpath/value to set
+        :return: None
+
+        """
+        self.pending_attrs.update(attrs)
+        if self.attrs_held == 0:
+            self.flush_attrs()
+
+    def flush_attrs(self):
+        """
+        Write the buffered attributes on XNAT with a single attrs.mset()
+
+        The attributes stay buffered if the call fails.
+
+        :return: number of attributes written
+
+        """
+        if not self.pending_attrs:
+            return 0
+        nb_attrs = len(self.pending_attrs)
+        self.assessor.attrs.mset(self.pending_attrs)
+        self.pending_attrs = dict()
+        self.invalidate_session()
+        return nb_attrs
+
+    def read_attr(self, name):
+        """
+        Get an attribute of the assessor, including the buffered ones
+
+        :param name: xpath of the attribute
+        :return: value of the attribute
+        """
+        if name in self.pending_attrs:
+            return self.pending_attrs[name]
+        return self.assessor.attrs.get(name)
+
+    def read_attrs(self, names):
+        """
+        Get several attributes of the assessor, including the buffered ones
+
+        :param names: list of xpaths of the attributes
+        :return: list of the values in the same order
+        """
+        values = dict()
+        missing = [name for name in names if name not in self.pending_attrs]
+        if missing:
+            values.update(zip(missing, self.assessor.attrs.mget(missing)))
+        for name in names:
+            if name in self.pending_attrs:
+                values[name] = self.pending_attrs[name]
+        return [values[name] for name in names]
 
     def get_processor_name(self):
         """
@@ -192,7 +340,7 @@ class Task(object):
 
         """
         atype = self.atype
-        mgets = self.assessor.attrs.mget([
+        mgets = self.read_attrs([
             '%s/memused' % atype,
             '%s/walltimeused' % atype,
             '%s/jobid' % atype,
@@ -255,7 +403,7 @@ class Task(object):
         :return: String of how much memory was used
 
         """
-        memused = self.assessor.attrs.get('%s/memused' % self.atype)
+        memused = self.read_attr('%s/memused' % self.atype)
         return memused.strip()
 
     def set_memused(self, memused):
@@ -266,7 +414,7 @@ class Task(object):
         :return: None
 
         """
-        self.assessor.attrs.set('%s/memused' % self.atype, memused)
+        self.write_attrs({'%s/memused' % self.atype: memused})
 
     def get_walltime(self):
         """
@@ -275,7 +423,7 @@ class Task(object):
         :return: String of how much walltime was used for a process
 
         """
-        walltime = self.assessor.attrs.get('%s/walltimeused' % self.atype)
+        walltime = self.read_attr('%s/walltimeused' % self.atype)
         return walltime.strip()
 
     def set_walltime(self, walltime):
@@ -287,7 +435,7 @@ class Task(object):
         :return: None
 
         """
-        self.assessor.attrs.set('%s/walltimeused' % self.atype, walltime)
+        self.write_attrs({'%s/walltimeused' % self.atype: walltime})
 
     def get_jobnode(self):
         """
@@ -296,7 +444,7 @@ class Task(object):
         :return: String identifying the node that a job ran on
 
         """
-        jobnode = self.assessor.attrs.get('%s/jobnode' % self.atype)
+        jobnode = self.read_attr('%s/jobnode' % self.atype)
         if jobnode is None:
             jobnode = 'NotFound'
         return jobnode.strip()
@@ -309,7 +457,7 @@ class Task(object):
         :return: None
 
         """
-        self.assessor.attrs.set('%s/jobnode' % self.atype, jobnode)
+        self.write_attrs({'%s/jobnode' % self.atype: jobnode})
 
     def undo_processing(self):
         """
@@ -388,6 +536,7 @@ class Task(object):
         os.remove(os.path.join(self.upload_dir, local_zip))
         shutil.rmtree(os.path.join(self.upload_dir, local_dir))
 
+    @buffer_attrs
     def update_status(self):
         """
         Update the satus of a Task object.
@@ -455,7 +604,7 @@ undo_processing...')
         :return: string of the jobid
 
         """
-        jobid = self.assessor.attrs.get('%s/jobid' % self.atype)
+        jobid = self.read_attr('%s/jobid' % self.atype)
         if jobid is None:
             jobid = 'NotFound'
         return jobid.strip()
@@ -477,6 +626,7 @@ undo_processing...')
 
         return jobstatus
 
+    @buffer_attrs
     def launch(self, jobdir, job_email=None,
                job_email_options=DAX_SETTINGS.get_email_opts(),
                xnat_host=None, writeonly=False, pbsdir=None,
@@ -555,7 +705,7 @@ undo_processing...')
         :return: String of the date that the job started in "%Y-%m-%d" format
 
         """
-        return self.assessor.attrs.get('%s/jobstartdate' % self.atype)
+        return self.read_attr('%s/jobstartdate' % self.atype)
 
     def set_jobstartdate_today(self):
         """
@@ -577,7 +727,7 @@ undo_processing...')
         :return: None
 
         """
-        self.assessor.attrs.set('%s/jobstartdate' % self.atype, date_str)
+        self.write_attrs({'%s/jobstartdate' % self.atype: date_str})
 
     def get_createdate(self):
         """
@@ -587,7 +737,7 @@ undo_processing...')
          format
 
         """
-        return self.assessor.attrs.get('%s/date' % self.atype)
+        return self.read_attr('%s/date' % self.atype)
 
     def set_createdate(self, date_str):
         """
@@ -597,7 +747,7 @@ undo_processing...')
         :return: String of today's date in "%Y-%m-%d" format
 
         """
-        self.assessor.attrs.set('%s/date' % self.atype, date_str)
+        self.write_attrs({'%s/date' % self.atype: date_str})
         return date_str
 
     def set_createdate_today(self):
@@ -623,8 +773,8 @@ undo_processing...')
             xnat_status = DOES_NOT_EXIST
         elif self.atype.lower() in [DEFAULT_DATATYPE.lower(),
                                     DEFAULT_FS_DATATYPE.lower()]:
-            xnat_status = self.assessor.attrs.get('%s/procstatus'
-                                                  % self.atype.lower())
+            xnat_status = self.read_attr('%s/procstatus'
+                                         % self.atype.lower())
         else:
             xnat_status = 'UNKNOWN_xsiType: %s' % self.atype
         return xnat_status
@@ -642,7 +792,7 @@ undo_processing...')
             jobid = ''
         elif self.atype.lower() in [DEFAULT_DATATYPE.lower(),
                                     DEFAULT_FS_DATATYPE.lower()]:
-            xnat_status, qcstatus, jobid = self.assessor.attrs.mget([
+            xnat_status, qcstatus, jobid = self.read_attrs([
                 '%s/procstatus' % self.atype,
                 '%s/validation/status' % self.atype,
                 '%s/jobid' % self.atype
@@ -662,7 +812,7 @@ undo_processing...')
         :return: None
 
         """
-        self.assessor.attrs.set('%s/procstatus' % self.atype, status)
+        self.write_attrs({'%s/procstatus' % self.atype: status})
 
     def get_qcstatus(self):
         """
@@ -679,8 +829,8 @@ undo_processing...')
             qcstatus = DOES_NOT_EXIST
         elif self.atype.lower() in [DEFAULT_DATATYPE.lower(),
                                     DEFAULT_FS_DATATYPE.lower()]:
-            qcstatus = self.assessor.attrs.get('%s/validation/status'
-                                               % self.atype)
+            qcstatus = self.read_attr('%s/validation/status'
+                                      % self.atype)
         else:
             qcstatus = 'UNKNOWN_xsiType: %s' % self.atype
 
@@ -694,7 +844,7 @@ undo_processing...')
         :return: None
 
         """
-        self.assessor.attrs.mset({
+        self.write_attrs({
             '%s/validation/status' % self.atype: qcstatus,
             '%s/validation/validated_by' % self.atype: 'NULL',
             '%s/validation/date' % self.atype: 'NULL',
@@ -711,7 +861,7 @@ undo_processing...')
         :return: None
 
         """
-        self.assessor.attrs.mset({
+        self.write_attrs({
             '%s/procstatus' % self.atype: procstatus,
             '%s/validation/status' % self.atype: qcstatus,
         })
@@ -724,7 +874,7 @@ undo_processing...')
         :return: None
 
         """
-        self.assessor.attrs.set('%s/jobid' % self.atype, jobid)
+        self.write_attrs({'%s/jobid' % self.atype: jobid})
 
     def set_launch(self, jobid):
         """
@@ -736,7 +886,7 @@ undo_processing...')
 
         """
         today_str = str(date.today())
-        self.assessor.attrs.mset({
+        self.write_attrs({
             '%s/jobstartdate' % self.atype.lower(): today_str,
             '%s/jobid' % self.atype.lower(): jobid,
             '%s/procstatus' % self.atype.lower(): JOB_RUNNING,
@@ -824,11 +974,175 @@ undo_processing...')
             return JOB_RUNNING
 
 
+class LazyTask(Task):
+    """
+    Task built from an assessor row of XnatUtils.list_project_assessors
+
+    The pyxnat assessor object is only selected on XNAT when the task needs
+     it (e.g. to write its attributes), the statuses and job information
+     are read from the row.
+    """
+    # xpath of the attributes relative to the datatype -> key in the row
+    ROW_KEYS = {'procstatus': 'procstatus',
+                'validation/status': 'qcstatus',
+                'jobid': 'jobid',
+                'jobstartdate': 'jobstartdate',
+                'memused': 'memused',
+                'walltimeused': 'walltimeused',
+                'jobnode': 'jobnode'}
+
+    def __init__(self, processor, assr_info, upload_dir, xnat):
+        """
+        Init of class LazyTask
+
+        :param processor: processor used
+        :param assr_info: dictionary containing the assessor info
+         (See XnatUtils.list_project_assessors)
+        :param upload_dir: upload directory to copy data after job finished.
+        :param xnat: pyxnat.Interface object to select the assessor
+        :return: None
+
+        """
+        self.processor = processor
+        self.assr_info = assr_info
+        self.upload_dir = upload_dir
+        self.xnat = xnat
+        self.atype = processor.xsitype.lower()
+        self.pending_attrs = dict()
+        self.attrs_held = 0
+        self._assessor = None
+
+        self.assessor_id = assr_info['ID']
+        self.assessor_label = assr_info['label']
+        if '-x-' not in self.assessor_label:
+            self.assessor_label = '-x-'.join([
+                assr_info['project_id'], assr_info['subject_label'],
+                assr_info['session_label'], assr_info['label']])
+
+        self.row_attrs = dict()
+        for xpath, key in list(self.ROW_KEYS.items()):
+            if assr_info.get(key) is not None:
+                self.row_attrs['%s/%s' % (self.atype, xpath)] = \
+                    assr_info[key]
+
+    @property
+    def assessor(self):
+        """
+        pyxnat assessor object, selected on XNAT the first time it is used
+        """
+        if self._assessor is None:
+            self._assessor = self.xnat.select_assessor(
+                self.assr_info['project_id'],
+                self.assr_info['subject_id'],
+                self.assr_info['session_id'],
+                self.assessor_id)
+        return self._assessor
+
+    def use_interface(self, xnat):
+        """
+        Use another XNAT interface, e.g. the one of the worker updating it
+
+        :param xnat: pyxnat.Interface object to select the assessor
+        :return: None
+        """
+        if xnat is not self.xnat:
+            self.xnat = xnat
+            self._assessor = None
+
+    def flush_attrs(self):
+        """
+        Write the buffered attributes on XNAT with a single attrs.mset()
+
+        :return: number of attributes written
+
+        """
+        attrs = dict(self.pending_attrs)
+        nb_attrs = super(LazyTask, self).flush_attrs()
+        self.row_attrs.update(attrs)
+        return nb_attrs
+
+    def read_attr(self, name):
+        """
+        Get an attribute of the assessor from the buffer or the row if set
+
+        :param name: xpath of the attribute
+        :return: value of the attribute
+        """
+        value = self.pending_attrs.get(name, self.row_attrs.get(name))
+        if value is None:
+            return super(LazyTask, self).read_attr(name)
+        return value
+
+    def read_attrs(self, names):
+        """
+        Get attributes of the assessor from the buffer or the row if set
+
+        :param names: list of xpaths of the attributes
+        :return: list of the values in the same order
+        """
+        values = [self.pending_attrs.get(name, self.row_attrs.get(name))
+                  for name in names]
+        if None in values:
+            return super(LazyTask, self).read_attrs(names)
+        return values
+
+    def is_dax_datatype(self):
+        """
+        Check if the assessor has the procstatus and qcstatus attributes
+
+        :return: True for the dax datatypes, False otherwise
+        """
+        return self.atype in [DEFAULT_DATATYPE.lower(),
+                              DEFAULT_FS_DATATYPE.lower()]
+
+    def get_status(self):
+        """
+        Get the procstatus of an assessor
+
+        :return: The string of the procstatus of the assessor.
+        """
+        if not self.is_dax_datatype():
+            return super(LazyTask, self).get_status()
+        return self.read_attr('%s/procstatus' % self.atype)
+
+    def get_statuses(self):
+        """
+        Get the procstatus, qcstatus, and job id of an assessor
+
+        :return: Serially ordered strings of the assessor procstatus,
+         qcstatus, then jobid.
+        """
+        if not self.is_dax_datatype():
+            return super(LazyTask, self).get_statuses()
+        return tuple(self.read_attrs([
+            '%s/procstatus' % self.atype,
+            '%s/validation/status' % self.atype,
+            '%s/jobid' % self.atype
+        ]))
+
+    def get_qcstatus(self):
+        """
+        Get the qcstatus of the assessor
+
+        :return: A string of the qcstatus for the assessor
+        """
+        if not self.is_dax_datatype():
+            return super(LazyTask, self).get_qcstatus()
+        return self.read_attr('%s/validation/status' % self.atype)
+
+
 class ClusterTask(Task):
     """ Class Task to generate/manage the assessor with the cluster """
-    def __init__(self, assr_label, upload_dir, diskq):
+    def __init__(self, assr_label, upload_dir, diskq, attrs=None):
         """
         Init of class ClusterTask
+
+        :param assr_label: assessor label
+        :param upload_dir: upload directory to copy data when job finished.
+        :param diskq: path to the DiskQ folder
+        :param attrs: dictionary of the task attributes already loaded from
+         the DiskQ store (see load_task_queue), the missing ones are read on
+         demand, None to always read them from the store
         :return: None
 
         """
@@ -839,6 +1153,8 @@ class ClusterTask(Task):
         self.assessor_id = None
         self.diskq = diskq
         self.upload_dir = upload_dir
+        self.store = get_diskq_store(diskq)
+        self.attrs = attrs
 
     def get_processor_name(self):
         """
@@ -1221,9 +1537,9 @@ class ClusterTask(Task):
 
         """
         today_str = str(date.today())
-        self.set_attr('jobstartdate', today_str)
-        self.set_attr('jobid', jobid)
-        self.set_attr('procstatus', JOB_RUNNING)
+        self.set_attrs({'jobstartdate': today_str,
+                        'jobid': jobid,
+                        'procstatus': JOB_RUNNING})
 
     def commands(self, jobdir):
         """
@@ -1318,20 +1634,20 @@ class ClusterTask(Task):
         raise NotImplementedError()
 
     def get_attr(self, name):
-        apath = self.attr_path(name)
+        if self.attrs is None:
+            return self.store.get_attr(self.assessor_label, name)
 
-        if not os.path.exists(apath):
-            return None
-
-        with open(apath, 'r') as f:
-            return f.read().strip()
+        if name not in self.attrs:
+            self.attrs[name] = self.store.get_attr(self.assessor_label, name)
+        return self.attrs[name]
 
     def set_attr(self, name, value):
-        attr_path = self.attr_path(name)
-        attr_dir = os.path.dirname(attr_path)
-        mkdirp(attr_dir)
-        with open(self.attr_path(name), 'w') as f:
-            f.write(str(value) + '\n')
+        self.set_attrs({name: value})
+
+    def set_attrs(self, attrs):
+        self.store.set_attrs(self.assessor_label, attrs)
+        if self.attrs is not None:
+            self.attrs.update((k, str(v)) for k, v in attrs.items())
 
     def attr_path(self, attr):
         return os.path.join(self.diskq, attr, self.assessor_label)
@@ -1389,10 +1705,9 @@ class ClusterTask(Task):
         return JOB_FAILED
 
     def delete_attr(self, attr):
-        try:
-            os.remove(self.attr_path(attr))
-        except OSError:
-            pass
+        self.store.delete_attr(self.assessor_label, attr)
+        if self.attrs is not None:
+            self.attrs.pop(attr, None)
 
     def delete_batch(self):
         # Delete batch file
@@ -1403,10 +1718,9 @@ class ClusterTask(Task):
 
     def delete(self):
         # Delete attributes
-        attr_list = ['jobid', 'jobnode', 'procstatus', 'walltimeused',
-                     'memused', 'jobstartdate']
-        for attr in attr_list:
-            self.delete_attr(attr)
+        self.store.delete(self.assessor_label)
+        if self.attrs is not None:
+            self.attrs.clear()
 
         self.delete_batch()
 
@@ -1437,6 +1751,7 @@ class XnatTask(Task):
         """
         raise NotImplementedError()
 
+    @buffer_attrs
     def update_status(self):
         """
         Update the satus of an XNAT Task object.
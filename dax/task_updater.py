@@ -0,0 +1,230 @@
+""" task_updater.py: update the status of the tasks concurrently """
+
+from builtins import object
+
+from collections import Counter, OrderedDict
+import logging
+import threading
+import time
+import traceback
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+
+__copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
+__all__ = ['TaskUpdater']
+LOGGER = logging.getLogger('dax')
+ERROR = 'ERROR'
+
+
+class TaskUpdater(object):
+    """
+    Update the status of tasks with a bounded number of threads
+
+    A task still updating after the timeout is reported as timed out and
+    left running in a daemon thread so the other tasks of the cycle go on
+    without it. Its thread keeps counting against the number of workers
+    until it ends. When all the workers are held by timed out tasks, the
+    tasks not started yet are skipped until the next cycle. A task ending
+    after its timeout writes its own attributes if they were buffered
+    (flush=False): the caller only writes the ones of the tasks updated in
+    time. The transitions of the statuses and the time spent in each phase
+    of the cycle are logged by log_summary().
+    """
+    def __init__(self, nb_workers=1, timeout=0, update_kwargs=None,
+                 worker_context=None):
+        """
+        Entry point for the TaskUpdater class
+
+        :param nb_workers: number of tasks updated at the same time
+        :param timeout: seconds before giving up on the update of a task,
+         0 for no timeout
+        :param update_kwargs: keyword arguments for task.update_status()
+        :param worker_context: function called with a task that returns the
+         context manager its update runs in (e.g. to give the task the XNAT
+         interface of the worker), None for no context
+        :return: None
+        """
+        self.nb_workers = max(1, nb_workers)
+        self.timeout = timeout if timeout and timeout > 0 else None
+        self.update_kwargs = update_kwargs or dict()
+        self.worker_context = worker_context
+        self.transitions = Counter()
+        self.updated = list()
+        self.timed_out = list()
+        self.failed = list()
+        self.skipped = list()
+        self.phase_times = OrderedDict()
+        self.phase = None
+        self.phase_start = None
+        self.abandoned = list()
+        self.results = Queue()
+        # Tasks whose update ended, to decide which ones timed out
+        self.lock = threading.Lock()
+        self.ended = set()
+
+    def start_phase(self, name):
+        """
+        Start timing a phase of the cycle, ending the current one
+
+        :param name: name of the phase, None to only end the current one
+        :return: None
+        """
+        now = time.time()
+        if self.phase is not None:
+            self.phase_times[self.phase] = \
+                self.phase_times.get(self.phase, 0) + now - self.phase_start
+        self.phase = name
+        self.phase_start = now
+
+    def update(self, tasks):
+        """
+        Update the status of the tasks
+
+        :param tasks: list of Task/ClusterTask objects
+        :return: list of the tasks updated within the timeout
+        """
+        if self.nb_workers == 1 and self.timeout is None:
+            for cur_task in tasks:
+                self._record(cur_task, *self._run(cur_task))
+            return list(self.updated)
+
+        pending = list(tasks)
+        running = dict()
+        while pending or running:
+            self.abandoned = [t for t in self.abandoned if t.is_alive()]
+            while pending and \
+                    len(running) + len(self.abandoned) < self.nb_workers:
+                cur_task = pending.pop(0)
+                worker = threading.Thread(target=self._update_worker,
+                                          args=(cur_task, self.results))
+                worker.daemon = True
+                running[id(cur_task)] = (cur_task, worker, time.time())
+                worker.start()
+
+            if not running:
+                # Only the timed out tasks hold the workers
+                LOGGER.error('%d workers held by timed out tasks, %d tasks '
+                             'skipped until the next update'
+                             % (len(self.abandoned), len(pending)))
+                self.skipped.extend(pending)
+                break
+
+            wait = None
+            if self.timeout is not None and running:
+                first_start = min(start for _, _, start in running.values())
+                wait = max(0, first_start + self.timeout - time.time())
+            try:
+                # The timed out tasks also put their result when they end
+                cur_task, result = self.results.get(timeout=wait)
+                if running.pop(id(cur_task), None) is not None:
+                    self._record(cur_task, *result)
+            except Empty:
+                pass
+
+            if self.timeout is not None:
+                now = time.time()
+                for key, (cur_task, worker, start) in list(running.items()):
+                    if now - start < self.timeout:
+                        continue
+                    with self.lock:
+                        if key in self.ended:
+                            # its result is in the queue
+                            continue
+                        self.timed_out.append(cur_task)
+                    del running[key]
+                    self.abandoned.append(worker)
+                    LOGGER.error('timeout after %ds updating task: %s'
+                                 % (self.timeout, cur_task.assessor_label))
+
+        return list(self.updated)
+
+    def wait_abandoned(self, timeout):
+        """
+        Wait for the threads of the timed out tasks to end
+
+        :param timeout: maximum number of seconds to wait for all of them
+        :return: number of threads still running
+        """
+        end = time.time() + (timeout or 0)
+        for worker in self.abandoned:
+            worker.join(max(0, end - time.time()))
+        self.abandoned = [t for t in self.abandoned if t.is_alive()]
+        if self.abandoned:
+            LOGGER.error('%d timed out tasks still running, their new '
+                         'status may not be saved' % len(self.abandoned))
+        return len(self.abandoned)
+
+    def _update_worker(self, cur_task, results):
+        results.put((cur_task, self._run(cur_task)))
+
+    def _run(self, cur_task):
+        if self.worker_context is None:
+            return self._update_status(cur_task)
+        with self.worker_context(cur_task):
+            return self._update_status(cur_task)
+
+    def _end_update(self, cur_task):
+        """ Mark the update of a task ended, return True if timed out """
+        with self.lock:
+            self.ended.add(id(cur_task))
+            return any(t is cur_task for t in self.timed_out)
+
+    def _update_status(self, cur_task):
+        """ Update a task, return the old status, new status and error """
+        old_status = None
+        try:
+            old_status = cur_task.get_status()
+            LOGGER.info('     Updating task: %s' % cur_task.assessor_label)
+            new_status = cur_task.update_status(**self.update_kwargs)
+        except Exception as err:
+            self._end_update(cur_task)
+            LOGGER.error('failed to update task %s: %s\n%s'
+                         % (cur_task.assessor_label, err,
+                            traceback.format_exc()))
+            return old_status, None, err
+
+        if self._end_update(cur_task) and \
+           self.update_kwargs.get('flush') is False:
+            # Timed out: the attributes buffered are not written by the
+            # caller anymore
+            try:
+                cur_task.flush_attrs()
+                LOGGER.info('task %s updated after the timeout: %s'
+                            % (cur_task.assessor_label, new_status))
+            except Exception as err:
+                LOGGER.error('failed to set the attributes of %s after the '
+                             'timeout: %s' % (cur_task.assessor_label, err))
+        return old_status, new_status, None
+
+    def _record(self, cur_task, old_status, new_status, error):
+        if error is not None:
+            self.failed.append(cur_task)
+            self.transitions[(old_status, ERROR)] += 1
+        else:
+            self.updated.append(cur_task)
+            self.transitions[(old_status, new_status)] += 1
+
+    def log_summary(self):
+        """
+        Log the transitions of the statuses and the time spent per phase
+
+        :return: None
+        """
+        self.start_phase(None)
+        nb_tasks = len(self.updated) + len(self.failed) + len(self.timed_out)
+        LOGGER.info('%d tasks updated: %d failed, %d timed out, %d skipped'
+                    % (nb_tasks, len(self.failed), len(self.timed_out),
+                       len(self.skipped)))
+        for (old_status, new_status), count in \
+                sorted(self.transitions.items(), key=lambda x: str(x[0])):
+            if old_status != new_status:
+                LOGGER.info('  %s -> %s: %d'
+                            % (old_status, new_status, count))
+        if self.phase_times:
+            LOGGER.info('Time per phase: %s' % ', '.join(
+                '%s %.1fs' % (name, seconds)
+                for name, seconds in self.phase_times.items()))
@@ -0,0 +1,106 @@
+""" benchmark_extract_exp.py: cost of the scan type matching of a build
+
+Standalone script, not collected by the test runners:
+
+    python -m dax.tests.benchmark_extract_exp
+
+Compares compiling the patterns for every scan, the cached extract_exp and
+match_many. The correctness of both is tested in unit_test_xnatutils.py.
+"""
+
+from __future__ import print_function
+
+import fnmatch
+import re
+import sys
+import timeit
+
+from dax import XnatUtils
+
+
+# scan types of a build: many scans, processors filtering a few types each
+SCAN_TYPES = ['T1', 'MPRAGE', 'FLAIR', 'T2', 'DTI_64dir', 'fMRI_rest',
+              'Survey', 'B0_map', 'T1W_SENSE', 'T2_FLAIR']
+NB_SESSIONS = 5
+NB_PROCESSORS = 10
+PROC_TYPES = ['T1', 'MPRAGE*', 'T1W*', 'FLAIR*', 'T2_FLAIR']
+
+
+def uncached_good_type(scan_type, types_list):
+    """
+    Match a scan type compiling the patterns each time
+
+    :param scan_type: scan type to match
+    :param types_list: list of scan types patterns
+    :return: True if the scan type matches a pattern, False otherwise
+    """
+    for exp in types_list:
+        regex = re.compile(fnmatch.translate(exp))
+        if regex.match(scan_type):
+            return True
+    return False
+
+
+def cached_good_type(scan_type, types_list):
+    """
+    Match a scan type with the patterns cached by extract_exp
+
+    :param scan_type: scan type to match
+    :param types_list: list of scan types patterns
+    :return: True if the scan type matches a pattern, False otherwise
+    """
+    return XnatUtils.match_many([scan_type], types_list)[0]
+
+
+def build(scan_types, good_type):
+    """
+    Match the scans of all the sessions for each processor, one by one
+
+    :param scan_types: scan types of the sessions
+    :param good_type: method matching one scan type
+    :return: list of booleans for each processor and scan
+    """
+    return [good_type(scan_type, PROC_TYPES)
+            for _ in range(NB_PROCESSORS)
+            for scan_type in scan_types]
+
+
+def build_vectorised(scan_types):
+    """
+    Match the scans of all the sessions for each processor at once
+
+    :param scan_types: scan types of the sessions
+    :return: list of booleans for each processor and scan
+    """
+    return sum([XnatUtils.match_many(scan_types, PROC_TYPES)
+                for _ in range(NB_PROCESSORS)], [])
+
+
+def main():
+    """
+    Time the three ways of matching the scan types
+
+    :return: 0 if they all give the same result, 1 if not
+    """
+    scan_types = SCAN_TYPES * 14 * NB_SESSIONS
+    expected = build(scan_types, uncached_good_type)
+    if build(scan_types, cached_good_type) != expected or \
+       build_vectorised(scan_types) != expected:
+        print('cached patterns do not match as the uncompiled ones')
+        return 1
+
+    uncached = min(timeit.repeat(
+        lambda: build(scan_types, uncached_good_type), number=1, repeat=3))
+    cached = min(timeit.repeat(
+        lambda: build(scan_types, cached_good_type), number=1, repeat=3))
+    vectorised = min(timeit.repeat(
+        lambda: build_vectorised(scan_types), number=1, repeat=3))
+    print('%d processors x %d scans: %.4fs uncompiled, %.4fs cached '
+          '(x%.1f), %.4fs match_many (x%.1f)'
+          % (NB_PROCESSORS, len(scan_types), uncached, cached,
+             uncached / cached, vectorised, uncached / vectorised))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+""" benchmark_gzip.py: peak memory and throughput of XnatUtils.gzip_file
+
+Standalone script, not collected by the test runners (Linux only, the peak
+RSS is read from /proc and depends on the machine):
+
+    python -m dax.tests.benchmark_gzip [size in MB] [threads]
+
+Each method runs in a new process to measure its own peak RSS. The script
+exits with an error if gzip_file reads the whole file in memory.
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from dax import XnatUtils
+
+
+# size of the NIfTI file compressed
+SIZE_MB = 32
+NB_THREADS = 4
+
+# Run in a new process to measure the peak RSS of one method only
+SCRIPT = '''
+import gzip
+import json
+import sys
+import time
+
+from dax import XnatUtils
+
+
+def rss_kb(field):
+    with open('/proc/self/status') as fin:
+        for line in fin:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+
+
+def read_all_gzip(fpath):
+    content = open(fpath, 'rb').read()
+    fout = gzip.open(fpath + '.gz', 'wb')
+    fout.write(content)
+    fout.close()
+
+
+method, fpath = sys.argv[1:3]
+start_rss = rss_kb('VmRSS')
+start = time.time()
+if method == 'read_all':
+    read_all_gzip(fpath)
+elif method == 'gunzip':
+    XnatUtils.gunzip_file(fpath + '.gz')
+else:
+    XnatUtils.gzip_file(fpath, nb_threads=int(method))
+duration = time.time() - start
+print(json.dumps({'seconds': duration,
+                  'peak_rss_mb': (rss_kb('VmHWM') - start_rss) / 1024.0}))
+'''
+
+
+def run_method(method, fpath, data):
+    """
+    Compress the file in a new process with one method
+
+    :param method: 'read_all', 'gunzip' or the number of threads of gzip_file
+    :param fpath: path of the file to compress
+    :param data: content of the file
+    :return: dictionary with the seconds and the peak RSS in MB
+    """
+    with open(fpath, 'wb') as fout:
+        fout.write(data)
+    if method == 'gunzip':
+        XnatUtils.gzip_file(fpath)
+    output = subprocess.check_output(
+        [sys.executable, '-c', SCRIPT, method, fpath])
+    for cur_path in [fpath, fpath + '.gz']:
+        if os.path.exists(cur_path):
+            os.remove(cur_path)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main(size_mb=SIZE_MB, nb_threads=NB_THREADS):
+    """
+    Compare the memory used to compress a file in memory and streamed
+
+    :param size_mb: size of the file in MB
+    :param nb_threads: number of threads of the last run of gzip_file
+    :return: 0 if the memory of gzip_file/gunzip_file is bounded, 1 if not
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        # compressible like an image: small values with noise
+        data = np.random.randint(0, 16, size_mb * 1024 * 1024,
+                                 np.uint8).tostring()
+        fpath = os.path.join(tmp_dir, 'image.nii')
+        results = dict()
+        for method in ['read_all', '1', str(nb_threads), 'gunzip']:
+            results[method] = run_method(method, fpath, data)
+            print('gzip %dMB %s: %.2fs, %.1fMB/s, peak RSS +%.1fMB'
+                  % (size_mb, method, results[method]['seconds'],
+                     size_mb / results[method]['seconds'],
+                     results[method]['peak_rss_mb']))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    # the file is not read in memory anymore, with threads only the blocks
+    # compressed and their output are
+    block_mb = XnatUtils.GZIP_BLOCK_SIZE / (1024 * 1024)
+    bounds = {'1': size_mb / 2.0,
+              str(nb_threads): 2 * nb_threads * block_mb + 4,
+              'gunzip': size_mb / 2.0}
+    status = 0
+    for method, bound in sorted(bounds.items()):
+        if results[method]['peak_rss_mb'] >= bound:
+            print('%s: peak RSS +%.1fMB over %.1fMB'
+                  % (method, results[method]['peak_rss_mb'], bound))
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:3]]))
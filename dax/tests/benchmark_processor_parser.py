@@ -0,0 +1,117 @@
+""" benchmark_processor_parser.py: cost of the artefacts matching of a build
+
+Standalone script, not collected by the test runners:
+
+    python -m dax.tests.benchmark_processor_parser
+
+Compares parsing a session for each processor with per-processor artefacts
+and with the artefacts shared by parse_artefacts. The correctness of both is
+tested in unit_test_processor_parser.py (SharedArtefactsTest).
+"""
+
+from __future__ import print_function
+
+import copy
+import StringIO
+import sys
+import timeit
+
+import yaml
+
+from dax.processor_parser import ProcessorParser
+from dax.tests import unit_test_common_processor_yamls as yamls
+from dax.tests.unit_test_processor_parser import TestSession, scan_files
+
+
+# synthetic session: many scans sharing a few scan types
+SCAN_TYPES = ['T1', 'FLAIR', 'T2', 'DTI', 'fMRI_rest', 'Survey', 'B0_map']
+NB_SCANS = 140
+NB_PROCESSORS = 10
+
+
+def processor_yaml(index):
+    """
+    Generate the yaml of a processor filtering a few scan types
+
+    :param index: index of the processor, used in its name
+    :return: yaml of the processor as a string
+    """
+    return yamls.generate_yaml(
+        'proc%d' % index,
+        scans=[
+            {
+                'name': 'scanx', 'types': 'T1,MPRAGE*,T1W',
+                'select': 'foreach',
+                'resources': [
+                    {'type': 'NIFTI', 'name': 't1'}
+                ]
+            },
+            {
+                'name': 'scany', 'types': 'FLAIR*,T2_FLAIR',
+                'select': 'foreach(scanx)',
+                'resources': [
+                    {'type': 'NIFTI', 'name': 'fl'}
+                ]
+            },
+        ],
+        assessors=[]
+    )
+
+
+def synthetic_session():
+    """
+    Generate a session with NB_SCANS scans cycling through SCAN_TYPES
+
+    :return: TestSession
+    """
+    scans = [('proj1', 'subj1', 'sess1', str(i),
+              SCAN_TYPES[i % len(SCAN_TYPES)], 'usable',
+              copy.deepcopy(scan_files))
+             for i in range(NB_SCANS)]
+    return TestSession().OldInit('proj1', 'subj1', 'sess1', scans, [])
+
+
+def parse_all(parsers, csess, shared):
+    """
+    Parse the session for each processor
+
+    :param parsers: list of ProcessorParser
+    :param csess: session to parse
+    :param shared: parse the artefacts once for all the processors
+    :return: list of the parameter matrix of each processor
+    """
+    artefacts = None
+    if shared:
+        artefacts = ProcessorParser.parse_artefacts([csess])
+    for parser in parsers:
+        parser.parse_session(csess, [csess], artefacts)
+    return [p.parameter_matrix for p in parsers]
+
+
+def main():
+    """
+    Time the parsing with per-processor and shared artefacts
+
+    :return: 0 if both give the same parameter matrices, 1 if not
+    """
+    parsers = [
+        ProcessorParser(yaml.load(StringIO.StringIO(processor_yaml(i))))
+        for i in range(NB_PROCESSORS)]
+    csess = synthetic_session()
+    if parse_all(parsers, csess, False) != parse_all(parsers, csess, True):
+        print('shared artefacts do not give the same parameter matrices')
+        return 1
+
+    per_processor = min(timeit.repeat(
+        lambda: parse_all(parsers, csess, False), number=5, repeat=3))
+    shared = min(timeit.repeat(
+        lambda: parse_all(parsers, csess, True), number=5, repeat=3))
+    print('%d processors x %d scans: %.4fs per-processor artefacts, '
+          '%.4fs shared artefacts (x%.1f)'
+          % (NB_PROCESSORS, NB_SCANS, per_processor, shared,
+             per_processor / shared))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -40,6 +40,22 @@ class AutoProcessorUnitTest(TestCase):
         ap = AutoProcessor(common.FakeXnat, yaml_source)
 
 
+    def test_copy_for_build(self):
+        yaml_source = self._make_yaml_source(
+            common.processor_yamls.scan_brain_tiv_from_gif_yaml)
+        ap = AutoProcessor(common.FakeXnat, yaml_source)
+        ap_copy = ap.copy_for_build()
+        # state set by parse_session on the copy only
+        ap_copy.parser.csess = 'sess1'
+        ap_copy.parser.assessor_parameter_map = [('inputs', [])]
+        self.assertIsNone(ap.parser.csess)
+        self.assertIsNone(ap.get_assessor_mapping())
+        self.assertEqual(ap_copy.get_assessor_mapping(), [('inputs', [])])
+        # the parsed yaml is shared
+        self.assertIs(ap_copy.parser.inputs, ap.parser.inputs)
+        self.assertEqual(ap_copy.name, ap.name)
+
+
     def test_test(self):
         print("hello world")
 
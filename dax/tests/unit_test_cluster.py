@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from string import Template
+from unittest import TestCase
+
+from dax import cluster
+
+
+class JobStatusesTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.listing = os.path.join(self.tmp_dir, 'jobs.txt')
+        with open(self.listing, 'w') as f:
+            f.write('101 R\n102 Q\n103 CG\n\n')
+        self.settings = cluster.DAX_SETTINGS
+        cluster.DAX_SETTINGS = _FakeSettings('cat %s' % self.listing)
+
+    def tearDown(self):
+        cluster.DAX_SETTINGS = self.settings
+        cluster.clear_job_statuses()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_load_job_statuses(self):
+        statuses = cluster.load_job_statuses()
+        self.assertEqual(statuses, {'101': 'R', '102': 'Q', '103': None})
+        self.assertEqual(cluster.job_status(101), 'R')
+        self.assertEqual(cluster.job_status('102'), 'Q')
+        # not listed: polled with cmd_get_job_status
+        cluster.DAX_SETTINGS.job_cmd = 'echo C'
+        self.assertEqual(cluster.job_status('104'), 'C')
+        cluster.DAX_SETTINGS.job_cmd = 'echo R'
+        self.assertEqual(cluster.job_status('105'), 'R')
+        # and kept for the rest of the run
+        self.assertEqual(cluster.job_status('104'), 'C')
+
+    def test_fallback_to_job_polling(self):
+        cluster.DAX_SETTINGS.all_jobs_cmd = ''
+        self.assertIsNone(cluster.load_job_statuses())
+        # cmd_get_job_status template prints the status of the job
+        self.assertEqual(cluster.job_status('101'), 'R')
+
+    def test_fallback_when_listing_fails(self):
+        cluster.DAX_SETTINGS.all_jobs_cmd = 'exit 1'
+        self.assertIsNone(cluster.load_job_statuses())
+        self.assertEqual(cluster.job_status('101'), 'R')
+
+
+class JobsUsageTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.usage = os.path.join(self.tmp_dir, 'usage.txt')
+        with open(self.usage, 'w') as f:
+            f.write('101 2048 00:10:00 node1\n102 0 00:00:05\n')
+        self.settings = cluster.DAX_SETTINGS
+        cluster.DAX_SETTINGS = _FakeSettings(
+            '', 'echo ${jobids} ${numberofdays} > %s.args; cat %s'
+            % (self.usage, self.usage))
+
+    def tearDown(self):
+        cluster.DAX_SETTINGS = self.settings
+        cluster.clear_jobs_usage()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_load_jobs_usage(self):
+        today = datetime.today().strftime('%Y-%m-%d')
+        usage = cluster.load_jobs_usage(['101', 102], today)
+        self.assertEqual(len(usage), 2)
+        with open(self.usage + '.args') as f:
+            self.assertEqual(f.read().strip(), '101,102 1')
+
+        self.assertEqual(cluster.tracejob_info('101', today),
+                         {'mem_used': '2048', 'walltime_used': '00:10:00',
+                          'jobnode': 'node1'})
+        self.assertEqual(cluster.tracejob_info(102, today),
+                         {'mem_used': '0', 'walltime_used': '00:00:05',
+                          'jobnode': ''})
+
+    def test_not_loaded_without_template(self):
+        cluster.DAX_SETTINGS.all_jobs_usage_cmd = ''
+        self.assertIsNone(cluster.load_jobs_usage(['101'], '2018-01-01'))
+
+
+class _FakeSettings(object):
+
+    def __init__(self, all_jobs_cmd, all_jobs_usage_cmd=''):
+        self.all_jobs_cmd = all_jobs_cmd
+        self.all_jobs_usage_cmd = all_jobs_usage_cmd
+        self.job_cmd = 'echo R'
+
+    def get_cmd_get_all_jobs_usage(self):
+        if not self.all_jobs_usage_cmd:
+            return ''
+        return Template(self.all_jobs_usage_cmd)
+
+    def get_cmd_get_all_jobs_status(self):
+        if not self.all_jobs_cmd:
+            return ''
+        return Template(self.all_jobs_cmd)
+
+    def get_cmd_get_job_status(self):
+        return Template(self.job_cmd)
+
+    def get_running_status(self):
+        return 'R'
+
+    def get_queue_status(self):
+        return 'Q'
+
+    def get_complete_status(self):
+        return 'C'
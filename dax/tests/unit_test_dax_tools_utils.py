@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+import matplotlib.image
+import numpy as np
+
+from dax import dax_tools_utils
+
+
+class _FakeSession(object):
+
+    def __init__(self, key, exists):
+        self.key = key
+        self.exists_ = exists
+
+    def exists(self):
+        return self.exists_
+
+
+class UploadAssessorsTest(TestCase):
+
+    def setUp(self):
+        self.saved = (dax_tools_utils.get_assessor_list,
+                      dax_tools_utils.upload_assessor,
+                      dax_tools_utils.XnatUtils.select_obj)
+        self.lock = threading.Lock()
+        self.selected = list()
+        self.uploaded = list()
+        dax_tools_utils.get_assessor_list = lambda projects: [
+            'proj1-x-subj1-x-sess1-x-proc1',
+            'proj1-x-subj1-x-sess2-x-proc1',
+            'proj1-x-subj1-x-sess1-x-proc2',
+            'proj1-x-subj2-x-sess3-x-proc1',
+            'proj1-x-subj1-x-sess1-x-proc3',
+            'bad_label']
+        dax_tools_utils.upload_assessor = self._upload_assessor
+        dax_tools_utils.XnatUtils.select_obj = self._select_obj
+
+    def tearDown(self):
+        (dax_tools_utils.get_assessor_list,
+         dax_tools_utils.upload_assessor,
+         dax_tools_utils.XnatUtils.select_obj) = self.saved
+
+    def _select_obj(self, intf, project, subject, session):
+        with self.lock:
+            self.selected.append(session)
+        return _FakeSession(session, session != 'sess3')
+
+    def _upload_assessor(self, xnat, assessor_dict, assessor_path,
+                         session_obj=None):
+        assert session_obj.key == assessor_dict['session_label']
+        label = assessor_dict['label']
+        with self.lock:
+            self.uploaded.append(label)
+        if label.endswith('proc2'):
+            raise IOError('connection reset')
+        return not label.endswith('proc3')
+
+    def test_grouped_by_session_and_reported(self):
+        warnings = dax_tools_utils.upload_assessors(None, None)
+
+        self.assertEqual(sorted(self.selected), ['sess1', 'sess2', 'sess3'])
+        # no upload for the session missing on XNAT
+        self.assertEqual(len(self.uploaded), 4)
+        self.assertEqual(sorted(warnings), [
+            '    - Assessor label : proj1-x-subj1-x-sess1-x-proc2\n',
+            '    - Assessor label : proj1-x-subj1-x-sess1-x-proc3\n'])
+
+
+class SnapshotPreviewTest(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_preview_from_original(self):
+        original = os.path.join(self.tmpdir, 'SNAPSHOTS',
+                                dax_tools_utils.SNAPSHOTS_ORIGINAL)
+        os.makedirs(os.path.dirname(original))
+        matplotlib.image.imsave(original, np.random.rand(1000, 750))
+        dax_tools_utils.generate_snapshots(self.tmpdir)
+
+        preview = matplotlib.image.imread(os.path.join(
+            self.tmpdir, 'SNAPSHOTS', dax_tools_utils.SNAPSHOTS_PREVIEW))
+        self.assertEqual(preview.shape[:2], (200, 150))
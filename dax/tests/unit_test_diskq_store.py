@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from dax.diskq_store import FileTaskStore, SQLiteTaskStore, migrate_diskq
+from dax.task import ClusterTask
+
+
+LABEL1 = 'proj1-x-subj1-x-sess1-x-proc1'
+LABEL2 = 'proj1-x-subj1-x-sess1-x-proc2'
+LABEL3 = 'proj2-x-subj2-x-sess2-x-proc1'
+
+
+class TaskStoreTest(object):
+
+    def setUp(self):
+        self.diskq = tempfile.mkdtemp()
+        self.store = self.make_store(self.diskq)
+
+    def tearDown(self):
+        shutil.rmtree(self.diskq)
+
+    def test_get_set_delete(self):
+        self.assertIsNone(self.store.get_attr(LABEL1, 'jobid'))
+        self.store.set_attr(LABEL1, 'jobid', 1234)
+        self.assertEqual(self.store.get_attr(LABEL1, 'jobid'), '1234')
+        self.store.set_attrs(LABEL1, {'procstatus': 'JOB_RUNNING',
+                                      'jobnode': 'node1'})
+        self.store.delete_attr(LABEL1, 'jobnode')
+        self.assertIsNone(self.store.get_attr(LABEL1, 'jobnode'))
+        self.store.delete(LABEL1)
+        self.assertEqual(self.store.load_attrs(), {})
+
+    def test_load_attrs_filters(self):
+        self.store.set_many({
+            LABEL1: {'procstatus': 'JOB_RUNNING', 'jobid': '1'},
+            LABEL2: {'procstatus': 'NEED_TO_RUN'},
+            LABEL3: {'procstatus': 'JOB_RUNNING', 'jobid': '3'}})
+
+        self.assertEqual(len(self.store.load_attrs()), 3)
+        self.assertEqual(sorted(self.store.load_attrs(projects=['proj1'])),
+                         [LABEL1, LABEL2])
+        self.assertEqual(
+            self.store.load_attrs(projects=['proj1'], status='JOB_RUNNING'),
+            {LABEL1: {'procstatus': 'JOB_RUNNING', 'jobid': '1'}})
+        self.assertEqual(
+            self.store.load_attrs(labels=[LABEL1, LABEL3],
+                                  names=['procstatus']),
+            {LABEL1: {'procstatus': 'JOB_RUNNING'},
+             LABEL3: {'procstatus': 'JOB_RUNNING'}})
+
+
+class FileTaskStoreTest(TaskStoreTest, TestCase):
+
+    def make_store(self, diskq):
+        return FileTaskStore(diskq)
+
+    def test_load_attrs_opens_labels_only(self):
+        self.store.set_many({
+            LABEL1: {'procstatus': 'JOB_RUNNING', 'jobid': '1'},
+            LABEL2: {'procstatus': 'NEED_TO_RUN'}})
+        opened = list()
+        get_attr = self.store.get_attr
+
+        def counting_get_attr(label, name):
+            opened.append((label, name))
+            return get_attr(label, name)
+
+        self.store.get_attr = counting_get_attr
+        self.store.load_attrs(labels=[LABEL1, LABEL3], names=['procstatus'])
+        self.assertEqual(opened, [(LABEL1, 'procstatus')])
+
+    def test_task_reads_missing_attrs(self):
+        self.store.set_many({
+            LABEL1: {'procstatus': 'JOB_RUNNING', 'jobid': '1'}})
+        attrs = self.store.load_attrs(names=['procstatus'])[LABEL1]
+        cur_task = ClusterTask(LABEL1, self.diskq, self.diskq, attrs=attrs)
+        self.assertEqual(cur_task.get_attr('jobid'), '1')
+        self.assertIsNone(cur_task.get_attr('jobnode'))
+        self.assertEqual(attrs, {'procstatus': 'JOB_RUNNING', 'jobid': '1',
+                                 'jobnode': None})
+
+
+class SQLiteTaskStoreTest(TaskStoreTest, TestCase):
+
+    def make_store(self, diskq):
+        return SQLiteTaskStore(diskq)
+
+    def test_migrate_diskq(self):
+        FileTaskStore(self.diskq).set_many({
+            LABEL1: {'procstatus': 'JOB_RUNNING', 'jobid': '1'},
+            LABEL3: {'procstatus': 'NEED_TO_RUN'}})
+
+        self.assertEqual(migrate_diskq(self.diskq, remove_files=True), 2)
+        self.assertEqual(self.store.get_attr(LABEL1, 'jobid'), '1')
+        self.assertEqual(self.store.get_attr(LABEL3, 'procstatus'),
+                         'NEED_TO_RUN')
+        self.assertFalse(os.path.exists(os.path.join(self.diskq, 'jobid')))
@@ -0,0 +1,436 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from dax import launcher, modules
+from dax.errors import DaxLauncherError
+
+
+class _RecordHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = list()
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def _bare_launcher(build_workers=None, build_pool_type=None):
+    lchr = launcher.Launcher.__new__(launcher.Launcher)
+    lchr.build_workers = build_workers
+    lchr.build_pool_type = build_pool_type
+    return lchr
+
+
+class BuildPoolTest(TestCase):
+
+    def test_get_build_pool_global(self):
+        lchr = _bare_launcher(4, 'process')
+        self.assertEqual(lchr.get_build_pool('proj1'), (4, 'process'))
+
+    def test_get_build_pool_per_project(self):
+        lchr = _bare_launcher({'proj1': 8}, {'proj1': 'process'})
+        self.assertEqual(lchr.get_build_pool('proj1'), (8, 'process'))
+        workers, pool_type = lchr.get_build_pool('proj2')
+        self.assertEqual(workers,
+                         launcher.DAX_SETTINGS.get_build_workers())
+        self.assertEqual(pool_type,
+                         launcher.DAX_SETTINGS.get_build_pool_type())
+
+    def test_get_build_pool_bad_type(self):
+        lchr = _bare_launcher(2, 'greenlet')
+        with self.assertRaises(DaxLauncherError):
+            lchr.get_build_pool('proj1')
+
+
+class SubjectLogFilterTest(TestCase):
+
+    def setUp(self):
+        self.handler = _RecordHandler()
+        launcher.LOGGER.addHandler(self.handler)
+        self.level = launcher.LOGGER.level
+        launcher.LOGGER.setLevel(logging.INFO)
+
+    def tearDown(self):
+        launcher.LOGGER.removeHandler(self.handler)
+        launcher.LOGGER.setLevel(self.level)
+        launcher._SUBJECT_LOGS.records = None
+
+    def test_records_held_back_then_replayed(self):
+        launcher._SUBJECT_LOGS.records = list()
+        launcher.LOGGER.info('subject %s', 'sub1')
+        held = launcher._SUBJECT_LOGS.records
+        launcher._SUBJECT_LOGS.records = None
+        self.assertEqual(self.handler.records, [])
+        self.assertEqual(len(held), 1)
+
+        for record in held:
+            launcher.LOGGER.handle(launcher.freeze_log_record(record))
+        self.assertEqual([r.getMessage() for r in self.handler.records],
+                         ['subject sub1'])
+        self.assertIsNone(self.handler.records[0].args)
+
+    def test_records_not_held_outside_workers(self):
+        launcher.LOGGER.info('project')
+        self.assertEqual(len(self.handler.records), 1)
+
+
+class _FakeTask(object):
+
+    def __init__(self, label):
+        self.assessor_label = label
+        self.launched = False
+
+    def launch(self, force_no_qsub=False):
+        self.launched = True
+        return True
+
+
+class _LaunchSettings(object):
+
+    def __init__(self, workers, resync_jobs, resync_seconds=60):
+        self.workers = workers
+        self.resync_jobs = resync_jobs
+        self.resync_seconds = resync_seconds
+
+    def get_cmd_submit(self):
+        return 'sbatch'
+
+    def get_launch_workers(self):
+        return self.workers
+
+    def get_launch_resync_jobs(self):
+        return self.resync_jobs
+
+    def get_launch_resync_seconds(self):
+        return self.resync_seconds
+
+
+class LaunchTasksTest(TestCase):
+
+    def setUp(self):
+        self.settings = launcher.DAX_SETTINGS
+        self.count_jobs = launcher.cluster.count_jobs
+        self.nb_counts = 0
+        self.tasks = list()
+        launcher.cluster.count_jobs = self._count_jobs
+
+    def tearDown(self):
+        launcher.DAX_SETTINGS = self.settings
+        launcher.cluster.count_jobs = self.count_jobs
+
+    def _count_jobs(self):
+        # launched jobs stay in the queue
+        self.nb_counts += 1
+        return len([t for t in self.tasks if t.launched])
+
+    def _launch(self, nb_tasks, queue_limit, workers, resync_jobs):
+        launcher.DAX_SETTINGS = _LaunchSettings(workers, resync_jobs)
+        lchr = launcher.Launcher.__new__(launcher.Launcher)
+        lchr.launcher_type = 'diskq-combined'
+        lchr.queue_limit = queue_limit
+        self.tasks = [_FakeTask('task%d' % i) for i in range(nb_tasks)]
+        lchr.launch_tasks(list(self.tasks))
+        return self.tasks
+
+    def test_count_after_each_job_by_default(self):
+        tasks = self._launch(5, 10, 1, 1)
+        self.assertTrue(all(t.launched for t in tasks))
+        self.assertEqual(self.nb_counts, 6)
+
+    def test_queue_count_tracked_locally(self):
+        tasks = self._launch(20, 8, 4, 10)
+        self.assertEqual(len([t for t in tasks if t.launched]), 8)
+        # first count and the one confirming the queue is full
+        self.assertEqual(self.nb_counts, 2)
+
+    def test_resync_every_n_jobs(self):
+        tasks = self._launch(12, 100, 4, 6)
+        self.assertTrue(all(t.launched for t in tasks))
+        # batches of 4, 2, 4, 2 jobs: count after 6 and 12 jobs
+        self.assertEqual(self.nb_counts, 3)
+
+
+class BuildStateTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.tmp_dir, 'BUILD_STATE',
+                                       'settings_proj1.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_save_and_load(self):
+        self.assertIsNone(launcher.load_build_state(self.state_file))
+        state = {'last_modified': '2018-01-01 10:00:00',
+                 'processors': ['proc1', 'proc2']}
+        launcher.save_build_state(self.state_file, state)
+        self.assertEqual(launcher.load_build_state(self.state_file), state)
+        self.assertEqual(os.listdir(os.path.dirname(self.state_file)),
+                         ['settings_proj1.json'])
+
+    def test_corrupted_state_ignored(self):
+        os.makedirs(os.path.dirname(self.state_file))
+        with open(self.state_file, 'w') as f:
+            f.write('{"last_modified": ')
+        self.assertIsNone(launcher.load_build_state(self.state_file))
+
+    def test_build_mark_ignores_dax_writes(self):
+        sessions = [
+            {'last_modified': '2018-01-01 10:00:00.0',
+             'last_updated': ''},
+            # last_updated set by dax after the build
+            {'last_modified': '2018-01-03 10:00:00.0',
+             'last_updated': 'updated--2018-01-03 10:01:00'},
+            # modified after dax set last_updated
+            {'last_modified': '2018-01-02 10:00:00.0',
+             'last_updated': 'updated--2018-01-01 10:01:00'},
+            # never built
+            {'last_modified': '2018-01-02 09:00:00.0',
+             'last_updated': None}]
+        self.assertTrue(launcher.is_modified_by_dax(sessions[1]))
+        self.assertFalse(launcher.is_modified_by_dax(sessions[2]))
+        self.assertEqual(launcher.get_build_mark(sessions),
+                         '2018-01-02 09:55:00')
+        self.assertEqual(launcher.get_build_mark(sessions, margin=0),
+                         '2018-01-02 10:00:00')
+        self.assertIsNone(launcher.get_build_mark(sessions[1:2]))
+
+    def test_sessions_list_given(self):
+        sessions = [{'label': 'sess1', 'last_updated': 'updated--2018'},
+                    {'label': 'sess2', 'last_updated': ''}]
+        sorted_list = launcher.Launcher.get_sessions_list(
+            None, 'proj1', None, sessions=sessions)
+        self.assertEqual([s['label'] for s in sorted_list],
+                         ['sess2', 'sess1'])
+
+
+class _FakeProcessor(object):
+
+    def __init__(self, name, xsitype='proc:genProcData'):
+        self.name = name
+        self.xsitype = xsitype
+
+
+class ProcessorIndexTest(TestCase):
+
+    def test_generate_task_from_index(self):
+        procs = [_FakeProcessor('proc1'), _FakeProcessor('proc2'),
+                 _FakeProcessor('proc2', 'fs:fsData')]
+        proc_index = dict(((p.xsitype, p.name), p) for p in procs)
+        lchr = launcher.Launcher.__new__(launcher.Launcher)
+        assr_info = {'ID': 'XNAT_E00001', 'label': 'p-x-s-x-e-x-proc2',
+                     'assessor_label': 'p-x-s-x-e-x-proc2',
+                     'xsiType': 'fs:fsData', 'proctype': 'proc2'}
+
+        cur_task = lchr.generate_task(None, assr_info, [], [], [], proc_index)
+        self.assertIs(cur_task.processor, procs[2])
+        self.assertIs(cur_task.processor,
+                      lchr.match_proc(assr_info, [], [], procs))
+        # the assessor is not selected on XNAT
+        self.assertIsNone(cur_task._assessor)
+
+        assr_info['proctype'] = 'proc3'
+        self.assertIsNone(
+            lchr.generate_task(None, assr_info, [], [], [], proc_index))
+
+
+class _FakeInterface(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class _ResultsSettings(object):
+
+    def __init__(self, results_dir):
+        self.results_dir = results_dir
+
+    def get_results_dir(self):
+        return self.results_dir
+
+
+class BuildProjectsTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmp_dir, 'FlagFiles'))
+        self.settings = launcher.DAX_SETTINGS
+        self.get_interface = launcher.XnatUtils.get_interface
+        launcher.DAX_SETTINGS = _ResultsSettings(self.tmp_dir)
+        launcher.XnatUtils.get_interface = self._get_interface
+        self.lock = threading.Lock()
+        self.started = list()
+        self.interfaces = list()
+        self.lchr = launcher.Launcher.__new__(launcher.Launcher)
+        self.lchr.xnat_host = 'http://xnat'
+        self.lchr.xnat_user = 'user'
+        self.lchr.xnat_pass = 'pwd'
+        self.lchr.build_project = self._build_project
+
+    def tearDown(self):
+        launcher.DAX_SETTINGS = self.settings
+        launcher.XnatUtils.get_interface = self.get_interface
+        shutil.rmtree(self.tmp_dir)
+
+    def _get_interface(self, *args, **kwargs):
+        intf = _FakeInterface()
+        with self.lock:
+            self.interfaces.append(intf)
+        return intf
+
+    def _build_project(self, intf, project_id, lockfile_prefix,
+                       sessions_local, mod_delta=None, lastrun=None,
+                       incremental=False):
+        with self.lock:
+            self.started.append(project_id)
+        # the project is locked while it is built
+        self.assertTrue(os.path.exists(launcher.project_flagfile(
+            lockfile_prefix, project_id, launcher.BUILD_SUFFIX)))
+        time.sleep(0.05)
+        if project_id == 'crash':
+            raise IOError('connection reset')
+
+    def test_priority_order_and_errors(self):
+        projects = ['prio1', 'prio2', 'crash', 'proj3', 'proj4']
+        built = self.lchr.build_projects_parallel(projects, 2, 'settings',
+                                                  None)
+        self.assertEqual(self.started[:2], ['prio1', 'prio2'])
+        self.assertEqual(sorted(built), ['prio1', 'prio2', 'proj3', 'proj4'])
+        # one interface per project
+        self.assertEqual(len(self.interfaces), 5)
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir, 'FlagFiles')),
+                         [])
+
+    def test_locked_project_skipped(self):
+        flagfile = launcher.project_flagfile('settings', 'proj1',
+                                             launcher.BUILD_SUFFIX)
+        open(flagfile, 'w').close()
+        built = self.lchr.build_projects_parallel(['proj1', 'proj2'], 2,
+                                                  'settings', None)
+        self.assertEqual(built, ['proj2'])
+        self.assertTrue(os.path.exists(flagfile))
+
+
+class _ReportModule(modules.SessionModule):
+
+    def __init__(self, directory):
+        super(_ReportModule, self).__init__('report', directory, None, '')
+
+
+class BuildSubjectsModulesTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.get_interface = launcher.XnatUtils.get_interface
+        launcher.XnatUtils.get_interface = lambda *args: _FakeInterface()
+        self.lchr = launcher.Launcher.__new__(launcher.Launcher)
+        self.lchr.xnat_host = 'http://xnat'
+        self.lchr.xnat_user = 'user'
+        self.lchr.xnat_pass = 'pwd'
+        self.lchr.build_subject = self._build_subject
+        self.mod = _ReportModule(self.tmp_dir)
+
+    def tearDown(self):
+        launcher.XnatUtils.get_interface = self.get_interface
+        shutil.rmtree(self.tmp_dir)
+
+    @staticmethod
+    def _build_subject(intf, sessions, *build_args):
+        mod = build_args[7][0]
+        # each subject downloads in its own folder
+        assert os.path.isdir(mod.directory)
+        assert mod.text_report == ''
+        mod.report(sessions[0])
+        time.sleep(0.02)
+        return True
+
+    def _build(self, pool_type):
+        sessions_by_subject = dict(('subj%d' % i, ['sess%d' % i])
+                                   for i in range(4))
+        build_args = (None, False, None, None, [], [], [], [self.mod], [])
+        self.assertTrue(self.lchr.build_subjects_parallel(
+            'proj1', sessions_by_subject, build_args, 2, pool_type))
+        self.assertEqual(self.mod.send_an_email, 1)
+        self.assertEqual(sorted(self.mod.text_report.splitlines()),
+                         ['  -sess%d' % i for i in range(4)])
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_module_reports_merged_threads(self):
+        self._build('thread')
+
+    def test_module_reports_merged_processes(self):
+        self._build('process')
+
+
+class _InterfaceTask(object):
+
+    def __init__(self):
+        self.xnat = None
+
+    def use_interface(self, xnat):
+        self.xnat = xnat
+
+
+class WorkerInterfaceTest(TestCase):
+
+    def setUp(self):
+        self.get_interface = launcher.XnatUtils.get_interface
+        self.opened = list()
+        launcher.XnatUtils.get_interface = self._get_interface
+        self.lchr = launcher.Launcher.__new__(launcher.Launcher)
+        self.lchr.xnat_host = 'http://xnat'
+        self.lchr.xnat_user = 'user'
+        self.lchr.xnat_pass = 'pwd'
+
+    def tearDown(self):
+        launcher.XnatUtils.get_interface = self.get_interface
+
+    def _get_interface(self, *args):
+        intf = _FakeInterface()
+        self.opened.append(intf)
+        return intf
+
+    def test_interfaces_opened_once_per_worker(self):
+        interfaces = launcher.Queue()
+        for _ in range(2):
+            interfaces.put(None)
+        tasks = [_InterfaceTask() for _ in range(3)]
+        with self.lchr.worker_interface(interfaces, tasks[0]):
+            with self.lchr.worker_interface(interfaces, tasks[1]):
+                self.assertIsNot(tasks[0].xnat, tasks[1].xnat)
+        with self.lchr.worker_interface(interfaces, tasks[2]):
+            pass
+        self.assertEqual(len(self.opened), 2)
+        self.assertIn(tasks[2].xnat, self.opened)
+
+
+class _AssessorsSnapshot(object):
+
+    def __init__(self, assessors):
+        self.assessors_ = assessors
+        self.calls = 0
+
+    def assessors(self):
+        self.calls += 1
+        return self.assessors_
+
+
+class AssessorsListTest(TestCase):
+
+    def test_snapshot_assessors_filtered(self):
+        snapshot = _AssessorsSnapshot([{'session_label': 'sess1'},
+                                       {'session_label': 'sess2'}])
+        assr_list = launcher.Launcher.get_assessors_list(
+            None, 'proj1', 'sess2', snapshot=snapshot)
+        self.assertEqual(assr_list, [{'session_label': 'sess2'}])
+        self.assertEqual(snapshot.calls, 1)
@@ -11,6 +11,7 @@ from dax.processors import AutoProcessor
 from dax.tests import unit_test_entity_common as common
 from dax.tests import unit_test_common_processor_yamls as yamls
 from dax import yaml_doc
+from dax import XnatUtils
 
 
 # test matrix
@@ -813,3 +814,73 @@ class ProcessorParserUnitTests(TestCase):
               "It must be one of 'all', 'some'")]
         self.assertEqual(errors, expected)
 
+
+
+class SharedArtefactsTest(TestCase):
+
+    SCAN_TYPES = ['T1', 'FLAIR', 'T2', 'DTI', 'Survey']
+
+    @staticmethod
+    def __processor_yaml(index):
+        return yamls.generate_yaml(
+            'proc%d' % index,
+            scans=[
+                {
+                    'name': 'scanx', 'types': 'T1,MPRAGE*,T1W',
+                    'select': 'foreach',
+                    'resources': [
+                        {'type': 'NIFTI', 'name': 't1'}
+                    ]
+                },
+                {
+                    'name': 'scany', 'types': 'FLAIR*,T2_FLAIR',
+                    'select': 'foreach(scanx)',
+                    'resources': [
+                        {'type': 'NIFTI', 'name': 'fl'}
+                    ]
+                },
+            ],
+            assessors=[]
+        )
+
+    def setUp(self):
+        self.extract_exp = XnatUtils.extract_exp
+        self.nb_compiled = 0
+        XnatUtils.extract_exp = self._extract_exp
+        self.parsers = [
+            ProcessorParser(yaml.load(StringIO.StringIO(
+                self.__processor_yaml(i))))
+            for i in range(3)]
+        scans = [('proj1', 'subj1', 'sess1', str(i),
+                  self.SCAN_TYPES[i % len(self.SCAN_TYPES)], 'usable',
+                  copy.deepcopy(scan_files))
+                 for i in range(20)]
+        self.csess = TestSession().OldInit('proj1', 'subj1', 'sess1', scans,
+                                           [])
+
+    def tearDown(self):
+        XnatUtils.extract_exp = self.extract_exp
+
+    def _extract_exp(self, expression, full_regex=False):
+        self.nb_compiled += 1
+        return self.extract_exp(expression, full_regex)
+
+    def _parse_all(self, shared):
+        artefacts = None
+        if shared:
+            artefacts = ProcessorParser.parse_artefacts([self.csess])
+        for parser in self.parsers:
+            parser.parse_session(self.csess, [self.csess], artefacts)
+        return [p.parameter_matrix for p in self.parsers]
+
+    def test_types_compiled_at_init(self):
+        # 5 expressions per processor, compiled once in __init__
+        self.assertEqual(self.nb_compiled, 5 * len(self.parsers))
+        self._parse_all(shared=True)
+        self.assertEqual(self.nb_compiled, 5 * len(self.parsers))
+
+    def test_shared_artefacts(self):
+        self.assertEqual(self._parse_all(shared=False),
+                         self._parse_all(shared=True))
+        self.assertEqual(len(self.parsers[0].parameter_matrix),
+                         20 // len(self.SCAN_TYPES))
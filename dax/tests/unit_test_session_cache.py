@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from dax.session_cache import SessionXmlCache
+
+
+XML = b'<xnat:MRSession xmlns:xnat="http://nrg.wustl.edu/xnat" label="s1"/>'
+
+
+class SessionXmlCacheTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = SessionXmlCache(
+            os.path.join(self.tmp_dir, 'CACHE', 'cache.sqlite'), 10 * 1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_validates_last_modified(self):
+        self.cache.put('proj', 'subj', 'sess', '2018-01-01 10:00:00',
+                       'xnat:mrSessionData', '2017-12-01', XML)
+        self.assertEqual(
+            self.cache.get('proj', 'subj', 'sess', '2018-01-01 10:00:00'),
+            ('xnat:mrSessionData', '2017-12-01', XML))
+        self.assertIsNone(
+            self.cache.get('proj', 'subj', 'sess', '2018-02-01 10:00:00'))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_invalidate(self):
+        self.cache.put('proj', 'subj', 'sess', 'lm', 'dt', 'ct', XML)
+        self.cache.invalidate('proj', 'subj', 'sess')
+        self.assertIsNone(self.cache.get('proj', 'subj', 'sess', 'lm'))
+
+    def test_lru_eviction(self):
+        # incompressible payloads of ~4KB each, 10KB cache
+        payloads = [os.urandom(4096) for _ in range(3)]
+        self.cache.put('proj', 'subj', 's0', 'lm', 'dt', 'ct', payloads[0])
+        self.cache.put('proj', 'subj', 's1', 'lm', 'dt', 'ct', payloads[1])
+        # s0 is now the most recently used
+        self.assertIsNotNone(self.cache.get('proj', 'subj', 's0', 'lm'))
+        self.cache.put('proj', 'subj', 's2', 'lm', 'dt', 'ct', payloads[2])
+
+        self.assertIsNone(self.cache.get('proj', 'subj', 's1', 'lm'))
+        self.assertIsNotNone(self.cache.get('proj', 'subj', 's0', 'lm'))
+        self.assertIsNotNone(self.cache.get('proj', 'subj', 's2', 'lm'))
+        self.assertLessEqual(self.cache.size(), 10 * 1024)
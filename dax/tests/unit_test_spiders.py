@@ -0,0 +1,132 @@
+import os
+import re
+import shutil
+import tempfile
+from unittest import TestCase
+
+import nibabel as nib
+import numpy as np
+
+from dax import spiders
+
+
+# voxel axes: A->P, S->I, L->R
+AFFINE = np.array([[0, 0, 2, -10],
+                   [-2, 0, 0, 20],
+                   [0, -3, 0, 30],
+                   [0, 0, 0, 1]], dtype=float)
+
+
+class _CountingProxy(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.shape = data.shape
+        self.ndim = data.ndim
+        self.is_proxy = True
+        self.read = 0
+
+    def __getitem__(self, slicer):
+        sliced = self.data[slicer]
+        self.read += sliced.size
+        return sliced
+
+    def __array__(self):
+        self.read += self.data.size
+        return self.data
+
+
+class CanonicalSliceTest(TestCase):
+
+    def setUp(self):
+        self.data = np.arange(4 * 5 * 6 * 3, dtype=np.float32)\
+            .reshape((4, 5, 6, 3))
+
+    def test_same_as_closest_canonical(self):
+        for data in [self.data[..., 1], self.data]:
+            nii_image = nib.Nifti1Image(data, AFFINE)
+            canonical = nib.as_closest_canonical(nii_image).get_data()
+            if canonical.ndim > 3:
+                canonical = canonical[..., 1]
+            self.assertEqual(spiders.canonical_shape(nii_image),
+                             canonical.shape[:3])
+            for axis in range(3):
+                for index in range(canonical.shape[axis]):
+                    np.testing.assert_array_equal(
+                        spiders.canonical_slice(nii_image, axis, index,
+                                                volume_ind=1),
+                        np.take(canonical, index, axis=axis))
+
+    def test_only_slice_read(self):
+        proxy = _CountingProxy(self.data)
+        nii_image = nib.Nifti1Image(proxy, AFFINE)
+        dslice = spiders.canonical_slice(nii_image, 2, 2)
+        self.assertEqual(proxy.read, dslice.size)
+
+
+class PlotImagesTest(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.image = os.path.join(self.tmpdir, 'image.nii.gz')
+        data = np.random.rand(8, 10, 6, 2).astype(np.float32)
+        nib.save(nib.Nifti1Image(data, AFFINE), self.image)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_plot_images(self):
+        pdf_path = os.path.join(self.tmpdir, 'page.pdf')
+        for slices in [None, {'0': [1, 2]}]:
+            spiders.plot_images(pdf_path, 1, [self.image], 'test',
+                                {'0': 'image'}, slices=slices, vmins={},
+                                vmaxs={}, time_writer=lambda msg: None)
+            self.assertTrue(os.path.getsize(pdf_path) > 0)
+            os.remove(pdf_path)
+        self.assertEqual(os.listdir(self.tmpdir), ['image.nii.gz'])
+
+
+class RenderReportTest(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.image = os.path.join(self.tmpdir, 'image.nii.gz')
+        data = np.random.rand(80, 100, 6).astype(np.float32)
+        nib.save(nib.Nifti1Image(data, AFFINE), self.image)
+        self.pages = [
+            ('images', {'nii_images': [self.image], 'title': 'test',
+                        'image_labels': {'0': 'image'}, 'vmins': {},
+                        'vmaxs': {}, 'max_image_size': 32}),
+            ('stats', {'stats_dict': dict(('stat%d' % i, i)
+                                          for i in range(6)),
+                       'title': 'test'})]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _nb_pages(self, pdf_path):
+        with open(pdf_path, 'rb') as fin:
+            return len(re.findall(br'/Type\s*/Page\b', fin.read()))
+
+    def test_render_report(self):
+        for nb_processes in [1, 2]:
+            pdf_path = os.path.join(self.tmpdir, 'report.pdf')
+            snapshot = os.path.join(self.tmpdir, 'snapshot_original.png')
+            spiders.render_report(self.pages, pdf_path,
+                                  nb_processes=nb_processes,
+                                  snapshot=snapshot,
+                                  time_writer=lambda msg: None)
+            self.assertEqual(self._nb_pages(pdf_path), 2)
+            self.assertTrue(os.path.getsize(snapshot) > 0)
+            os.remove(pdf_path)
+            os.remove(snapshot)
+
+    def test_unknown_page(self):
+        with self.assertRaises(spiders.SpiderError):
+            spiders.render_report([('table', {})], 'report.pdf')
+
+    def test_downsample_slice(self):
+        dslice = np.zeros((100, 40))
+        self.assertEqual(spiders.downsample_slice(dslice, 32).shape, (25, 10))
+        self.assertIs(spiders.downsample_slice(dslice), dslice)
+        self.assertIs(spiders.downsample_slice(dslice, 100), dslice)
@@ -0,0 +1,194 @@
+from unittest import TestCase
+
+from dax import task
+
+
+class _FakeAttrs(object):
+
+    def __init__(self, values):
+        self.values = values
+        self.puts = list()
+
+    def get(self, name):
+        return self.values.get(name, '')
+
+    def mget(self, names):
+        return [self.get(name) for name in names]
+
+    def set(self, name, value):
+        self.mset({name: value})
+
+    def mset(self, attrs):
+        self.puts.append(dict(attrs))
+        self.values.update(attrs)
+
+
+class _FakeAssessor(object):
+
+    def __init__(self, values, exists=True):
+        self.attrs = _FakeAttrs(values)
+        self.exists_ = exists
+
+    def exists(self):
+        return self.exists_
+
+    def create(self, **kwargs):
+        self.exists_ = True
+
+    def id(self):
+        return 'XNAT_E00001'
+
+    def label(self):
+        return 'proj1-x-subj1-x-sess1-x-proc1'
+
+    def out_resources(self):
+        return list()
+
+
+class _FakeProcessor(object):
+    name = 'proc1'
+    version = '1.0.0'
+    xsitype = 'proc:genProcData'
+
+
+ATYPE = 'proc:genprocdata'
+
+
+def _task(values, exists=True):
+    assessor = _FakeAssessor(values, exists)
+    cur_task = task.Task(_FakeProcessor(), assessor, '/tmp')
+    del assessor.attrs.puts[:]
+    return cur_task
+
+
+class TaskAttrsBufferTest(TestCase):
+
+    def setUp(self):
+        self.invalidate_session = task.invalidate_session
+        self.invalidated = list()
+        task.invalidate_session = \
+            lambda *labels: self.invalidated.append(labels)
+        self.tracejob_info = task.cluster.tracejob_info
+        self.is_traceable_date = task.cluster.is_traceable_date
+        task.cluster.tracejob_info = lambda jobid, jobdate: {
+            'mem_used': '2gb', 'walltime_used': '01:00:00',
+            'jobnode': 'node1'}
+        task.cluster.is_traceable_date = lambda jobdate: True
+
+    def tearDown(self):
+        task.invalidate_session = self.invalidate_session
+        task.cluster.tracejob_info = self.tracejob_info
+        task.cluster.is_traceable_date = self.is_traceable_date
+
+    def test_create_single_put(self):
+        assessor = _FakeAssessor(dict(), exists=False)
+        task.Task(_FakeProcessor(), assessor, '/tmp')
+        self.assertEqual(len(assessor.attrs.puts), 1)
+        self.assertEqual(
+            sorted(assessor.attrs.puts[0].keys()),
+            ['%s/%s' % (ATYPE, key) for key in
+             ['date', 'procstatus', 'proctype', 'procversion',
+              'validation/status']])
+
+    def test_completed_job_single_put(self):
+        cur_task = _task({'%s/procstatus' % ATYPE: task.READY_TO_COMPLETE,
+                          '%s/jobid' % ATYPE: '123',
+                          '%s/jobstartdate' % ATYPE: '2018-01-01'})
+        self.assertEqual(cur_task.update_status(), task.COMPLETE)
+
+        puts = cur_task.assessor.attrs.puts
+        self.assertEqual(len(puts), 1)
+        self.assertEqual(puts[0], {
+            '%s/memused' % ATYPE: '2gb',
+            '%s/walltimeused' % ATYPE: '01:00:00',
+            '%s/jobnode' % ATYPE: 'node1',
+            '%s/procstatus' % ATYPE: task.COMPLETE,
+            '%s/validation/status' % ATYPE: task.NEEDS_QA})
+        self.assertEqual(self.invalidated, [('proj1', 'subj1', 'sess1')])
+
+    def test_buffered_values_read_back(self):
+        cur_task = _task({'%s/procstatus' % ATYPE: task.JOB_RUNNING})
+        cur_task.hold_attrs()
+        cur_task.set_status(task.JOB_FAILED)
+        cur_task.set_jobid('456')
+        self.assertEqual(cur_task.get_statuses(),
+                         (task.JOB_FAILED, '', '456'))
+        self.assertEqual(cur_task.assessor.attrs.puts, [])
+        cur_task.release_attrs()
+        self.assertEqual(len(cur_task.assessor.attrs.puts), 1)
+
+    def test_unbuffered_setter_writes_now(self):
+        cur_task = _task(dict())
+        cur_task.set_jobid('789')
+        self.assertEqual(cur_task.assessor.attrs.puts,
+                         [{'%s/jobid' % ATYPE: '789'}])
+
+    def test_flush_tasks(self):
+        tasks = [_task({'%s/procstatus' % ATYPE: task.COMPLETE,
+                        '%s/validation/status' % ATYPE: task.RERUN})
+                 for _ in range(3)]
+        for cur_task in tasks:
+            self.assertEqual(cur_task.update_status(flush=False),
+                             task.NEED_TO_RUN)
+            self.assertEqual(cur_task.assessor.attrs.puts, [])
+
+        self.assertEqual(task.flush_tasks(tasks), 3)
+        for cur_task in tasks:
+            # undo_processing and the new status in one call
+            self.assertEqual(len(cur_task.assessor.attrs.puts), 1)
+            self.assertEqual(
+                cur_task.assessor.attrs.values['%s/procstatus' % ATYPE],
+                task.NEED_TO_RUN)
+        self.assertEqual(task.flush_tasks(tasks), 0)
+
+
+class _FakeXnat(object):
+
+    def __init__(self, values):
+        self.values = values
+        self.selected = list()
+
+    def select_assessor(self, project, subject, session, assessor):
+        self.selected.append(assessor)
+        return _FakeAssessor(self.values)
+
+
+def _assr_info(procstatus, qcstatus):
+    return {'ID': 'XNAT_E00001', 'label': 'proj1-x-subj1-x-sess1-x-proc1',
+            'project_id': 'proj1', 'subject_id': 'XNAT_S00001',
+            'session_id': 'XNAT_E00002', 'xsiType': 'proc:genProcData',
+            'proctype': 'proc1', 'procstatus': procstatus,
+            'qcstatus': qcstatus, 'jobid': '123', 'jobstartdate': None}
+
+
+class LazyTaskTest(TestCase):
+
+    def setUp(self):
+        self.invalidate_session = task.invalidate_session
+        task.invalidate_session = lambda *labels: None
+
+    def tearDown(self):
+        task.invalidate_session = self.invalidate_session
+
+    def test_statuses_read_from_row(self):
+        xnat = _FakeXnat(dict())
+        cur_task = task.LazyTask(_FakeProcessor(),
+                                 _assr_info(task.NEED_TO_RUN, task.NEEDS_QA),
+                                 '/tmp', xnat)
+        self.assertEqual(cur_task.update_status(), task.NEED_TO_RUN)
+        self.assertTrue(cur_task.is_open())
+        self.assertEqual(cur_task.get_jobid(), '123')
+        self.assertEqual(xnat.selected, [])
+
+    def test_assessor_selected_to_write(self):
+        xnat = _FakeXnat({'%s/jobstartdate' % ATYPE: '2018-01-01'})
+        cur_task = task.LazyTask(_FakeProcessor(),
+                                 _assr_info(task.COMPLETE, task.RERUN),
+                                 '/tmp', xnat)
+        self.assertEqual(cur_task.update_status(), task.NEED_TO_RUN)
+        self.assertEqual(xnat.selected, ['XNAT_E00001'])
+        self.assertEqual(len(cur_task.assessor.attrs.puts), 1)
+        # not in the row
+        self.assertEqual(cur_task.get_jobstartdate(), '2018-01-01')
+        self.assertEqual(cur_task.get_status(), task.NEED_TO_RUN)
+        self.assertEqual(xnat.selected, ['XNAT_E00001'])
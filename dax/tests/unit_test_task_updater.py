@@ -0,0 +1,128 @@
+import contextlib
+import threading
+import time
+from unittest import TestCase
+
+from dax.task_updater import TaskUpdater
+
+
+class _FakeTask(object):
+
+    def __init__(self, label, old_status, new_status, seconds=0,
+                 error=None):
+        self.assessor_label = label
+        self.old_status = old_status
+        self.new_status = new_status
+        self.seconds = seconds
+        self.error = error
+        self.kwargs = None
+
+    def get_status(self):
+        return self.old_status
+
+    def update_status(self, **kwargs):
+        self.kwargs = kwargs
+        time.sleep(self.seconds)
+        if self.error:
+            raise self.error
+        return self.new_status
+
+
+class TaskUpdaterTest(TestCase):
+
+    def test_serial_update(self):
+        tasks = [_FakeTask('task1', 'JOB_RUNNING', 'COMPLETE'),
+                 _FakeTask('task2', 'JOB_RUNNING', 'JOB_RUNNING'),
+                 _FakeTask('task3', 'JOB_RUNNING', None, error=OSError())]
+        updater = TaskUpdater(update_kwargs={'flush': False})
+        self.assertEqual(updater.update(tasks), tasks[:2])
+        self.assertEqual(updater.failed, [tasks[2]])
+        self.assertEqual(tasks[0].kwargs, {'flush': False})
+        self.assertEqual(dict(updater.transitions), {
+            ('JOB_RUNNING', 'COMPLETE'): 1,
+            ('JOB_RUNNING', 'JOB_RUNNING'): 1,
+            ('JOB_RUNNING', 'ERROR'): 1})
+
+    def test_hung_task_timed_out(self):
+        hung = _FakeTask('hung', 'JOB_RUNNING', 'COMPLETE', seconds=1.5)
+        tasks = [hung] + [_FakeTask('task%d' % i, 'READY_TO_COMPLETE',
+                                    'COMPLETE', seconds=0.05)
+                          for i in range(8)]
+        updater = TaskUpdater(nb_workers=2, timeout=0.5)
+
+        start = time.time()
+        updated = updater.update(tasks)
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(updater.timed_out, [hung])
+        self.assertEqual(sorted(t.assessor_label for t in updated),
+                         ['task%d' % i for i in range(8)])
+        self.assertEqual(
+            updater.transitions[('READY_TO_COMPLETE', 'COMPLETE')], 8)
+
+    def test_timed_out_task_holds_worker(self):
+        hung = _FakeTask('hung', 'JOB_RUNNING', 'COMPLETE', seconds=0.6)
+        task = _FakeTask('task', 'JOB_RUNNING', 'COMPLETE')
+        updater = TaskUpdater(nb_workers=1, timeout=0.2)
+        start = time.time()
+        # The hung task holds the only worker: the other one is skipped
+        self.assertEqual(updater.update([hung, task]), [])
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(updater.timed_out, [hung])
+        self.assertEqual(updater.skipped, [task])
+        self.assertIsNone(task.kwargs)
+        self.assertEqual(updater.wait_abandoned(1), 0)
+
+    def test_timed_out_task_flushes_itself(self):
+        flushed = list()
+
+        class _BufferedTask(_FakeTask):
+            def flush_attrs(self):
+                flushed.append(self.assessor_label)
+                return 1
+
+        hung = _BufferedTask('hung', 'JOB_RUNNING', 'COMPLETE', seconds=0.4)
+        task = _BufferedTask('task', 'JOB_RUNNING', 'COMPLETE')
+        contexts = list()
+
+        @contextlib.contextmanager
+        def worker_context(cur_task):
+            contexts.append(cur_task.assessor_label)
+            yield
+
+        updater = TaskUpdater(nb_workers=2, timeout=0.1,
+                              update_kwargs={'flush': False},
+                              worker_context=worker_context)
+        self.assertEqual(updater.update([hung, task]), [task])
+        self.assertEqual(updater.wait_abandoned(1), 0)
+        # only the task updated after the timeout is written by its thread
+        self.assertEqual(flushed, ['hung'])
+        self.assertEqual(sorted(contexts), ['hung', 'task'])
+
+    def test_concurrent_update(self):
+        active = [0, 0]
+        lock = threading.Lock()
+
+        class _CountingTask(_FakeTask):
+            def update_status(self, **kwargs):
+                with lock:
+                    active[0] += 1
+                    active[1] = max(active)
+                time.sleep(0.05)
+                with lock:
+                    active[0] -= 1
+                return self.new_status
+
+        tasks = [_CountingTask('task%d' % i, 'JOB_RUNNING', 'COMPLETE')
+                 for i in range(12)]
+        updater = TaskUpdater(nb_workers=4)
+        self.assertEqual(len(updater.update(tasks)), 12)
+        self.assertEqual(active[1], 4)
+
+    def test_phase_times(self):
+        updater = TaskUpdater()
+        updater.start_phase('task list')
+        updater.start_phase('update')
+        updater.start_phase('task list')
+        updater.log_summary()
+        self.assertEqual(list(updater.phase_times.keys()),
+                         ['task list', 'update'])
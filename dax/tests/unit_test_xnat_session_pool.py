@@ -0,0 +1,123 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import threading
+from unittest import TestCase
+
+from dax.xnat_session_pool import XnatSessionPool
+
+
+class _XnatHandler(BaseHTTPRequestHandler):
+    # keep-alive connections
+    protocol_version = 'HTTP/1.1'
+    jsession = 'JS1'
+    logins = 0
+    # password refused
+    reject_all = False
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code, body='', cookie=None):
+        self.send_response(code)
+        if cookie:
+            self.send_header('Set-Cookie', 'JSESSIONID=%s; Path=/' % cookie)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if _XnatHandler.reject_all:
+            if self.path == '/data/JSESSION':
+                _XnatHandler.logins += 1
+            self._reply(401)
+        elif self.path == '/data/JSESSION':
+            _XnatHandler.logins += 1
+            self._reply(200, _XnatHandler.jsession, _XnatHandler.jsession)
+        elif 'JSESSIONID=%s' % _XnatHandler.jsession in \
+                self.headers.get('Cookie', ''):
+            self._reply(200, 'ok')
+        else:
+            self._reply(401)
+
+
+class _XnatServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class XnatSessionPoolTest(TestCase):
+
+    def setUp(self):
+        _XnatHandler.jsession = 'JS1'
+        _XnatHandler.logins = 0
+        _XnatHandler.reject_all = False
+        self.server = _XnatServer(('127.0.0.1', 0), _XnatHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.host = 'http://127.0.0.1:%d' % self.server.server_port
+        self.pool = XnatSessionPool(2)
+
+    def tearDown(self):
+        for session in self.pool.sessions.values():
+            session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _login(self, session):
+        session.dax_jsession = session.get(self.host + '/data/JSESSION').content
+
+    def test_session_and_connection_reused(self):
+        session, reused = self.pool.get_session(self.host, 'user', 'pwd')
+        self.assertFalse(reused)
+        self._login(session)
+        for _ in range(3):
+            same, reused = self.pool.get_session(self.host, 'user', 'pwd')
+            self.assertIs(same, session)
+            self.assertTrue(reused)
+            self.assertEqual(same.get(self.host + '/data/projects').content,
+                             'ok')
+
+        stats = self.pool.stats()
+        self.assertEqual(_XnatHandler.logins, 1)
+        self.assertEqual(stats['sessions_opened'], 1)
+        self.assertEqual(stats['sessions_reused'], 3)
+        self.assertEqual(stats['connections_opened'], 1)
+        self.assertEqual(stats['connections_reused'], 3)
+
+    def test_other_user_gets_new_session(self):
+        session, _ = self.pool.get_session(self.host, 'user', 'pwd')
+        other, reused = self.pool.get_session(self.host, 'user2', 'pwd')
+        self.assertFalse(reused)
+        self.assertIsNot(other, session)
+
+    def test_reauthenticate_on_401(self):
+        session, _ = self.pool.get_session(self.host, 'user', 'pwd')
+        self._login(session)
+        # JSESSION expired on XNAT
+        _XnatHandler.jsession = 'JS2'
+        response = session.get(self.host + '/data/projects')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(session.dax_jsession, 'JS2')
+        self.assertEqual(_XnatHandler.logins, 2)
+        self.assertEqual(self.pool.stats()['reauthentications'], 1)
+
+    def test_wrong_password_not_retried(self):
+        session, _ = self.pool.get_session(self.host, 'user', 'bad')
+        self._login(session)
+        _XnatHandler.reject_all = True
+        login = session.get(self.host + '/data/JSESSION')
+        self.assertEqual(login.status_code, 401)
+        self.assertEqual(_XnatHandler.logins, 2)
+
+        responses = list()
+        threads = [threading.Thread(target=lambda: responses.append(
+            session.get(self.host + '/data/projects')))
+            for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual([response.status_code for response in responses],
+                         [401] * 4)
+        # one login per request at most, no recursion
+        self.assertLessEqual(_XnatHandler.logins, 6)
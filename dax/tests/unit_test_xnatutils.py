@@ -1,6 +1,18 @@
 from unittest import TestCase
 
+import fnmatch
+import glob
+import gzip
+import hashlib
 import json
+import os
+import shutil
+import tempfile
+
+import nibabel as nib
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileDataset
 
 from dax import XnatUtils
 from dax import assessor_utils
@@ -55,3 +67,533 @@ class XnatUtilsUnitTest(TestCase):
             name = assessor_utils.full_label(*test_entries[t])
             self.assertEqual(test_names[t], name)
 
+
+
+class TestExperiment:
+    class TestAttrs:
+
+        def __init__(self, experiment):
+            self.experiment = experiment
+
+        def get(self, name):
+            if name.endswith('/meta/last_modified'):
+                return self.experiment.last_modified
+            return '2017-01-01 00:00:00'
+
+    def __init__(self, last_modified):
+        self.last_modified = last_modified
+        self.attrs = TestExperiment.TestAttrs(self)
+        self.gets = 0
+
+    def datatype(self):
+        return 'xnat:mrSessionData'
+
+    def get(self):
+        self.gets += 1
+        return '<xnat:MRSession xmlns:xnat="http://nrg.wustl.edu/xnat"' \
+               ' label="sess1"/>'
+
+
+class TestInterface:
+
+    def __init__(self, experiment):
+        self.experiment = experiment
+
+    def select_experiment(self, proj, subj, sess):
+        return self.experiment
+
+
+class CachedImageSessionReloadTest(TestCase):
+
+    def setUp(self):
+        self.experiment = TestExperiment('2018-01-01 10:00:00.0')
+        self.csess = XnatUtils.CachedImageSession(
+            TestInterface(self.experiment), 'proj1', 'subj1', 'sess1',
+            last_modified='2018-01-01 10:00:00')
+        # read the XML
+        self.csess.label()
+
+    def test_reload_avoided_when_not_modified(self):
+        self.assertFalse(self.csess.reload_if_modified())
+        self.assertFalse(self.csess.reload_if_modified())
+        self.assertEqual(self.experiment.gets, 1)
+        self.assertEqual(self.csess.reloads_avoided, 2)
+
+    def test_reload_when_last_modified_changed(self):
+        self.experiment.last_modified = '2018-01-02 10:00:00.0'
+        self.assertTrue(self.csess.reload_if_modified())
+        self.assertFalse(self.csess.reload_if_modified())
+        self.assertEqual(self.experiment.gets, 2)
+        self.assertEqual(self.csess.reloads, 1)
+
+    def test_reload_when_marked_dirty(self):
+        self.csess.mark_dirty()
+        self.assertTrue(self.csess.reload_if_modified())
+        self.assertEqual(self.experiment.gets, 2)
+        self.assertEqual(self.csess.reloads_avoided, 0)
+
+
+class CachedImageSessionLazyTest(TestCase):
+
+    def setUp(self):
+        self.experiment = TestExperiment('2018-01-01 10:00:00.0')
+        self.csess = XnatUtils.CachedImageSession(
+            TestInterface(self.experiment), 'proj1', 'subj1', 'sess1',
+            datatype='xnat:mrSessionData',
+            creation_timestamp='2018-01-01 09:00:00.0')
+
+    def test_xml_read_when_used(self):
+        self.assertFalse(self.csess.is_loaded())
+        self.assertEqual(self.csess.creation_timestamp(),
+                         '2018-01-01 09:00:00.0')
+        self.assertEqual(self.csess.datatype(), 'xnat:mrSessionData')
+        self.assertFalse(self.csess.reload_if_modified())
+        self.assertEqual(self.experiment.gets, 0)
+
+        self.assertEqual(self.csess.label(), 'sess1')
+        self.assertEqual(self.csess.scans(), [])
+        self.assertEqual(self.experiment.gets, 1)
+        # the timestamp from the session list is kept
+        self.assertEqual(self.csess.creation_timestamp(),
+                         '2018-01-01 09:00:00.0')
+
+    def test_creation_timestamp_read_from_xnat(self):
+        csess = XnatUtils.CachedImageSession(
+            TestInterface(self.experiment), 'proj1', 'subj1', 'sess1')
+        self.assertEqual(csess.creation_timestamp(), '2017-01-01 00:00:00')
+        self.assertEqual(self.experiment.gets, 1)
+
+
+class SnapshotInterface:
+
+    def __init__(self):
+        self.calls = list()
+
+    def get_subjects(self, project_id):
+        self.calls.append('subjects')
+        return [{'ID': 'XNAT_S1', 'label': 'subj1'}]
+
+    def get_sessions(self, projectid, subject_list=None):
+        self.calls.append('sessions')
+        assert subject_list is not None
+        return [{'ID': 'XNAT_E1', 'label': 'sess1', 'subject_id': 'XNAT_S1'},
+                {'ID': 'XNAT_E2', 'label': 'sess2', 'subject_id': 'XNAT_S1'}]
+
+    def get_project_scans(self, project_id, include_shared=True,
+                          session_list=None):
+        self.calls.append('scans')
+        assert session_list is not None
+        return [{'ID': '1', 'session_id': 'XNAT_E1'},
+                {'ID': '2', 'session_id': 'XNAT_E1'},
+                {'ID': '1', 'session_id': 'XNAT_E2'}]
+
+
+class ProjectSnapshotTest(TestCase):
+
+    def test_queries_once_and_indexes(self):
+        intf = SnapshotInterface()
+        snapshot = XnatUtils.ProjectSnapshot(intf, 'proj1')
+
+        self.assertEqual(snapshot.get_subject('subj1')['ID'], 'XNAT_S1')
+        self.assertEqual(snapshot.get_session('XNAT_E2')['label'], 'sess2')
+        self.assertEqual(snapshot.get_session('sess1')['ID'], 'XNAT_E1')
+        self.assertEqual(len(snapshot.get_subject_sessions('subj1')), 2)
+        self.assertEqual(len(snapshot.get_session_scans('sess1')), 2)
+        self.assertEqual(snapshot.get_scan('XNAT_E2', '1')['session_id'],
+                         'XNAT_E2')
+        self.assertIsNone(snapshot.get_scan('sess2', '2'))
+        self.assertIsNone(snapshot.get_session('sess3'))
+        self.assertEqual(intf.calls, ['subjects', 'sessions', 'scans'])
+
+
+class ModifiedSessionsTest(TestCase):
+
+    def test_dates_listed_once(self):
+        intf = XnatUtils.InterfaceTemp.__new__(XnatUtils.InterfaceTemp)
+        calls = list()
+        sessions_dates = [
+            {'ID': 'E1', 'subject_ID': 'S1',
+             'last_modified': '2018-01-02 10:00:00.0'},
+            {'ID': 'E2', 'subject_ID': 'S1',
+             'last_modified': '2017-01-01 10:00:00.0'},
+            {'ID': 'E3', 'subject_ID': 'S2',
+             'last_modified': '2018-01-03 10:00:00.0'},
+            {'ID': 'E4', 'subject_ID': 'S3',
+             'last_modified': '2017-01-01 10:00:00.0'}]
+
+        def get_sessions_last_modified(projectid):
+            calls.append('dates')
+            return sessions_dates
+
+        def get_subjects(projectid):
+            calls.append('subjects')
+            return []
+
+        def get_sessions(projectid, subjectid=None, subject_list=None):
+            calls.append(subjectid)
+            return [s for s in sessions_dates if s['subject_ID'] == subjectid]
+
+        intf.get_sessions_last_modified = get_sessions_last_modified
+        intf.get_subjects = get_subjects
+        intf.get_sessions = get_sessions
+        sessions = intf.get_modified_sessions('proj1', '2018-01-01 00:00:00')
+        self.assertEqual([s['ID'] for s in sessions], ['E1', 'E2', 'E3'])
+        self.assertEqual(calls, ['dates', 'subjects', 'S1', 'S2'])
+
+        calls = list()
+        sessions = intf.get_modified_sessions(
+            'proj1', '2018-01-01 00:00:00',
+            is_modified=lambda x: x['ID'] != 'E3',
+            sessions_dates=sessions_dates)
+        self.assertEqual([s['ID'] for s in sessions], ['E1', 'E2'])
+        self.assertEqual(calls, ['subjects', 'S1'])
+
+
+class DownloadResponse:
+
+    def __init__(self, status_code, data, fail_after=None):
+        self.status_code = status_code
+        self.data = data
+        self.fail_after = fail_after
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.data), 4):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise IOError('connection reset')
+            yield self.data[i:i + 4]
+
+
+class DownloadHttp:
+
+    def __init__(self, data, fail_after=None):
+        self.data = data
+        self.fail_after = fail_after
+        self.ranges = list()
+
+    def get(self, url, headers=None, stream=False):
+        assert url == 'http://xnat/data/projects/p/resources/r/files/f.txt'
+        byte_range = headers.get('Range')
+        self.ranges.append(byte_range)
+        fail_after, self.fail_after = self.fail_after, None
+        if byte_range:
+            offset = int(byte_range[len('bytes='):-1])
+            return DownloadResponse(206, self.data[offset:], fail_after)
+        return DownloadResponse(200, self.data, fail_after)
+
+
+class DownloadInterface:
+
+    def __init__(self, http):
+        self._server = 'http://xnat'
+        self._http = http
+
+
+class DownloadFileResumableTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fpath = os.path.join(self.tmp_dir, 'f.txt')
+        self.data = b'0123456789abcdefghij'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _download(self, http, **kwargs):
+        return XnatUtils.download_file_resumable(
+            DownloadInterface(http), '/projects/p/resources/r/files/f.txt',
+            self.fpath, **kwargs)
+
+    def test_download_resumed_after_failure(self):
+        http = DownloadHttp(self.data, fail_after=8)
+        self._download(http, size=len(self.data),
+                       digest=hashlib.md5(self.data).hexdigest())
+        self.assertEqual(http.ranges, [None, 'bytes=8-'])
+        with open(self.fpath, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(os.path.exists(self.fpath + '.part'))
+
+    def test_corrupted_download_fails(self):
+        http = DownloadHttp(self.data)
+        with self.assertRaises(XnatUtils.XnatAccessError):
+            self._download(http, digest='0' * 32, retries=1)
+        self.assertEqual(http.ranges, [None, None])
+        self.assertFalse(os.path.exists(self.fpath))
+
+    def test_complete_file_not_downloaded(self):
+        with open(self.fpath, 'wb') as f:
+            f.write(self.data)
+        http = DownloadHttp(self.data)
+        self.assertEqual(self._download(http, size=len(self.data)), 0)
+        self.assertEqual(http.ranges, [])
+
+
+class StreamZipTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmp_dir, 'stats'))
+        self.files = {'report.pdf': b'%PDF' * 1000,
+                      'stats/aseg.stats': os.urandom(3000),
+                      'stats/empty.txt': b''}
+        for name, data in self.files.items():
+            with open(os.path.join(self.tmp_dir, name), 'wb') as f:
+                f.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_stream_zip_readable(self):
+        fpaths = [os.path.join(self.tmp_dir, name)
+                  for name in sorted(self.files)]
+        zip_path = os.path.join(self.tmp_dir, 'out.zip')
+        with open(zip_path, 'wb') as f:
+            for chunk in XnatUtils.stream_zip(self.tmp_dir, fpaths,
+                                              chunk_size=512):
+                f.write(chunk)
+
+        with XnatUtils.zipfile.ZipFile(zip_path) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(sorted(zf.namelist()), sorted(self.files))
+            for name, data in self.files.items():
+                self.assertEqual(zf.read(name), data)
+
+    def test_too_many_files(self):
+        fpaths = [os.path.join(self.tmp_dir, 'report.pdf')] * \
+            XnatUtils.zipfile.ZIP_FILECOUNT_LIMIT
+        with self.assertRaises(XnatUtils.XnatUtilsError):
+            next(XnatUtils.stream_zip(self.tmp_dir, fpaths))
+
+
+class ExtractExpTest(TestCase):
+
+    def test_fnmatch_and_full_regex(self):
+        self.assertTrue(XnatUtils.extract_exp('T1*').match('T1_MPRAGE'))
+        self.assertFalse(XnatUtils.extract_exp('T1*').match('fT1'))
+        regex = XnatUtils.extract_exp('T[12]_.*', full_regex=True)
+        self.assertTrue(regex.match('T2_FLAIR'))
+        self.assertFalse(regex.match('T1*'))
+
+    def test_cache_reused_and_bounded(self):
+        size = XnatUtils.PATTERN_CACHE_SIZE
+        XnatUtils.PATTERN_CACHE_SIZE = 3
+        try:
+            regex = XnatUtils.extract_exp('DTI*')
+            self.assertIs(XnatUtils.extract_exp('DTI*'), regex)
+            self.assertIsNot(XnatUtils.extract_exp('DTI*', True), regex)
+            for exp in ['a*', 'b*', 'c*']:
+                XnatUtils.extract_exp(exp)
+            self.assertEqual(len(XnatUtils._PATTERN_CACHE), 3)
+            self.assertNotIn(('DTI*', False), XnatUtils._PATTERN_CACHE)
+        finally:
+            XnatUtils.PATTERN_CACHE_SIZE = size
+
+    def test_match_many(self):
+        self.assertEqual(
+            XnatUtils.match_many(['T1', 'FLAIR', 'T1', 'T2'], ['T1', 'FL*']),
+            [True, True, True, False])
+        # same result as fnmatch on each pattern
+        scan_types = ['T1', 'MPRAGE', 'FLAIR', 'T2', 'DTI_64dir',
+                      'T1W_SENSE', 'T2_FLAIR']
+        patterns = ['T1', 'MPRAGE*', 'T1W*', 'FLAIR*', 'T2_FLAIR']
+        self.assertEqual(
+            XnatUtils.match_many(scan_types, patterns),
+            [any(fnmatch.fnmatch(t, p) for p in patterns)
+             for t in scan_types])
+        dicts = [{'type': 'T1'}, {'type': 'T2'}, {'type': 'DTI'}]
+        self.assertEqual(
+            XnatUtils.filter_list_dicts_regex(dicts, 'type', ['T*']),
+            dicts[:2])
+        self.assertEqual(
+            XnatUtils.filter_list_dicts_regex(dicts, 'type', ['T*'],
+                                              nor=True),
+            dicts[2:])
+
+
+class GzipFileTest(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.block_size = XnatUtils.GZIP_BLOCK_SIZE
+        XnatUtils.GZIP_BLOCK_SIZE = 1000
+        self.data = b''.join(b'%d-' % i for i in range(5000))
+
+    def tearDown(self):
+        XnatUtils.GZIP_BLOCK_SIZE = self.block_size
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, name, data):
+        fpath = os.path.join(self.tmpdir, name)
+        with open(fpath, 'wb') as fout:
+            fout.write(data)
+        return fpath
+
+    def _check_roundtrip(self, data, nb_threads):
+        fpath = self._write('image.nii', data)
+        self.assertEqual(XnatUtils.gzip_file(fpath, nb_threads=nb_threads),
+                         [fpath + '.gz'])
+        self.assertFalse(os.path.exists(fpath))
+        with gzip.open(fpath + '.gz', 'rb') as fin:
+            self.assertEqual(fin.read(), data)
+        XnatUtils.gunzip_file(fpath + '.gz')
+        with open(fpath, 'rb') as fin:
+            self.assertEqual(fin.read(), data)
+
+    def test_roundtrip(self):
+        self._check_roundtrip(self.data, 1)
+
+    def test_roundtrip_threads(self):
+        self._check_roundtrip(self.data, 3)
+        self._check_roundtrip(self.data[:3000], 3)
+        self._check_roundtrip(b'', 3)
+
+    def test_gzip_nii(self):
+        self._write('a.nii', self.data)
+        self._write('b.nii', self.data[:10])
+        XnatUtils.gzip_nii(self.tmpdir, nb_threads=2)
+        self.assertEqual(
+            sorted(os.listdir(self.tmpdir)), ['a.nii.gz', 'b.nii.gz'])
+        XnatUtils.ungzip_nii(self.tmpdir)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['a.nii', 'b.nii'])
+        with open(glob.glob(os.path.join(self.tmpdir, 'a.nii'))[0],
+                  'rb') as fin:
+            self.assertEqual(fin.read(), self.data)
+
+
+def _dicom_dataset(slice_location):
+    dst = Dataset()
+    dst.SOPClassUID = '1.2.840.10008.5.1.4.1.1.4'
+    dst.SOPInstanceUID = '1.2.3.%d' % slice_location
+    dst.Modality = 'MR'
+    dst.SliceLocation = str(slice_location)
+    dst.is_little_endian = True
+    dst.is_implicit_VR = True
+    return dst
+
+
+def _save_dicom(fpath, dst):
+    file_meta = Dataset()
+    file_meta.MediaStorageSOPClassUID = dst.SOPClassUID
+    file_meta.MediaStorageSOPInstanceUID = dst.SOPInstanceUID
+    file_meta.TransferSyntaxUID = '1.2.840.10008.1.2'
+    FileDataset(fpath, dst, file_meta=file_meta,
+                preamble=b'\0' * 128).save_as(fpath)
+
+
+class DicomFolderTest(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmpdir, 'series'))
+        for slice_location in [3, 1, 2]:
+            _save_dicom(os.path.join(self.tmpdir, '%d.dcm' % slice_location),
+                        _dicom_dataset(slice_location))
+        # without preamble
+        self.raw = os.path.join(self.tmpdir, 'series', 'raw')
+        pydicom.dcmwrite(self.raw, _dicom_dataset(4),
+                         write_like_original=True)
+        self.text = os.path.join(self.tmpdir, 'series', 'notes.txt')
+        with open(self.text, 'w') as fout:
+            fout.write('DICM not a dicom\n' * 20)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_is_dicom(self):
+        with open(self.raw, 'rb') as fin:
+            self.assertNotEqual(fin.read(132)[128:], b'DICM')
+        self.assertTrue(XnatUtils.is_dicom(
+            os.path.join(self.tmpdir, '1.dcm')))
+        self.assertTrue(XnatUtils.is_dicom(self.raw))
+        self.assertFalse(XnatUtils.is_dicom(self.text))
+
+    def test_find_dicom_in_folder(self):
+        expected = sorted([os.path.join(self.tmpdir, '%d.dcm' % i)
+                           for i in [1, 2, 3]] + [self.raw])
+        for nb_threads in [1, 3]:
+            self.assertEqual(sorted(XnatUtils.find_dicom_in_folder(
+                self.tmpdir, nb_threads=nb_threads)), expected)
+        self.assertEqual(len(XnatUtils.find_dicom_in_folder(
+            self.tmpdir, recursively=False)), 3)
+
+    def test_order_dicoms(self):
+        self.assertEqual(
+            list(XnatUtils.order_dicoms(self.tmpdir).items()),
+            [(float(i), os.path.join(self.tmpdir, '%d.dcm' % i))
+             for i in [1, 2, 3]])
+
+
+class ConvertNiftiTest(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = np.arange(-20, 4 * 3 * 12 - 20, dtype=np.float32)\
+            .reshape((4, 3, 12)) * 1.5
+        self.nifti = os.path.join(self.tmpdir, 'adc.nii')
+        nib.save(nib.Nifti1Image(self.data, np.eye(4)), self.nifti)
+        self.targets = list()
+        for slice_i in range(12):
+            dst = _dicom_dataset(slice_i)
+            dst.InstanceNumber = slice_i + 1
+            dst.PatientPosition = 'HFS'
+            dst.SliceThickness = '2'
+            dst.SpacingBetweenSlices = '2'
+            dst.InPlanePhaseEncodingDirection = 'ROW'
+            dst.ImagePositionPatient = ['0', '0', str(2 * slice_i)]
+            dst.ImageOrientationPatient = ['1', '0', '0', '0', '1', '0']
+            dst.Rows = 3
+            dst.Columns = 4
+            dst.PixelSpacing = ['1', '1']
+            fpath = os.path.join(self.tmpdir, 't2_%d.dcm' % slice_i)
+            _save_dicom(fpath, dst)
+            self.targets.append(fpath)
+        source = _dicom_dataset(1)
+        source.SOPInstanceUID = '1.2.3.4.5'
+        source.SeriesDescription = 'ADC'
+        source.ProtocolName = 'DWI'
+        source.PatientPosition = 'FFS'
+        source.PixelData = b'\0' * 8
+        self.source = os.path.join(self.tmpdir, 'source.dcm')
+        _save_dicom(self.source, source)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_nifti_to_dicom_stack(self):
+        stack = XnatUtils.nifti_to_dicom_stack(self.data)
+        self.assertEqual(stack.dtype, np.uint16)
+        self.assertTrue(stack.flags['C_CONTIGUOUS'])
+        for slice_i in range(12):
+            expected = np.rot90(self.data[:, :, slice_i].copy())
+            expected[expected < 0] = 0
+            np.testing.assert_array_equal(stack[slice_i],
+                                          expected.astype(np.uint16))
+
+    def test_convert(self):
+        output = os.path.join(self.tmpdir, 'output')
+        for nb_threads in [1, 4]:
+            XnatUtils.convert_nifti_2_dicoms(
+                self.nifti, self.targets, self.source, output, label='adc',
+                nb_threads=nb_threads)
+            fnames = sorted(os.listdir(output))
+            self.assertEqual(fnames[:2], ['adc_01.dcm', 'adc_02.dcm'])
+            self.assertEqual(len(fnames), 12)
+            uids = set()
+            stack = XnatUtils.nifti_to_dicom_stack(self.data)
+            for slice_i in range(12):
+                dst = pydicom.read_file(
+                    os.path.join(output, 'adc_%02d.dcm' % (slice_i + 1)),
+                    force=True)
+                self.assertEqual(dst.InstanceNumber, slice_i + 1)
+                self.assertEqual(dst.SeriesDescription, 'ADC fromNifti')
+                self.assertEqual(dst.PatientPosition, 'HFS')
+                self.assertEqual(dst.ImagePositionPatient[2], 2 * slice_i)
+                self.assertEqual(dst.PixelData, stack[slice_i].tostring())
+                uids.add(dst.SOPInstanceUID)
+            self.assertEqual(len(uids), 12)
+            shutil.rmtree(output)
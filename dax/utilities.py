@@ -1,5 +1,8 @@
+from past.builtins import basestring
+
 import itertools as it
 import json
+import os
 import HTMLParser
 import smtplib
 from email.mime.text import MIMEText
@@ -128,3 +131,23 @@ def send_email(smtp_from, smtp_host, smtp_pass, to_addr, subject, content):
     smtp.login(smtp_from, smtp_pass)
     smtp.sendmail(smtp_from, to_addr, msg.as_string())
     smtp.quit()
+
+
+def get_disk_size(paths):
+    """
+    Get the size of files and folders on disk
+
+    :param paths: path or list of paths to files or folders
+    :return: size in bytes
+    """
+    if isinstance(paths, basestring):
+        paths = [paths]
+    size = 0
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, filenames in os.walk(path):
+                size += sum(os.path.getsize(os.path.join(root, filename))
+                            for filename in filenames)
+        elif os.path.isfile(path):
+            size += os.path.getsize(path)
+    return size
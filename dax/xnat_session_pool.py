@@ -0,0 +1,200 @@
+""" xnat_session_pool.py: HTTP sessions to XNAT shared by the interfaces """
+
+from builtins import object
+
+import atexit
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .dax_settings import DAX_Settings
+
+
+__copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
+__all__ = ['XnatSessionPool', 'get_session_pool']
+DAX_SETTINGS = DAX_Settings()
+LOGGER = logging.getLogger('dax')
+JSESSION_URI = '/data/JSESSION'
+
+_SESSION_POOL = None
+_SESSION_POOL_LOADED = False
+
+
+class XnatSessionPool(object):
+    """
+    Keep-alive HTTP sessions to XNAT shared by the InterfaceTemp objects
+
+    One requests.Session is kept per host and user for the life of the
+    process, so the interfaces opened by get_interface reuse the JSESSION
+    and the pooled connections instead of logging in each time. The number of
+    connections to a host is capped: a request waits for a free connection
+    when they are all in use. A request rejected with 401 (e.g. expired
+    JSESSION) is sent again once after logging in again, one login at a time.
+    """
+    def __init__(self, max_connections):
+        """
+        Entry point for the XnatSessionPool class
+
+        :param max_connections: maximum number of connections opened to a
+         host by a session
+        :return: None
+        """
+        self.max_connections = max_connections
+        self.sessions = dict()
+        self.lock = threading.Lock()
+        self.login_lock = threading.Lock()
+        self.pid = os.getpid()
+        self.sessions_opened = 0
+        self.sessions_reused = 0
+        self.reauthentications = 0
+
+    def get_session(self, host, user, pwd, verify=None, proxy_url=None):
+        """
+        Get the session for a host and user, create it if needed
+
+        :param host: XNAT host url
+        :param user: XNAT user
+        :param pwd: XNAT password
+        :param verify: requests verify option, None for requests default
+        :param proxy_url: parsed url of the http proxy, None for no proxy
+        :return: tuple (requests.Session, True if the session was reused)
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                # Connections can't be shared with the parent process
+                self.sessions = dict()
+                self.pid = os.getpid()
+
+            key = (host, user)
+            session = self.sessions.get(key)
+            if session is not None:
+                self.sessions_reused += 1
+                return session, True
+
+            session = self._new_session(host, user, pwd, verify, proxy_url)
+            self.sessions[key] = session
+            self.sessions_opened += 1
+            return session, False
+
+    def _new_session(self, host, user, pwd, verify, proxy_url):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.max_connections,
+                              pool_block=True)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if verify is not None:
+            session.verify = verify
+        session.auth = (user, pwd)
+        if proxy_url:
+            session.proxies = {'http': proxy_url.geturl()}
+        # JSESSION ID once logged in, see InterfaceTemp.authenticate
+        session.dax_jsession = None
+        session.hooks['response'].append(
+            self._reauthenticate_hook(session, host))
+        return session
+
+    def _reauthenticate_hook(self, session, host):
+        login_url = host.rstrip('/') + JSESSION_URI
+
+        def reauthenticate(response, *args, **kwargs):
+            request = response.request
+            if response.status_code != 401 or \
+               getattr(request, 'dax_retried', False) or \
+               request.url.split('?')[0] == login_url or \
+               not isinstance(request.body, (type(None), bytes, str)):
+                # Logins are not retried, streamed bodies can't be sent again
+                return response
+
+            # Release the connection before logging in
+            response.content
+            with self.login_lock:
+                jsession = session.dax_jsession
+                if not jsession or 'JSESSIONID=%s' % jsession in \
+                        request.headers.get('Cookie', ''):
+                    LOGGER.debug('XNAT session expired on %s, logging in '
+                                 'again' % request.url)
+                    self.reauthentications += 1
+                    session.cookies.clear()
+                    login_request = session.prepare_request(
+                        requests.Request('GET', login_url))
+                    login_request.dax_retried = True
+                    login = session.send(login_request, **kwargs)
+                    if not login.ok:
+                        return response
+                    session.dax_jsession = login.content
+
+            retry = request.copy()
+            retry.dax_retried = True
+            retry.headers.pop('Cookie', None)
+            retry.prepare_cookies(session.cookies)
+            return session.send(retry, **kwargs)
+        return reauthenticate
+
+    def stats(self):
+        """
+        Get the counters of the sessions and connections
+
+        connections_reused is the number of requests that did not need to
+        open a new connection.
+
+        :return: dictionary of counters
+        """
+        opened = 0
+        requests_sent = 0
+        for session in list(self.sessions.values()):
+            for adapter in set(session.adapters.values()):
+                for key in adapter.poolmanager.pools.keys():
+                    pool = adapter.poolmanager.pools.get(key)
+                    if pool is None:
+                        continue
+                    opened += pool.num_connections
+                    requests_sent += pool.num_requests
+        return {'sessions_opened': self.sessions_opened,
+                'sessions_reused': self.sessions_reused,
+                'reauthentications': self.reauthentications,
+                'connections_opened': opened,
+                'connections_reused': max(0, requests_sent - opened)}
+
+    def close(self):
+        """
+        Disconnect the JSESSIONs and close the connections
+
+        :return: None
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            for (host, _), session in self.sessions.items():
+                try:
+                    if session.dax_jsession:
+                        session.delete(host.rstrip('/') + JSESSION_URI)
+                except requests.RequestException as err:
+                    LOGGER.debug('failed to disconnect from %s: %s'
+                                 % (host, err))
+                session.close()
+            if self.sessions:
+                LOGGER.debug('XNAT sessions: %s' % self.stats())
+            self.sessions = dict()
+
+
+def get_session_pool():
+    """
+    Get the XNAT session pool set in dax_settings.ini
+
+    The pool is disabled when xnat_max_connections is 0 (default): each
+    interface then logs in and out of XNAT with its own connection.
+
+    :return: XnatSessionPool object or None if disabled
+    """
+    global _SESSION_POOL, _SESSION_POOL_LOADED
+    if not _SESSION_POOL_LOADED:
+        _SESSION_POOL_LOADED = True
+        max_connections = DAX_SETTINGS.get_xnat_max_connections()
+        if max_connections > 0:
+            _SESSION_POOL = XnatSessionPool(max_connections)
+            atexit.register(_SESSION_POOL.close)
+    return _SESSION_POOL
@@ -116,7 +116,7 @@ VERSION = get_version()
 # versions
 SPHINX_MIN_VERSION = '1.4'
 NIBABEL_MIN_VERSION = '2.0.1'
-NUMPY_MIN_VERSION = '1.6.2'
+NUMPY_MIN_VERSION = '1.12.0'
 MATPLOTLIB_MIN_VERSION = '1.4.3'
 PYXNAT_VERSION = '1.0.1.0'
 PYDICOM_MIN_VERSION = '1.0.0'
@@ -135,6 +135,7 @@ REQUIRES = [
     'pillow',
     'pydicom>=%s' % PYDICOM_MIN_VERSION,
     'httplib2',
+    'requests',
     'future',
     'configparser'
 ]